@@ -0,0 +1,197 @@
+"""Prioritized queue for Discord REST actions, aware of rate-limit buckets.
+
+Discord rate-limits each route per resource: edits of one channel share a
+bucket, messages in one channel share another and role changes in a guild
+share a third. Queued actions run one at a time per bucket, with at most
+``max_concurrency`` calls in flight across the bot. Background actions
+(archiving, role cleanup) are held back while a command is being handled,
+for at most ``max_defer`` seconds, so interactive replies go first.
+
+Edits of the same channel that have not started yet are merged into one
+``channel.edit`` call; later fields override earlier ones. When discord.py
+gives up on a long rate limit (``discord.RateLimited``, raised past the
+client's ``max_ratelimit_timeout``) the bucket is paused for
+``retry_after`` seconds and the action is retried instead of failing.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+
+import discord
+
+import metrics
+
+INTERACTIVE = 0
+BACKGROUND = 1
+MAX_RETRIES = 3
+
+
+def channel_bucket(channel):
+    return f"channel:{channel.id}"
+
+
+def messages_bucket(channel):
+    return f"messages:{channel.id}"
+
+
+def roles_bucket(guild):
+    return f"roles:{guild.id}"
+
+
+class _Action:
+    def __init__(self, bucket, label, call, priority):
+        self.bucket = bucket
+        self.label = label
+        self.call = call  # async () -> result; called again on retry
+        self.priority = priority
+        self.queued_at = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+        self.started = False
+        self.retries = 0
+        self.channel_id = None  # Set, with the merged fields, for channel edits
+        self.fields = None
+
+
+class ActionQueue:
+    def __init__(self, max_concurrency=2, max_defer=5.0):
+        self.max_concurrency = max_concurrency
+        self.max_defer = max_defer
+        self._heap = []  # (priority, seq, action); an action may appear twice after a priority raise
+        self._counter = itertools.count()
+        self._edits = {}  # channel_id -> merged edit that has not started
+        self._busy = set()  # buckets with a call in flight
+        self._paused = {}  # bucket -> monotonic time its rate limit resets
+        self._running = set()
+        self._futures = set()
+        self._interactive = 0
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def _push(self, action):
+        heapq.heappush(self._heap, (action.priority, next(self._counter), action))
+        self._wakeup.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def _enqueue(self, action):
+        self._futures.add(action.future)
+        action.future.add_done_callback(self._forget)
+        self._push(action)
+        return action.future
+
+    def submit(self, bucket, call, priority=BACKGROUND, label="action"):
+        """Queue ``call`` (an async function without arguments); returns a future for its result."""
+        return self._enqueue(_Action(bucket, label, call, priority))
+
+    def edit_channel(self, channel, priority=BACKGROUND, **fields):
+        """Queue ``channel.edit(**fields)``, merged into a pending edit of the same channel."""
+        action = self._edits.get(channel.id)
+        if action is None:
+            merged = {}
+            action = _Action(channel_bucket(channel), f"edit #{channel.name}", lambda: channel.edit(**merged), priority)
+            action.channel_id = channel.id
+            action.fields = merged
+            self._edits[channel.id] = action
+            self._enqueue(action)
+        elif priority < action.priority:
+            action.priority = priority
+            self._push(action)
+        action.fields.update(fields)
+        return action.future
+
+    def send(self, channel, priority=BACKGROUND, **kwargs):
+        return self.submit(messages_bucket(channel), lambda: channel.send(**kwargs), priority,
+                           label=f"send to #{channel.name}")
+
+    def _forget(self, future):
+        self._futures.discard(future)
+        if not future.cancelled():
+            future.exception()  # Failures are already logged by the queue
+
+    def begin_interactive(self):
+        self._interactive += 1
+
+    def end_interactive(self):
+        self._interactive = max(0, self._interactive - 1)
+        self._wakeup.set()
+
+    def _dispatch(self):
+        """Start every action that may run now; returns seconds until one may become runnable."""
+        now = time.monotonic()
+        delay = None
+        skipped = []
+        while self._heap and len(self._running) < self.max_concurrency:
+            entry = heapq.heappop(self._heap)
+            action = entry[2]
+            if action.started or action.future.done():
+                continue
+            wait = self._paused.get(action.bucket, 0) - now
+            if action.priority == BACKGROUND and self._interactive:
+                wait = max(wait, action.queued_at + self.max_defer - now)
+            if action.bucket in self._busy or wait > 0:
+                skipped.append(entry)
+                if wait > 0:
+                    delay = wait if delay is None else min(delay, wait)
+                continue
+            self._start(action)
+        for entry in skipped:
+            heapq.heappush(self._heap, entry)
+        return delay
+
+    def _start(self, action):
+        action.started = True
+        if action.channel_id is not None and self._edits.get(action.channel_id) is action:
+            del self._edits[action.channel_id]  # Later edits start a new call
+        self._busy.add(action.bucket)
+        task = asyncio.create_task(self._execute(action))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _execute(self, action):
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            result = await action.call()
+        except discord.RateLimited as e:
+            status = "rate_limited"
+            self._paused[action.bucket] = time.monotonic() + e.retry_after
+            if action.retries < MAX_RETRIES:
+                print(f"Discord action '{action.label}' rate limited, retrying in {e.retry_after:.0f}s")
+                action.retries += 1
+                action.started = False
+                self._push(action)
+            else:
+                print(f"Discord action '{action.label}' failed: {e}")
+                action.future.set_exception(e)
+        except Exception as e:
+            status = "error"
+            print(f"Discord action '{action.label}' failed: {e}")
+            action.future.set_exception(e)
+        else:
+            action.future.set_result(result)
+        finally:
+            metrics.DISCORD_LATENCY.observe(time.perf_counter() - start, bucket=action.bucket.split(":")[0], status=status)
+            self._busy.discard(action.bucket)
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            delay = self._dispatch()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def drain(self):
+        """Wait for every queued action, then stop the dispatcher."""
+        while self._futures:
+            await asyncio.gather(*self._futures, return_exceptions=True)
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
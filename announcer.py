@@ -0,0 +1,34 @@
+"""Background fan-out of Discord side effects after a command has replied.
+
+A command sends its acknowledgement itself and hands everything else
+(announcements in other channels, role changes, DMs, scoreboard refreshes)
+to ``Announcer.fan_out``. The side effects run concurrently as background
+tasks, at most ``max_concurrency`` at a time across the bot. A failure is
+logged with its label and does not affect the others.
+"""
+import asyncio
+
+
+class Announcer:
+    def __init__(self, max_concurrency=4):
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._tasks = set()
+
+    def fan_out(self, **effects):
+        """Start each ``label=coroutine`` side effect in the background."""
+        for label, coro in effects.items():
+            task = asyncio.create_task(self._run(label, coro))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, label, coro):
+        async with self._semaphore:
+            try:
+                await coro
+            except Exception as e:
+                print(f"Side effect '{label}' failed: {e}")
+
+    async def drain(self):
+        """Wait for every side effect already started."""
+        while self._tasks:
+            await asyncio.gather(*self._tasks)
@@ -0,0 +1,457 @@
+"""End-to-end load benchmark for the bot's command handlers.
+
+Drives the real command callbacks (``!add``, ``!unsolve``, ``!profile``,
+``!scoreboard``, ``!solved``), the reaction handlers and the CTFtime team
+stats update against a synthetic database, with fake Discord objects in
+place of the gateway and a local stub server in place of ctftime.org.
+Each workload runs as its own phase, with many players issuing commands
+concurrently, and reports throughput, p50/p99 latency and the number of
+SQL statements, Discord calls and CTFtime requests it caused.
+
+    python bench.py --players 50 --solves 5000 --ops 500
+    python bench.py --save baseline.json
+    python bench.py --compare baseline.json   # exits 1 on a regression
+
+Nothing here talks to Discord or ctftime.org, and the database is a
+temporary file.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from aiohttp import web
+
+GUILD_ID = 1000
+SCOREBOARD_CHANNEL_ID = 2001
+FIRSTBLOOD_CHANNEL_ID = 2002
+COMMANDS_CHANNEL_ID = 2003
+CTFTIME_TEAM_CHANNEL_ID = 2004
+TEAM_ID = 303159
+EVENT_ID = "9001"
+ANNOUNCE_MESSAGE_ID = 3001
+CTF_ROLE_ID = 4001
+FIRST_USER_ID = 100000000000000000
+
+CATEGORIES = ["pwn", "reverse", "dfir", "web", "crypto", "misc", "blockchain", "osint", "android", "ppc"]
+DIFFICULTIES = ["easy", "medium", "hard"]
+PHASES = ["add", "profile", "scoreboard", "solved", "reaction_add", "reaction_remove", "unsolve", "team_stats", "mixed"]
+
+# Discord calls made through the fakes, by method
+discord_calls = Counter()
+
+
+class FakeDiscord:
+    latency = 0.0  # Seconds each fake REST call takes
+
+    @classmethod
+    async def call(cls, method):
+        discord_calls[method] += 1
+        if cls.latency:
+            await asyncio.sleep(cls.latency)
+
+
+class FakeAsset:
+    url = "https://cdn.discordapp.com/embed/avatars/0.png"
+
+
+class FakeRole:
+    def __init__(self, role_id, name):
+        self.id = role_id
+        self.name = name
+        self.mention = f"<@&{role_id}>"
+        self.color = None
+
+    async def delete(self, reason=None):
+        await FakeDiscord.call("role.delete")
+
+
+class FakeAttachment:
+    def __init__(self, filename):
+        self.filename = filename
+        # Signed CDN URLs carry their expiry as hex in ``ex``
+        self.url = f"https://cdn.discordapp.com/attachments/1/2/{filename}?ex={int(time.time()) + 86400:x}"
+
+
+class FakeMessage:
+    _next_id = 5000
+
+    def __init__(self, channel, filename=None):
+        FakeMessage._next_id += 1
+        self.id = FakeMessage._next_id
+        self.channel = channel
+        self.attachments = [FakeAttachment(filename)] if filename else []
+
+    async def edit(self, **kwargs):
+        await FakeDiscord.call("message.edit")
+        return self
+
+
+class FakeChannel:
+    def __init__(self, guild, channel_id, name):
+        self.guild = guild
+        self.id = channel_id
+        self.name = name
+        self.mention = f"<#{channel_id}>"
+        self.category_id = None
+        self._messages = {}
+
+    async def send(self, content=None, **kwargs):
+        await FakeDiscord.call("channel.send")
+        file = kwargs.get("file")
+        message = FakeMessage(self, file.filename if file else None)
+        self._messages[message.id] = message
+        return message
+
+    async def fetch_message(self, message_id):
+        await FakeDiscord.call("channel.fetch_message")
+        return self._messages.get(message_id) or FakeMessage(self)
+
+
+class FakeMember:
+    bot = False
+
+    def __init__(self, guild, user_id):
+        self.guild = guild
+        self.id = user_id
+        self.name = self.display_name = f"player{user_id - FIRST_USER_ID}"
+        self.mention = f"<@{user_id}>"
+        self.display_avatar = FakeAsset()
+        self.roles = []
+        self.guild_permissions = type("Permissions", (), {"administrator": True})()
+
+    async def add_roles(self, *roles, reason=None):
+        await FakeDiscord.call("member.add_roles")
+        self.roles.extend(role for role in roles if role not in self.roles)
+
+    async def remove_roles(self, *roles, reason=None):
+        await FakeDiscord.call("member.remove_roles")
+        self.roles = [role for role in self.roles if role not in roles]
+
+    async def send(self, content=None, **kwargs):
+        await FakeDiscord.call("member.send")
+
+
+class FakeGuild:
+    def __init__(self, guild_id, players):
+        self.id = guild_id
+        self.name = "Benchmark"
+        self.default_role = FakeRole(guild_id, "@everyone")
+        self.roles = [self.default_role, FakeRole(CTF_ROLE_ID, "bench-ctf")]
+        self.channels = {channel_id: FakeChannel(self, channel_id, name) for channel_id, name in [
+            (SCOREBOARD_CHANNEL_ID, "scoreboard"), (FIRSTBLOOD_CHANNEL_ID, "first-bloods"),
+            (COMMANDS_CHANNEL_ID, "general"), (CTFTIME_TEAM_CHANNEL_ID, "ctftime")]}
+        self.members = {FIRST_USER_ID + i: FakeMember(self, FIRST_USER_ID + i) for i in range(players)}
+        self.me = self.members[FIRST_USER_ID]
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    def get_member(self, user_id):
+        return self.members.get(user_id)
+
+    def get_role(self, role_id):
+        return next((role for role in self.roles if role.id == role_id), None)
+
+    async def create_role(self, name, **kwargs):
+        await FakeDiscord.call("guild.create_role")
+        role = FakeRole(len(self.roles) + 1, name)
+        self.roles.append(role)
+        return role
+
+
+class FakeContext:
+    def __init__(self, guild, author, command):
+        self.guild = guild
+        self.author = author
+        self.channel = guild.channels[COMMANDS_CHANNEL_ID]
+        self.command = command
+        self.message = None
+        self.command_failed = False
+
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+
+class FakePayload:
+    def __init__(self, user_id):
+        self.emoji = type("Emoji", (), {"name": "🔥"})()
+        self.message_id = ANNOUNCE_MESSAGE_ID
+        self.guild_id = GUILD_ID
+        self.user_id = user_id
+
+
+class StubCTFtime:
+    """A local stand-in for the CTFtime API that counts its requests."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = 0
+        self.url = None
+        self._runner = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/api/v1/teams/{team_id}/", self._team)
+        app.router.add_get("/api/v1/events/", self._events)
+        app.router.add_get("/api/v1/events/{event_id}/", self._event)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", 0).start()
+        port = self._runner.addresses[0][1]
+        self.url = f"http://127.0.0.1:{port}/api/v1"
+
+    async def close(self):
+        await self._runner.cleanup()
+
+    async def _respond(self, data):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.json_response(data)
+
+    async def _team(self, request):
+        return await self._respond({
+            "id": int(request.match_info["team_id"]), "name": "Benchmark Team", "country": "US",
+            "rating": {"2025": {"rating_place": 42, "rating_points": 123.4, "country_place": 3}},
+        })
+
+    def _event_data(self, event_id):
+        return {"id": event_id, "title": f"Bench CTF {event_id}", "weight": 25.0, "format": "Jeopardy",
+                "start": "2030-01-01T00:00:00+00:00", "finish": "2030-01-03T00:00:00+00:00",
+                "url": "https://example.com", "logo": "", "onsite": False, "participants": 100}
+
+    async def _events(self, request):
+        return await self._respond([self._event_data(9000 + i) for i in range(10)])
+
+    async def _event(self, request):
+        return await self._respond(self._event_data(int(request.match_info["event_id"])))
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def synthetic_solves(players, solves, seed):
+    rng = random.Random(seed)
+    rows = []
+    for i in range(solves):
+        uid = FIRST_USER_ID + rng.randrange(players)
+        category = rng.choice(CATEGORIES)
+        rows.append((f"seed-{category}-{i}", category, rng.choice(DIFFICULTIES), int(rng.random() < 0.1),
+                     str(uid), f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} 12:00:00"))
+    participation = [(str(FIRST_USER_ID + rng.randrange(players)), str(event)) for event in range(100, 120)
+                     for _ in range(players // 2)]
+    return rows, participation
+
+
+async def seed_database(main, db, args):
+    await db.init()
+    solves, participation = synthetic_solves(args.players, args.solves, args.seed)
+    await db.bulk_import(GUILD_ID, solves, participation, main.scoring_config.get(GUILD_ID))
+    for key, value in [("scoreboard_channel", SCOREBOARD_CHANNEL_ID), ("firstblood_channel", FIRSTBLOOD_CHANNEL_ID),
+                       ("ctftime_team_channel", CTFTIME_TEAM_CHANNEL_ID), ("ctftime_team_id", TEAM_ID)]:
+        await db.set_guild_config(GUILD_ID, key, value)
+    await db.close()
+
+
+class Workloads:
+    """One coroutine factory per phase; each call performs a single operation."""
+
+    def __init__(self, main, guild, seed):
+        self.main = main
+        self.guild = guild
+        self.rng = random.Random(seed)
+        self.players = list(guild.members.values())
+        self.added = []  # (member, challenge) pairs recorded by the add phase
+        self._counter = 0
+
+    def _ctx(self, command, member=None):
+        return FakeContext(self.guild, member or self.rng.choice(self.players), command)
+
+    async def add(self):
+        self._counter += 1
+        ctx = self._ctx(self.main.add)
+        name = f"bench-{self._counter}"
+        await self.main.add.callback(ctx, self.rng.choice(CATEGORIES), name, self.rng.choice(DIFFICULTIES),
+                                     int(self.rng.random() < 0.1))
+        self.added.append((ctx.author, name))
+
+    async def unsolve(self):
+        if not self.added:
+            return
+        member, name = self.added.pop()
+        await self.main.unsolve.callback(self._ctx(self.main.unsolve, member), name)
+
+    async def profile(self):
+        await self.main.profile.callback(self._ctx(self.main.profile), None)
+
+    async def scoreboard(self):
+        await self.main.scoreboard.callback(self._ctx(self.main.scoreboard), self.main.SCOREBOARD_SIZE)
+
+    async def solved(self):
+        await self.main.solved.callback(self._ctx(self.main.solved), f"category:{self.rng.choice(CATEGORIES)}")
+
+    async def reaction_add(self):
+        await self.main.on_raw_reaction_add(FakePayload(self.rng.choice(self.players).id))
+
+    async def reaction_remove(self):
+        await self.main.on_raw_reaction_remove(FakePayload(self.rng.choice(self.players).id))
+
+    async def team_stats(self):
+        await self.main.update_guild_ctftime_team_stats(self.guild, TEAM_ID)
+
+    async def mixed(self):
+        # The first hour of a CTF: mostly solves and profile checks
+        op = self.rng.choices([self.add, self.profile, self.scoreboard, self.solved], weights=[5, 3, 1, 1])[0]
+        await op()
+
+
+async def settle(main):
+    """Wait for side effects a phase started, so they are counted in it."""
+    await main.announcer.drain()
+    for publisher in main.scoreboard_publishers.values():
+        await publisher.drain()
+    await main.actions.drain()
+
+
+async def run_phase(main, metrics, stub, operation, ops, concurrency):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    queries, discord, ctftime_requests = metrics.DB_QUERIES.total(), sum(discord_calls.values()), stub.requests
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            await operation()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(ops)))
+    elapsed = time.perf_counter() - start
+    await settle(main)
+    return {
+        "ops": ops,
+        "throughput": ops / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "queries_per_op": (metrics.DB_QUERIES.total() - queries) / ops,
+        "discord_per_op": (sum(discord_calls.values()) - discord) / ops,
+        "ctftime_requests": stub.requests - ctftime_requests,
+    }
+
+
+def print_results(results):
+    print(f"{'phase':<16}{'ops/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'sql/op':>9}{'discord/op':>12}{'ctftime':>9}")
+    for phase, r in results.items():
+        print(f"{phase:<16}{r['throughput']:>10.1f}{r['p50_ms']:>10.2f}{r['p99_ms']:>10.2f}"
+              f"{r['queries_per_op']:>9.1f}{r['discord_per_op']:>12.1f}{r['ctftime_requests']:>9}")
+
+
+def compare(results, baseline, tolerance):
+    """Return the regressions of ``results`` against ``baseline`` beyond ``tolerance``."""
+    regressions = []
+    for phase, r in results.items():
+        base = baseline.get(phase)
+        if not base:
+            continue
+        if r["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(f"{phase}: throughput {r['throughput']:.1f} < {base['throughput']:.1f} ops/s")
+        if r["p99_ms"] > base["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{phase}: p99 {r['p99_ms']:.2f} > {base['p99_ms']:.2f} ms")
+        for key in ("queries_per_op", "discord_per_op", "ctftime_requests"):
+            if r[key] > base[key] * (1 + tolerance) + 0.05:
+                regressions.append(f"{phase}: {key} {r[key]:.2f} > {base[key]:.2f}")
+    return regressions
+
+
+async def run(args):
+    """Run the benchmark on a database in a temporary directory, removed afterwards unless ``--keep``."""
+    workdir = tempfile.mkdtemp(prefix="lain-bench-")
+    try:
+        return await run_in(args, workdir)
+    finally:
+        if args.keep:
+            print(f"Kept the benchmark database in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+async def run_in(args, workdir):
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))  # The images are loaded from here
+    os.environ["DB_PATH"] = os.path.join(workdir, "bench.db")
+    os.environ["METRICS_PORT"] = "0"
+    os.environ.pop("TOKEN", None)  # Importing main must not start the bot
+    stub = StubCTFtime(args.ctftime_latency)
+    await stub.start()
+    os.environ["CTFTIME_API_URL"] = stub.url
+    import db
+    import main
+    import metrics
+
+    FakeDiscord.latency = args.discord_latency
+    main.SCOREBOARD_UPDATE_WINDOW = args.scoreboard_window
+    guild = FakeGuild(GUILD_ID, args.players)
+    # The gateway cache, as the command handlers see it
+    main.client.get_guild = lambda guild_id: guild if guild_id == GUILD_ID else None
+    main.client.get_user = guild.get_member
+    main.client.get_channel = lambda channel_id: guild.get_channel(channel_id)
+
+    await seed_database(main, db, args)
+    await main.client.setup_hook()
+    await main.ctf_events.update(GUILD_ID, EVENT_ID, title="bench-ctf", announce_message_id=ANNOUNCE_MESSAGE_ID,
+                                 role_id=CTF_ROLE_ID)
+    print(f"Seeded {args.solves} solves for {args.players} players; {args.ops} operations per phase, "
+          f"{args.concurrency} concurrent\n")
+
+    workloads = Workloads(main, guild, args.seed)
+    results = {}
+    for phase in args.phases:
+        results[phase] = await run_phase(main, metrics, stub, getattr(workloads, phase), args.ops, args.concurrency)
+    await main.client.stop_services()
+    await stub.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--players", type=int, default=50)
+    parser.add_argument("--solves", type=int, default=5000, help="Solves in the synthetic database")
+    parser.add_argument("--ops", type=int, default=500, help="Operations per phase")
+    parser.add_argument("--concurrency", type=int, default=50, help="Operations in flight at once")
+    parser.add_argument("--phases", nargs="+", choices=PHASES, default=PHASES)
+    parser.add_argument("--discord-latency", type=float, default=0.0, help="Seconds per fake Discord call")
+    parser.add_argument("--ctftime-latency", type=float, default=0.0, help="Seconds per stub CTFtime response")
+    parser.add_argument("--scoreboard-window", type=float, default=0.5, help="Seconds between scoreboard edits")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Baseline JSON file; exit 1 if a phase regressed")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative regression")
+    parser.add_argument("--keep", action="store_true", help="Keep the benchmark database for inspection")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print()
+    print_results(results)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print("\nNo regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Bulk import and streaming export of solves and CTF participation.
+
+Imports accept CSV (with a header row) or JSON Lines. A record with an
+``event_id`` is a participation record (``user_id``, ``event_id``); any
+other record is a solve (``challenge_name``, ``category``, ``difficulty``,
+``user_id`` and optionally ``first_blood`` and an ISO 8601 ``timestamp``),
+validated with the same rules as ``!add``. Exports write the same columns, so an
+export can be imported into another database unchanged.
+"""
+import csv
+import io
+import json
+import os
+import tempfile
+from datetime import datetime
+
+SOLVE_COLUMNS = ("challenge_name", "category", "difficulty", "first_blood", "user_id", "timestamp")
+PARTICIPATION_COLUMNS = ("user_id", "event_id")
+EXPORT_TABLES = {
+    "solves": ("solved_challenges", SOLVE_COLUMNS),
+    "participation": ("ctf_participation", PARTICIPATION_COLUMNS),
+}
+
+
+def read_records(filename, data):
+    """Yield (line number, record dict) from CSV or JSONL bytes."""
+    text = data.decode("utf-8-sig")
+    if filename.lower().endswith((".jsonl", ".ndjson", ".json")):
+        for line_no, line in enumerate(text.splitlines(), 1):
+            if line.strip():
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    raise ValueError(f"line {line_no}: invalid JSON ({e})")
+                if not isinstance(record, dict):
+                    raise ValueError(f"line {line_no}: expected a JSON object")
+                yield line_no, record
+    else:
+        for line_no, record in enumerate(csv.DictReader(io.StringIO(text)), 2):
+            yield line_no, record
+
+
+def parse_import(filename, data, allowed_categories, allowed_difficulties):
+    """Validate an import file; returns (solves, participation, errors)."""
+    solves, participation, errors = [], [], []
+    now = datetime.now().isoformat(" ")
+    for line_no, record in read_records(filename, data):
+        record = {str(k).strip().lower(): str(v).strip() for k, v in record.items() if k is not None and v is not None}
+        user_id = record.get("user_id", "")
+        if not user_id.isdigit():
+            errors.append(f"line {line_no}: invalid user_id `{user_id}`")
+            continue
+        if record.get("event_id"):
+            participation.append((user_id, record["event_id"]))
+            continue
+        name = record.get("challenge_name", "")
+        category = record.get("category", "").lower()
+        difficulty = record.get("difficulty", "").lower()
+        first_blood = record.get("first_blood") or "0"
+        if not name:
+            errors.append(f"line {line_no}: missing challenge_name")
+        elif category not in allowed_categories:
+            errors.append(f"line {line_no}: invalid category `{category}`")
+        elif difficulty not in allowed_difficulties:
+            errors.append(f"line {line_no}: invalid difficulty `{difficulty}`")
+        elif first_blood not in ("0", "1"):
+            errors.append(f"line {line_no}: first_blood must be 0 or 1")
+        elif (timestamp := parse_timestamp(record.get("timestamp"))) is None:
+            errors.append(f"line {line_no}: invalid timestamp `{record['timestamp']}`, expected ISO 8601")
+        else:
+            solves.append((name, category, difficulty, int(first_blood), user_id, timestamp or now))
+    return solves, participation, errors
+
+
+def parse_timestamp(value):
+    """Normalize an imported timestamp to local ``YYYY-MM-DD HH:MM:SS``.
+
+    Returns "" for a missing value and None for one that is not ISO 8601.
+    Timestamps with a UTC offset are converted to local time and fractions
+    of a second are dropped.
+    """
+    if not value:
+        return ""
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed.strftime("%Y-%m-%d %H:%M:%S")
+
+
+async def export_to_file(rows, columns, fmt):
+    """Write an async iterator of row batches to a temporary file and return its path.
+
+    Rows are written batch by batch, so memory use does not grow with the
+    table size. The caller deletes the file.
+    """
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}")
+    with os.fdopen(fd, "w", newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            async for batch in rows:
+                writer.writerows(batch)
+        else:
+            async for batch in rows:
+                f.writelines(json.dumps(dict(zip(columns, row))) + "\n" for row in batch)
+    return path
@@ -0,0 +1,64 @@
+"""In-memory index over the ``ctf_events`` table.
+
+Every tracked CTF is loaded once at startup and kept in dicts keyed by
+(guild ID, event ID) and by announcement message ID, so a reaction on any message can
+be matched to its CTF (or dropped) without touching the database. All
+changes go through ``CTFEventIndex`` so the table and the index never
+disagree.
+"""
+import db
+
+
+class CTFEvent:
+    __slots__ = ("guild_id", "event_id", "title", "announce_message_id", "channel_id", "role_id")
+
+    def __init__(self, guild_id, event_id, title=None, announce_message_id=None, channel_id=None, role_id=None):
+        self.guild_id = str(guild_id)
+        self.event_id = str(event_id)
+        self.title = title
+        self.announce_message_id = announce_message_id
+        self.channel_id = channel_id
+        self.role_id = role_id
+
+
+class CTFEventIndex:
+    def __init__(self):
+        self._by_event = {}
+        self._by_message = {}
+
+    async def load(self):
+        self._by_event.clear()
+        self._by_message.clear()
+        for row in await db.get_ctf_events():
+            event = CTFEvent(*row)
+            self._by_event[event.guild_id, event.event_id] = event
+            if event.announce_message_id:
+                self._by_message[event.announce_message_id] = event
+
+    def __iter__(self):
+        return iter(list(self._by_event.values()))
+
+    def get(self, guild_id, event_id):
+        return self._by_event.get((str(guild_id), str(event_id)))
+
+    def for_message(self, message_id):
+        return self._by_message.get(message_id)
+
+    def is_announced(self, guild_id, event_id):
+        event = self.get(guild_id, event_id)
+        return event is not None and event.announce_message_id is not None
+
+    async def update(self, guild_id, event_id, **fields):
+        """Persist column changes for a guild's event and apply them to the index."""
+        await db.update_ctf_event(guild_id, event_id, **fields)
+        key = (str(guild_id), str(event_id))
+        event = self._by_event.get(key)
+        if event is None:
+            event = self._by_event[key] = CTFEvent(*key)
+        if "announce_message_id" in fields and event.announce_message_id:
+            self._by_message.pop(event.announce_message_id, None)
+        for name, value in fields.items():
+            setattr(event, name, value)
+        if event.announce_message_id:
+            self._by_message[event.announce_message_id] = event
+        return event
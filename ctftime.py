@@ -0,0 +1,302 @@
+"""Async client for the CTFtime API.
+
+All CTFtime traffic goes through one ``CTFtimeClient`` holding a single
+keep-alive ``aiohttp`` session. Requests are bounded by a timeout and a
+concurrency limit, retried with exponential backoff, and short-circuited
+by a breaker while ctftime.org is failing so that callers get an error
+immediately instead of piling up on a dead host.
+
+Responses can be kept in a ``ResponseCache`` stored in the bot database.
+Each endpoint has a freshness TTL and a longer stale window: fresh hits
+never touch the network, stale hits are served at once while a background
+request revalidates them with ``If-None-Match``/``If-Modified-Since``, and
+a stale copy is also served when CTFtime is unreachable. Concurrent misses
+and revalidations of one URL share a single request.
+
+Point ``CTFTIME_API_URL`` at a local server to run the bot against a
+stand-in API.
+"""
+import asyncio
+import json
+import os
+import random
+import re
+import time
+from urllib.parse import urlencode
+
+import aiohttp
+
+import db
+import metrics
+
+CTFTIME_API_URL = os.getenv("CTFTIME_API_URL", "https://ctftime.org/api/v1")
+USER_AGENT = "Lain-Agent (+https://github.com/0xla1n/Lain-Agent)"
+
+
+class CTFtimeError(Exception):
+    """A CTFtime request failed; ``status`` holds the HTTP status if there was one."""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class CircuitOpenError(CTFtimeError):
+    """Raised without touching the network while the breaker is open."""
+
+
+class CircuitBreaker:
+    """Closed -> open after ``failure_threshold`` consecutive failures.
+
+    After ``reset_timeout`` seconds one trial request is let through
+    (half-open); its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._trial_in_flight or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self._trial_in_flight = False
+
+    def release(self):
+        """End a trial request that neither succeeded nor failed, such as a cancelled one."""
+        self._trial_in_flight = False
+
+
+# (path pattern, fresh seconds, additional stale seconds)
+DEFAULT_TTLS = [
+    (r"^teams/\d+/$", 3600, 24 * 3600),
+    (r"^events/\d+/$", 1800, 24 * 3600),
+    (r"^events/$", 900, 3600),
+]
+
+
+class ResponseCache:
+    """TTL/ETag cache for CTFtime responses, persisted in the ``http_cache`` table."""
+
+    def __init__(self, ttls=DEFAULT_TTLS, default_ttl=600, default_stale=3600, max_bytes=5 * 1024 * 1024):
+        self.ttls = [(re.compile(pattern), fresh, stale) for pattern, fresh, stale in ttls]
+        self.default_ttl = default_ttl
+        self.default_stale = default_stale
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(path, params=None):
+        path = path.lstrip("/")
+        return f"{path}?{urlencode(sorted(params.items()))}" if params else path
+
+    def lifetime(self, path):
+        path = path.lstrip("/")
+        for pattern, fresh, stale in self.ttls:
+            if pattern.match(path):
+                return fresh, stale
+        return self.default_ttl, self.default_stale
+
+    async def get(self, key):
+        row = await db.get_cached_response(key)
+        if not row:
+            return None
+        body, etag, last_modified, expires_at, stale_until = row
+        await db.touch_cached_response(key, time.time())
+        return {
+            "data": json.loads(body),
+            "etag": etag,
+            "last_modified": last_modified,
+            "expires_at": expires_at,
+            "stale_until": stale_until,
+        }
+
+    async def put(self, key, path, data, etag, last_modified):
+        now = time.time()
+        fresh, stale = self.lifetime(path)
+        await db.put_cached_response(
+            key, json.dumps(data), etag, last_modified, now, now + fresh, now + fresh + stale)
+        await db.evict_cached_responses(self.max_bytes)
+
+    async def refresh(self, key, path, etag, last_modified):
+        now = time.time()
+        fresh, stale = self.lifetime(path)
+        await db.refresh_cached_response(key, etag, last_modified, now, now + fresh, now + fresh + stale)
+
+
+class CTFtimeClient:
+    def __init__(self, base_url=CTFTIME_API_URL, timeout=10.0, max_concurrency=4,
+                 retries=3, backoff=0.5, breaker=None, cache=None):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.cache = cache
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._session = None
+        self._revalidating = {}
+
+    async def start(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.timeout,
+                headers={"User-Agent": USER_AGENT, "Accept": "application/json"},
+            )
+
+    async def close(self):
+        for task in list(self._revalidating.values()):
+            task.cancel()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _delay(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return retry_after
+        return self.backoff * (2 ** attempt) * (1 + random.random() / 2)
+
+    async def _fetch(self, path, params=None, headers=None):
+        """Send one GET with retries; returns (status, data, response headers).
+
+        ``status`` is 200 or, for conditional requests, 304 with ``data`` None.
+        """
+        endpoint = re.sub(r"\d+", ":id", path.strip("/"))  # Metrics label, e.g. events/:id
+        trial = self.breaker.state == "half-open"
+        if not self.breaker.allow():
+            metrics.CTFTIME_ERRORS.inc(endpoint=endpoint, reason="circuit_open")
+            raise CircuitOpenError("CTFtime circuit is open, not sending request")
+        try:
+            await self.start()
+            url = f"{self.base_url}/{path.lstrip('/')}"
+            last_error = None
+            for attempt in range(self.retries + 1):
+                retry_after = None
+                try:
+                    async with self._semaphore:
+                        start = time.perf_counter()
+                        async with self._session.get(url, params=params, headers=headers) as resp:
+                            if resp.status in (200, 304):
+                                data = await resp.json(content_type=None) if resp.status == 200 else None
+                                metrics.CTFTIME_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint, status=resp.status)
+                                self.breaker.record_success()
+                                return resp.status, data, resp.headers
+                            metrics.CTFTIME_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint, status=resp.status)
+                            metrics.CTFTIME_ERRORS.inc(endpoint=endpoint, reason=f"http_{resp.status}")
+                            last_error = CTFtimeError(f"CTFtime returned HTTP {resp.status} for {url}", resp.status)
+                            if resp.status == 429:
+                                try:
+                                    retry_after = float(resp.headers.get("Retry-After", ""))
+                                except ValueError:
+                                    retry_after = None
+                            elif resp.status < 500:
+                                # Client errors (404 for an unknown event...) say nothing about CTFtime's health
+                                self.breaker.record_success()
+                                raise last_error
+                except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                    metrics.CTFTIME_ERRORS.inc(endpoint=endpoint, reason=type(e).__name__)
+                    last_error = CTFtimeError(f"CTFtime request to {url} failed: {e!r}")
+                if attempt < self.retries:
+                    await asyncio.sleep(self._delay(attempt, retry_after))
+            self.breaker.record_failure()
+            raise last_error
+        finally:
+            if trial:
+                # A no-op after record_success/record_failure; frees the trial if it was cancelled
+                self.breaker.release()
+
+    async def _revalidate(self, key, path, params, entry):
+        headers = {}
+        if entry:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+        status, data, resp_headers = await self._fetch(path, params, headers or None)
+        etag = resp_headers.get("ETag")
+        last_modified = resp_headers.get("Last-Modified")
+        if status == 304 and entry:
+            await self.cache.refresh(key, path, etag, last_modified)
+            return entry["data"]
+        await self.cache.put(key, path, data, etag, last_modified)
+        return data
+
+    def _revalidation(self, key, path, params, entry):
+        """Return the in-flight request for ``key``, starting one if there is none."""
+        task = self._revalidating.get(key)
+        if task is None:
+            task = asyncio.create_task(self._revalidate(key, path, params, entry))
+            self._revalidating[key] = task
+            task.add_done_callback(lambda _: self._revalidating.pop(key, None))
+        return task
+
+    def _revalidate_in_background(self, key, path, params, entry):
+        def report(task):
+            if not task.cancelled() and task.exception() is not None:
+                print(f"Background CTFtime revalidation of {key} failed: {task.exception()}")
+
+        self._revalidation(key, path, params, entry).add_done_callback(report)
+
+    async def get_json(self, path, params=None):
+        """GET ``path`` relative to the API root and return the decoded JSON body."""
+        if self.cache is None:
+            return (await self._fetch(path, params))[1]
+        key = self.cache.key(path, params)
+        entry = await self.cache.get(key)
+        now = time.time()
+        if entry and now < entry["expires_at"]:
+            metrics.CACHE_LOOKUPS.inc(cache="ctftime", result="fresh")
+            return entry["data"]
+        if entry and now < entry["stale_until"]:
+            metrics.CACHE_LOOKUPS.inc(cache="ctftime", result="stale")
+            self._revalidate_in_background(key, path, params, entry)
+            return entry["data"]
+        metrics.CACHE_LOOKUPS.inc(cache="ctftime", result="miss")
+        try:
+            # Concurrent misses for one key wait on a single request; shielded so one caller
+            # giving up does not cancel it for the others
+            return await asyncio.shield(self._revalidation(key, path, params, entry))
+        except CTFtimeError as e:
+            if entry:
+                print(f"Serving stale CTFtime response for {key}: {e}")
+                return entry["data"]
+            raise
+
+    async def get_team(self, team_id):
+        return await self.get_json(f"teams/{team_id}/")
+
+    async def get_events(self, start, finish, limit=10):
+        # Align the window to the hour so repeated calls share one cache entry
+        start -= start % 3600
+        finish -= finish % 3600
+        return await self.get_json("events/", params={"limit": limit, "start": start, "finish": finish})
+
+    async def get_event(self, event_id):
+        return await self.get_json(f"events/{event_id}/")
@@ -0,0 +1,70 @@
+"""Local mirror of CTFtime events in the ``ctftime_events`` table.
+
+The timeline from ``PAST`` before now to ``HORIZON`` after it is cut into
+fixed ``WINDOW``-sized windows, aligned to the epoch so they stay the same
+between runs. ``sync`` only downloads windows that are due: the ones close
+to now every ``NEAR_REFRESH``, farther ones every ``FAR_REFRESH``, so an
+hourly sync costs one or two API calls instead of a full download.
+
+Announcements, archival and ``!upcoming`` then read events with indexed
+queries on the mirror. Events missing from it (for instance a CTF that
+started before the mirrored range) are fetched once and stored.
+"""
+import time
+
+import db
+from ctftime import CTFtimeError
+
+DAY = 24 * 3600
+WINDOW = 7 * DAY
+PAST = 14 * DAY
+HORIZON = 63 * DAY
+NEAR = 14 * DAY
+NEAR_REFRESH = 3 * 3600
+FAR_REFRESH = DAY
+WINDOW_LIMIT = 100  # Events per request; CTFtime rarely lists more than ~20 a week
+
+
+class CTFtimeMirror:
+    def __init__(self, client):
+        self.client = client
+
+    def windows(self, now):
+        first = (now - PAST) // WINDOW * WINDOW
+        return range(int(first), int(now + HORIZON), WINDOW)
+
+    async def sync(self, now=None):
+        """Download every window that is due; returns how many were refreshed."""
+        now = time.time() if now is None else now
+        windows = self.windows(now)
+        synced = await db.get_ctftime_sync_windows(windows[0])
+        refreshed = 0
+        for start in windows:
+            refresh = NEAR_REFRESH if start < now + NEAR and start + WINDOW > now - NEAR else FAR_REFRESH
+            if now - synced.get(start, 0) < refresh:
+                continue
+            try:
+                events = await self.client.get_events(start, start + WINDOW, limit=WINDOW_LIMIT)
+            except CTFtimeError as e:
+                print(f"CTFtime sync stopped at window {start}: {e}")
+                break
+            await db.save_ctftime_events(events, now, window_start=start)
+            refreshed += 1
+        return refreshed
+
+    async def get(self, event_id):
+        """Event JSON from the mirror, fetched from CTFtime and stored if it is missing."""
+        event = await db.get_ctftime_event(event_id)
+        if event is None:
+            event = await self.client.get_event(event_id)
+            await db.save_ctftime_events([event], time.time())
+        return event
+
+    async def pick(self, start, finish, soonest=4, top=2):
+        """Of the ``soonest`` events starting in [start, finish), the ``top`` by weight."""
+        return await db.pick_ctftime_events(start, finish, soonest, top)
+
+    async def page(self, cursor, limit, query=None, now=None):
+        """Keyset page of events starting after ``now``, soonest first."""
+        now = time.time() if now is None else now
+        return await db.get_ctftime_events_page(now, cursor, limit, query)
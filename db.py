@@ -0,0 +1,1220 @@
+"""Async data access layer for the CTF team database.
+
+Every query the bot runs lives here so that command handlers never touch
+SQLite directly. Reads use pooled connections handed out per asyncio task:
+a task that is already inside ``connection()`` reuses the connection it
+holds, every other task gets its own. The database runs in WAL mode so
+readers never wait behind a writer.
+
+All writes go through a single writer task. ``write(apply)`` queues an
+``async def apply(conn)``; the writer runs whatever has queued up in one
+transaction (group commit), each request inside its own savepoint so a
+failing request does not undo its neighbours, and resolves every caller
+once the batch is committed.
+"""
+import asyncio
+import contextlib
+import contextvars
+import json
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+import aiosqlite
+
+import metrics
+import migrations
+
+DB_PATH = os.getenv("DB_PATH", "ctf_team.db")
+POOL_SIZE = 4
+WRITE_BATCH_SIZE = 64  # Most write requests committed together
+RESCORE_BATCH_SIZE = 100  # Challenges rescored per write by rescore()
+
+SCOREBOARD_CONFIG_KEY = "scoreboard_message_id"
+CTFTIME_TEAM_CONFIG_KEY = "ctftime_team_message_id"
+DATA_GENERATION_KEY = "data_generation"  # Bumped by every change to solves or points
+LEGACY_GUILD_ID = "0"  # Guild of rows written before guild scoping, until claimed
+LEGACY_GUILD_KEY = "legacy_guild_id"
+
+class TimedConnection(sqlite3.Connection):
+    """sqlite3 connection that records every statement's count and run time."""
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            metrics.observe_query(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            metrics.observe_query(sql, time.perf_counter() - start)
+
+
+class ConnectionPool:
+    """A small pool of aiosqlite connections opened lazily in WAL mode."""
+
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle = asyncio.LifoQueue()
+        self._opened = 0
+        self._all = []
+
+    async def _open(self):
+        conn = await aiosqlite.connect(self.path, isolation_level=None, factory=TimedConnection)
+        await conn.execute("PRAGMA journal_mode=WAL")
+        await conn.execute("PRAGMA synchronous=NORMAL")
+        await conn.execute("PRAGMA busy_timeout=5000")
+        self._all.append(conn)
+        return conn
+
+    async def acquire(self):
+        if self._idle.empty() and self._opened < self.size:
+            self._opened += 1
+            try:
+                return await self._open()
+            except Exception:
+                self._opened -= 1
+                raise
+        return await self._idle.get()
+
+    def release(self, conn):
+        self._idle.put_nowait(conn)
+
+    async def close(self):
+        for conn in self._all:
+            await conn.close()
+        self._all.clear()
+        self._opened = 0
+        self._idle = asyncio.LifoQueue()
+
+
+class Writer:
+    """The single task that applies every write, batching queued requests per commit."""
+
+    def __init__(self, conn, batch_size=WRITE_BATCH_SIZE):
+        self.conn = conn
+        self.batch_size = batch_size
+        self._queue = asyncio.Queue()
+        self._task = None
+        self._closing = False
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop taking requests and wait until everything queued is committed."""
+        self._closing = True
+        self._queue.put_nowait(None)
+        await self._task
+
+    async def submit(self, apply):
+        if self._closing:
+            raise RuntimeError("database writer is closed")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((apply, future))
+        return await future
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            item = await self._queue.get()
+            while item is not None:
+                batch.append(item)
+                if len(batch) >= self.batch_size or self._queue.empty():
+                    break
+                item = self._queue.get_nowait()
+            stopping = item is None
+            if batch:
+                await self._commit(batch)
+
+    async def _commit(self, batch):
+        results = []
+        try:
+            await self.conn.execute("BEGIN IMMEDIATE")
+            for apply, future in batch:
+                if future.cancelled():
+                    continue
+                await self.conn.execute("SAVEPOINT request")
+                try:
+                    result = await apply(self.conn)
+                except Exception as e:
+                    await self.conn.execute("ROLLBACK TO request")
+                    results.append((future, None, e))
+                else:
+                    results.append((future, result, None))
+                await self.conn.execute("RELEASE request")
+            await self.conn.commit()
+        except Exception as e:
+            print(f"Database write batch failed: {e}")
+            if self.conn.in_transaction:
+                await self.conn.rollback()
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for future, result, error in results:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+_pool = None
+_writer = None
+_current = contextvars.ContextVar("db_connection", default=(None, None))
+
+
+async def init(path=None):
+    """Open the connection pool, bring the schema up to date and start the writer."""
+    global _pool, _writer, DB_PATH
+    if path:
+        DB_PATH = path
+    _pool = ConnectionPool(DB_PATH)
+    conn = await _pool.acquire()
+    try:
+        await migrations.migrate(conn)
+    except BaseException:
+        _pool.release(conn)
+        raise
+    _writer = Writer(conn)  # Keeps this connection for as long as the pool is open
+    _writer.start()
+
+
+async def close():
+    """Drain queued writes, then close every connection."""
+    global _pool, _writer
+    if _writer:
+        await _writer.stop()
+        _writer = None
+    if _pool:
+        await _pool.close()
+        _pool = None
+
+
+@contextlib.asynccontextmanager
+async def connection():
+    """Yield the connection owned by the current task, acquiring one if needed."""
+    task = asyncio.current_task()
+    owner, conn = _current.get()
+    if conn is not None and owner is task:
+        yield conn
+        return
+    conn = await _pool.acquire()
+    token = _current.set((task, conn))
+    try:
+        yield conn
+    finally:
+        _current.reset(token)
+        _pool.release(conn)
+
+
+async def write(apply):
+    """Run ``await apply(conn)`` on the writer and return its result once committed."""
+    return await _writer.submit(apply)
+
+
+async def fetchone(sql, params=()):
+    async with connection() as conn:
+        async with conn.execute(sql, params) as cur:
+            return await cur.fetchone()
+
+
+async def fetchall(sql, params=()):
+    async with connection() as conn:
+        async with conn.execute(sql, params) as cur:
+            return await cur.fetchall()
+
+
+async def execute(sql, params=()):
+    async def apply(conn):
+        await conn.execute(sql, params)
+    await write(apply)
+
+
+# --- bot_config ---
+
+async def get_config(key):
+    row = await fetchone("SELECT value FROM bot_config WHERE key = ?", (key,))
+    return row[0] if row else None
+
+
+async def set_config(key, value):
+    await execute("INSERT OR REPLACE INTO bot_config (key, value) VALUES (?, ?)", (key, str(value)))
+
+
+async def get_config_json(key):
+    value = await get_config(key)
+    return json.loads(value) if value else {}
+
+
+async def set_config_json(key, mapping):
+    await set_config(key, json.dumps(mapping))
+
+
+# --- guild_config ---
+
+async def get_guild_config_rows():
+    """Return (guild_id, key, value) for every per-guild setting."""
+    return await fetchall('''SELECT guild_id, key, value FROM guild_config''')
+
+
+async def get_guild_config(guild_id, key):
+    row = await fetchone(
+        '''SELECT value FROM guild_config WHERE guild_id = ? AND key = ?''', (str(guild_id), key))
+    return row[0] if row else None
+
+
+async def set_guild_config(guild_id, key, value):
+    """Set a per-guild setting; None removes it."""
+    if value is None:
+        await execute('''DELETE FROM guild_config WHERE guild_id = ? AND key = ?''', (str(guild_id), key))
+    else:
+        await execute(
+            '''INSERT OR REPLACE INTO guild_config (guild_id, key, value) VALUES (?, ?, ?)''',
+            (str(guild_id), key, str(value)))
+
+
+async def get_scoreboard_message_id(guild_id):
+    value = await get_guild_config(guild_id, SCOREBOARD_CONFIG_KEY)
+    return int(value) if value else None
+
+
+async def set_scoreboard_message_id(guild_id, message_id):
+    await set_guild_config(guild_id, SCOREBOARD_CONFIG_KEY, message_id)
+
+
+async def get_ctftime_team_message_id(guild_id):
+    value = await get_guild_config(guild_id, CTFTIME_TEAM_CONFIG_KEY)
+    return int(value) if value else None
+
+
+async def set_ctftime_team_message_id(guild_id, message_id):
+    await set_guild_config(guild_id, CTFTIME_TEAM_CONFIG_KEY, message_id)
+
+
+async def claim_legacy_guild(guild_id, settings, config_keys):
+    """Assign every row written before guild scoping to ``guild_id``.
+
+    ``settings`` seeds the guild's configuration without overwriting
+    anything already set, and the bot_config keys in ``config_keys`` move
+    to the guild's configuration. Returns False if the legacy data was
+    already claimed.
+    """
+    guild_id = str(guild_id)
+
+    async def apply(conn):
+        async with conn.execute('''SELECT value FROM bot_config WHERE key = ?''', (LEGACY_GUILD_KEY,)) as cur:
+            if await cur.fetchone():
+                return False
+        for table in ("users", "solved_challenges", "active_challenges", "ctf_participation", "ctf_events",
+                      "solve_ledger", "ledger_snapshots", "challenge_threads", "thread_messages"):
+            await conn.execute(f'''UPDATE {table} SET guild_id = ? WHERE guild_id = ?''', (guild_id, LEGACY_GUILD_ID))
+        await conn.executemany(
+            '''INSERT OR IGNORE INTO guild_config (guild_id, key, value) VALUES (?, ?, ?)''',
+            [(guild_id, key, str(value)) for key, value in settings.items()])
+        await conn.execute(
+            '''INSERT OR IGNORE INTO guild_config (guild_id, key, value)
+               SELECT ?, key, value FROM bot_config WHERE key IN (SELECT value FROM json_each(?))''',
+            (guild_id, json.dumps(list(config_keys))))
+        await conn.execute(
+            '''DELETE FROM bot_config WHERE key IN (SELECT value FROM json_each(?))''', (json.dumps(list(config_keys)),))
+        await conn.execute(
+            '''INSERT INTO bot_config (key, value) VALUES (?, ?)''', (LEGACY_GUILD_KEY, guild_id))
+        await _bump_generation(conn)
+        return True
+
+    return await write(apply)
+
+
+# --- Scoreboard and profiles ---
+
+async def get_data_generation():
+    return int(await get_config(DATA_GENERATION_KEY) or 0)
+
+
+async def save_generation_snapshot(key, rows):
+    """Store ``rows`` under a bot_config key, stamped with the current data generation."""
+    async def apply(conn):
+        async with conn.execute('''SELECT value FROM bot_config WHERE key = ?''', (DATA_GENERATION_KEY,)) as cur:
+            row = await cur.fetchone()
+        generation = int(row[0]) if row else 0
+        await conn.execute(
+            '''INSERT OR REPLACE INTO bot_config (key, value) VALUES (?, ?)''',
+            (key, json.dumps({"generation": generation, "rows": rows})))
+    await write(apply)
+
+
+async def _bump_generation(conn):
+    await conn.execute(
+        '''UPDATE bot_config SET value = CAST(value AS INTEGER) + 1 WHERE key = ?''',
+        (DATA_GENERATION_KEY,))
+
+
+async def get_ranking_rows():
+    """Return (guild_id, user_id, points, first_bloods, flags) for every user of every guild."""
+    return await fetchall(
+        '''SELECT u.guild_id, u.user_id, u.points, u.first_bloods, COUNT(sc.challenge_name)
+            FROM users u
+            LEFT JOIN solved_challenges sc ON u.guild_id = sc.guild_id AND u.user_id = sc.user_id
+            GROUP BY u.guild_id, u.user_id''')
+
+
+async def get_user(guild_id, user_id):
+    """Return (first_bloods, points) for a user, or None."""
+    return await fetchone(
+        '''SELECT first_bloods, points FROM users WHERE guild_id = ? AND user_id = ?''', (str(guild_id), str(user_id)))
+
+
+async def get_user_stats_rows(guild_id, user_id):
+    """Return everything !profile shows about a user in one round trip.
+
+    Rows are tagged by their first column: one ('user', NULL, points,
+    first_bloods) row if the user exists, one ('category', name, solves,
+    first_blood_solves) row per category, and one ('event', event_id,
+    NULL, NULL) row per CTF participated in.
+    """
+    key = (str(guild_id), str(user_id))
+    return await fetchall(
+        '''SELECT 'user', NULL, points, first_bloods FROM users WHERE guild_id = ? AND user_id = ?
+           UNION ALL
+           SELECT 'category', category, COUNT(*), SUM(first_blood = 1)
+             FROM solved_challenges WHERE guild_id = ? AND user_id = ? GROUP BY category
+           UNION ALL
+           SELECT 'event', event_id, NULL, NULL FROM ctf_participation WHERE guild_id = ? AND user_id = ?''',
+        key * 3)
+
+
+async def get_distinct_categories(guild_id):
+    return [row[0] for row in await fetchall(
+        '''SELECT DISTINCT category FROM solved_challenges WHERE guild_id = ?''', (str(guild_id),))]
+
+
+# --- Challenges ---
+
+async def add_active_challenge(guild_id, challenge_name, category, user_id, thread_id, timestamp):
+    """Mark a challenge as being worked on and remember its discussion thread."""
+    guild_id, user_id = str(guild_id), str(user_id)
+
+    async def apply(conn):
+        # An upsert rather than INSERT OR REPLACE, whose implicit delete would skip the search triggers
+        await conn.execute(
+            '''INSERT INTO active_challenges (guild_id, challenge_name, category, user_id, thread_id, timestamp)
+               VALUES (?,?,?,?,?,?)
+               ON CONFLICT (guild_id, user_id, challenge_name) DO UPDATE
+               SET category = excluded.category, thread_id = excluded.thread_id, timestamp = excluded.timestamp''',
+            (guild_id, challenge_name, category, user_id, str(thread_id), timestamp))
+        await conn.execute(
+            '''INSERT OR REPLACE INTO challenge_threads (thread_id, guild_id, challenge_name, category, user_id, created_at)
+               VALUES (?, ?, ?, ?, ?, ?)''',
+            (int(thread_id), guild_id, challenge_name, category, user_id, timestamp))
+
+    await write(apply)
+
+
+def _keyset_query(columns, table, guild_id, cursor, limit, category=None, user_id=None, since=None, until=None):
+    clauses, params = ["guild_id = ?"], [str(guild_id)]
+    if cursor is not None:
+        clauses.append("(timestamp, rowid) < (?, ?)")
+        params.extend(cursor)
+    if category:
+        clauses.append("category = ?")
+        params.append(category)
+    if user_id:
+        clauses.append("user_id = ?")
+        params.append(str(user_id))
+    if since:
+        clauses.append("timestamp >= ?")
+        params.append(since)
+    if until:
+        clauses.append("timestamp < ?")
+        params.append(until)
+    sql = f'''SELECT timestamp, rowid, {columns} FROM {table} WHERE {' AND '.join(clauses)}
+              ORDER BY timestamp DESC, rowid DESC LIMIT ?'''
+    return sql, (*params, limit)
+
+
+async def get_active_page(guild_id, cursor=None, limit=15, **filters):
+    """Return a guild's active challenges older than ``cursor`` (a (timestamp, rowid) pair), newest first.
+
+    Rows are (timestamp, rowid, challenge_name, category, user_id, thread_id).
+    ``filters`` are category, user_id, since and until (timestamps, until exclusive).
+    """
+    return await fetchall(*_keyset_query(
+        "challenge_name, category, user_id, thread_id", "active_challenges", guild_id, cursor, limit, **filters))
+
+
+async def get_solved_page(guild_id, cursor=None, limit=15, **filters):
+    """Return a guild's solves older than ``cursor``, newest first; filters as for get_active_page.
+
+    Rows are (timestamp, rowid, challenge_name, category, difficulty, first_blood, user_id).
+    """
+    return await fetchall(*_keyset_query(
+        "challenge_name, category, difficulty, first_blood, user_id", "solved_challenges", guild_id, cursor, limit,
+        **filters))
+
+
+async def is_solved(guild_id, challenge_name, user_id):
+    row = await fetchone(
+        '''SELECT 1 FROM solved_challenges
+           WHERE guild_id = ? AND challenge_name = ? AND user_id = ?''',
+        (str(guild_id), challenge_name, str(user_id)))
+    return row is not None
+
+
+def _since_reset(event, guild_id, user_id):
+    """SQL condition keeping ledger ``event`` rows after the user's latest ``reset`` event.
+
+    A reset zeroes a user's totals with one event that names no challenge,
+    so per-challenge sums only add up to what is credited now when they
+    skip the events before it.
+    """
+    return (f"{event}.seq > (SELECT COALESCE(MAX(r.seq), 0) FROM solve_ledger r WHERE r.guild_id = {guild_id} "
+            f"AND r.user_id = {user_id} AND r.challenge_name IS NULL AND r.kind = 'reset')")
+
+
+async def _append_ledger(conn, guild_id, user_id, kind, challenge_name, points, first_bloods, flags, note=None):
+    """Append one ledger event and apply it to the users projection."""
+    await conn.execute(
+        '''INSERT INTO solve_ledger
+           (guild_id, user_id, kind, challenge_name, points, first_bloods, flags, note, created_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+        (guild_id, user_id, kind, challenge_name, points, first_bloods, flags, note, time.time()))
+    await conn.execute(
+        '''INSERT INTO users (guild_id, user_id, first_bloods, points) VALUES (?, ?, ?, ?)
+           ON CONFLICT (guild_id, user_id) DO UPDATE
+           SET points = points + excluded.points, first_bloods = first_bloods + excluded.first_bloods''',
+        (guild_id, user_id, first_bloods, points))
+
+
+async def record_solve(guild_id, challenge_name, category, difficulty, first_blood, user_id, scoring, timestamp):
+    """Store a solve, credit the user and clear the matching active challenge.
+
+    The solve is worth what the ``scoring`` rules give it; with decay the
+    other solvers of the challenge are rescored in the same transaction.
+    Returns the user's new ``points`` and ``first_bloods``, under
+    ``rescored`` {user_id: (points, first_bloods)} of the other players
+    whose points changed and under ``first_in_category`` whether this is
+    the user's first solve in ``category``, or None if the user already
+    solved this challenge.
+    """
+    key = (str(guild_id), str(user_id))
+    fb = 1 if first_blood == 1 else 0
+
+    async def apply(conn):
+        try:
+            await conn.execute(
+                '''INSERT INTO solved_challenges
+                   (guild_id, challenge_name, category, difficulty, first_blood, user_id, timestamp)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                (key[0], challenge_name, category, difficulty, first_blood, key[1], timestamp))
+        except sqlite3.IntegrityError:
+            return None
+        async with conn.execute(
+                '''SELECT NOT EXISTS (SELECT 1 FROM solved_challenges
+                                      WHERE guild_id = ? AND user_id = ? AND category = ? AND challenge_name != ?)''',
+                (*key, category, challenge_name)) as cur:
+            first_in_category, = await cur.fetchone()
+        solvers = await _count_solvers(conn, key[0], challenge_name)
+        await _append_ledger(conn, *key, "solve", challenge_name,
+                             scoring.points(difficulty, category, first_blood, solvers), fb, 1)
+        rescored = await _rescore(conn, key[0], scoring, [challenge_name]) if scoring.dynamic else {}
+        await conn.execute(
+            '''DELETE FROM active_challenges
+               WHERE guild_id = ? AND challenge_name = ? AND user_id = ?''',
+            (key[0], challenge_name, key[1]))
+        await _bump_generation(conn)
+        async with conn.execute(
+                '''SELECT points, first_bloods FROM users WHERE guild_id = ? AND user_id = ?''', key) as cur:
+            points_now, first_bloods = await cur.fetchone()
+        rescored.pop(key[1], None)
+        return {"points": points_now, "first_bloods": first_bloods, "rescored": rescored,
+                "first_in_category": bool(first_in_category)}
+
+    return await write(apply)
+
+
+async def revoke_solve(guild_id, challenge_name, user_id, scoring):
+    """Delete a user's solve and take back exactly what the ledger credited for it.
+
+    With decay the remaining solvers of the challenge are rescored under
+    ``scoring`` in the same transaction. Returns the removed solve's
+    ``difficulty`` and ``first_blood``, the user's new ``points`` and
+    ``first_bloods`` and ``rescored`` as for record_solve, or None if the
+    user never solved the challenge.
+    """
+    key = (str(guild_id), str(user_id))
+
+    async def apply(conn):
+        async with conn.execute(
+                '''SELECT difficulty, first_blood FROM solved_challenges
+                   WHERE guild_id = ? AND challenge_name = ? AND user_id = ?''',
+                (key[0], challenge_name, key[1])) as cur:
+            row = await cur.fetchone()
+        if not row:
+            return None
+        difficulty, first_blood = row
+        # Earlier solve/unsolve pairs and rescores of this challenge add up to what is credited now
+        async with conn.execute(
+                f'''SELECT COALESCE(SUM(l.points), 0), COALESCE(SUM(l.first_bloods), 0) FROM solve_ledger l
+                    WHERE l.guild_id = ? AND l.user_id = ? AND l.challenge_name = ?
+                      AND {_since_reset("l", "l.guild_id", "l.user_id")}''',
+                (key[0], key[1], challenge_name)) as cur:
+            points, first_bloods = await cur.fetchone()
+        await conn.execute(
+            '''DELETE FROM solved_challenges WHERE guild_id = ? AND challenge_name = ? AND user_id = ?''',
+            (key[0], challenge_name, key[1]))
+        await _append_ledger(conn, *key, "unsolve", challenge_name, -points, -first_bloods, -1)
+        rescored = await _rescore(conn, key[0], scoring, [challenge_name]) if scoring.dynamic else {}
+        await _bump_generation(conn)
+        async with conn.execute(
+                '''SELECT points, first_bloods FROM users WHERE guild_id = ? AND user_id = ?''', key) as cur:
+            new_points, new_fb = await cur.fetchone() or (0, 0)
+        return {"difficulty": difficulty, "first_blood": first_blood, "points": new_points, "first_bloods": new_fb,
+                "rescored": rescored}
+
+    return await write(apply)
+
+
+async def reset_scoreboard(guild_id):
+    async def apply(conn):
+        # Zero every user in the ledger first; the tables below hold no history of their own. Every user gets a
+        # reset event, even at zero, since it also marks where per-challenge sums start again (see _since_reset)
+        await conn.execute(
+            '''INSERT INTO solve_ledger (guild_id, user_id, kind, points, first_bloods, flags, created_at)
+               SELECT guild_id, user_id, 'reset', -SUM(points), -SUM(first_bloods), -SUM(flags), ?
+                 FROM solve_ledger WHERE guild_id = ? GROUP BY user_id''',
+            (time.time(), str(guild_id)))
+        for table in ("users", "solved_challenges", "active_challenges", "ctf_participation"):
+            await conn.execute(f'DELETE FROM {table} WHERE guild_id = ?', (str(guild_id),))
+        await _bump_generation(conn)
+    await write(apply)
+
+
+async def add_participation(guild_id, user_id, event_id):
+    await execute(
+        '''INSERT OR IGNORE INTO ctf_participation (guild_id, user_id, event_id) VALUES (?, ?, ?)''',
+        (str(guild_id), str(user_id), str(event_id)))
+
+
+async def _count_solvers(conn, guild_id, challenge_name):
+    async with conn.execute(
+            '''SELECT COUNT(*) FROM solved_challenges WHERE guild_id = ? AND challenge_name = ?''',
+            (guild_id, challenge_name)) as cur:
+        return (await cur.fetchone())[0]
+
+
+async def _rescore(conn, guild_id, scoring, challenges=None, note=None):
+    """Bring every current solve of a guild, or of a list of challenges, to its value under ``scoring``.
+
+    One set-based statement compares each solve's value with what the
+    ledger credited for it and appends a ``rescore`` event for every
+    difference; a second applies the events to the users table. Returns
+    {user_id: (points, first_bloods)} of the users whose points changed.
+    """
+    ctes, params = scoring.ctes()
+    only = "AND challenge_name IN (SELECT value FROM json_each(?))" if challenges is not None else ""
+    only_params = [json.dumps(list(challenges))] if challenges is not None else []
+    async with conn.execute('''SELECT COALESCE(MAX(seq), 0) FROM solve_ledger''') as cur:
+        last_event, = await cur.fetchone()
+    await conn.execute(
+        f'''WITH {ctes},
+            solvers AS (
+                SELECT challenge_name, COUNT(*) AS n FROM solved_challenges
+                 WHERE guild_id = ? {only} GROUP BY challenge_name),
+            solves AS (
+                SELECT sc.user_id, sc.challenge_name, sc.category, sc.difficulty, sc.first_blood, c.n
+                  FROM solvers c
+                  -- CROSS JOIN keeps solvers outermost, so only the selected challenges' solves are read
+                  CROSS JOIN solved_challenges sc ON sc.guild_id = ? AND sc.challenge_name = c.challenge_name),
+            -- Credits before a user's latest reset no longer count (see _since_reset)
+            resets AS (
+                SELECT u.user_id, (SELECT MAX(l.seq) FROM solve_ledger l
+                                    WHERE l.guild_id = ? AND l.user_id = u.user_id
+                                      AND l.challenge_name IS NULL AND l.kind = 'reset') AS seq
+                  FROM (SELECT DISTINCT user_id FROM solves) u),
+            target AS (
+                SELECT sc.user_id, sc.challenge_name, {scoring.solve_points_sql("sc", "sc.n")} AS points,
+                       (SELECT COALESCE(SUM(l.points), 0) FROM solve_ledger l
+                         WHERE l.guild_id = ? AND l.user_id = sc.user_id
+                           AND l.challenge_name = sc.challenge_name AND l.seq > COALESCE(rs.seq, 0)) AS credited
+                  FROM solves sc
+                  LEFT JOIN resets rs ON rs.user_id = sc.user_id
+                  LEFT JOIN scores s ON s.difficulty = sc.difficulty
+                  LEFT JOIN multipliers m ON m.category = sc.category)
+            INSERT INTO solve_ledger
+                (guild_id, user_id, kind, challenge_name, points, first_bloods, flags, note, created_at)
+            SELECT ?, user_id, 'rescore', challenge_name, points - credited, 0, 0, ?, ?
+              FROM target WHERE points != credited ORDER BY user_id, challenge_name''',
+        (*params, guild_id, *only_params, guild_id, guild_id, guild_id, guild_id, note, time.time()))
+    # NOT INDEXED: without it the GROUP BY walks idx_solve_ledger_challenge over the whole ledger
+    await conn.execute(
+        '''INSERT INTO users (guild_id, user_id, points, first_bloods)
+           SELECT guild_id, user_id, SUM(points), 0 FROM solve_ledger NOT INDEXED WHERE seq > ? GROUP BY guild_id, user_id
+           ON CONFLICT (guild_id, user_id) DO UPDATE SET points = points + excluded.points''',
+        (last_event,))
+    async with conn.execute(
+            '''SELECT user_id, points, first_bloods FROM users
+               WHERE guild_id = ? AND user_id IN (SELECT user_id FROM solve_ledger WHERE seq > ?)''',
+            (guild_id, last_event)) as cur:
+        return {user_id: (points, first_bloods) for user_id, points, first_bloods in await cur.fetchall()}
+
+
+async def rescore(guild_id, scoring):
+    """Rescore a guild's whole solve history under ``scoring``; returns the number of players whose points changed.
+
+    A solve's value only depends on its own challenge, so the challenges
+    are rescored RESCORE_BATCH_SIZE at a time, each batch in its own write,
+    and other writes are committed between batches instead of waiting for
+    the whole guild.
+    """
+    guild_id = str(guild_id)
+    challenges = [name for name, in await fetchall(
+        '''SELECT DISTINCT challenge_name FROM solved_challenges WHERE guild_id = ?''', (guild_id,))]
+    changed = set()
+    for i in range(0, len(challenges), RESCORE_BATCH_SIZE):
+        batch = challenges[i:i + RESCORE_BATCH_SIZE]
+
+        async def apply(conn):
+            rescored = await _rescore(conn, guild_id, scoring, batch, note="rules changed")
+            if rescored:
+                await _bump_generation(conn)
+            return rescored
+
+        changed.update(await write(apply))
+    return len(changed)
+
+
+async def bulk_import(guild_id, solves, participation, scoring):
+    """Insert many solves and participation rows for a guild in one transaction.
+
+    ``solves`` are (challenge_name, category, difficulty, first_blood,
+    user_id, timestamp) tuples and ``participation`` (user_id, event_id)
+    tuples; rows that already exist are skipped. Every inserted solve
+    becomes a ledger event worth what the ``scoring`` rules give it and the
+    users touched are credited with their events, in two set-based
+    statements; with decay the challenges that gained solvers are then
+    rescored. Returns the number of solves and participation rows actually
+    inserted.
+    """
+    guild_id = str(guild_id)
+    user_ids = json.dumps(sorted({str(row[4]) for row in solves}))
+
+    async def apply(conn):
+        async with conn.execute('''SELECT COALESCE(MAX(rowid), 0) FROM solved_challenges''') as cur:
+            last_solve, = await cur.fetchone()
+        async with conn.execute('''SELECT COALESCE(MAX(seq), 0) FROM solve_ledger''') as cur:
+            last_event, = await cur.fetchone()
+        # rowcount, unlike total_changes, leaves out the rollup rows written by triggers
+        async with conn.executemany(
+                '''INSERT OR IGNORE INTO solved_challenges
+                   (guild_id, challenge_name, category, difficulty, first_blood, user_id, timestamp)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                [(guild_id, name, category, difficulty, fb, str(uid), ts)
+                 for name, category, difficulty, fb, uid, ts in solves]) as cur:
+            solves_added = max(cur.rowcount, 0)
+        async with conn.executemany(
+                '''INSERT OR IGNORE INTO ctf_participation (guild_id, user_id, event_id) VALUES (?, ?, ?)''',
+                [(guild_id, str(uid), str(event_id)) for uid, event_id in participation]) as cur:
+            participation_added = max(cur.rowcount, 0)
+        if solves_added:
+            ctes, score_params = scoring.ctes()
+            # New solves get rowids past the previous maximum
+            await conn.execute(
+                f'''WITH {ctes},
+                    solvers AS (
+                        SELECT challenge_name, COUNT(*) AS n FROM solved_challenges
+                         WHERE guild_id = ? AND challenge_name IN (
+                             SELECT challenge_name FROM solved_challenges WHERE rowid > ?)
+                         GROUP BY challenge_name)
+                    INSERT INTO solve_ledger
+                        (guild_id, user_id, kind, challenge_name, points, first_bloods, flags, note, created_at)
+                    SELECT sc.guild_id, sc.user_id, 'solve', sc.challenge_name, {scoring.solve_points_sql("sc", "c.n")},
+                           sc.first_blood = 1, 1, 'import', ?
+                      FROM solved_challenges sc
+                      JOIN solvers c ON c.challenge_name = sc.challenge_name
+                      LEFT JOIN scores s ON s.difficulty = sc.difficulty
+                      LEFT JOIN multipliers m ON m.category = sc.category
+                     WHERE sc.rowid > ? ORDER BY sc.rowid''',
+                (*score_params, guild_id, last_solve, time.time(), last_solve))
+            await conn.execute(
+                '''INSERT INTO users (guild_id, user_id, points, first_bloods)
+                   SELECT guild_id, user_id, SUM(points), SUM(first_bloods) FROM solve_ledger
+                    WHERE seq > ? GROUP BY guild_id, user_id
+                   ON CONFLICT (guild_id, user_id) DO UPDATE
+                      SET points = points + excluded.points, first_bloods = first_bloods + excluded.first_bloods''',
+                (last_event,))
+            if scoring.dynamic:
+                await _rescore(conn, guild_id, scoring, note="import")
+            await conn.execute(
+                '''DELETE FROM active_challenges WHERE rowid IN (
+                       SELECT ac.rowid FROM active_challenges ac
+                       JOIN solved_challenges sc
+                         ON sc.guild_id = ac.guild_id AND sc.user_id = ac.user_id
+                        AND sc.challenge_name = ac.challenge_name
+                      WHERE ac.guild_id = ? AND ac.user_id IN (SELECT value FROM json_each(?)))''',
+                (guild_id, user_ids))
+            await _bump_generation(conn)
+        return solves_added, participation_added
+
+    return await write(apply)
+
+
+async def iter_table(table, columns, guild_id, batch_size=500):
+    """Yield a guild's rows of ``table`` in batches, oldest first, without loading them all.
+
+    Uses a connection of its own so the export never pins the caller's
+    task-bound connection across yields.
+    """
+    conn = await _pool.acquire()
+    try:
+        async with conn.execute(
+                f"SELECT {', '.join(columns)} FROM {table} WHERE guild_id = ? ORDER BY rowid", (str(guild_id),)) as cur:
+            while True:
+                rows = await cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+    finally:
+        _pool.release(conn)
+
+
+# --- Solve ledger ---
+# users is a projection of solve_ledger; every write above appends events and applies them in one transaction
+
+def _ledger_projection(guild_filter=""):
+    """Per-user totals as of the ledger head: the latest snapshot plus the events after it.
+
+    ``guild_filter`` is an extra condition on both parts, such as
+    ``AND guild_id = :guild_id``.
+    """
+    return f'''
+        SELECT guild_id, user_id, SUM(points) AS points, SUM(first_bloods) AS first_bloods, SUM(flags) AS flags FROM (
+            SELECT guild_id, user_id, points, first_bloods, flags FROM ledger_snapshots
+             WHERE seq = (SELECT MAX(seq) FROM ledger_snapshots) {guild_filter}
+            UNION ALL
+            SELECT guild_id, user_id, points, first_bloods, flags FROM solve_ledger
+             WHERE seq > (SELECT COALESCE(MAX(seq), 0) FROM ledger_snapshots) {guild_filter})
+        GROUP BY guild_id, user_id'''
+
+
+async def adjust_points(guild_id, user_id, points, note=None):
+    """Append an admin ``adjust`` event; returns the user's new ``points`` and ``first_bloods``."""
+    key = (str(guild_id), str(user_id))
+
+    async def apply(conn):
+        await _append_ledger(conn, *key, "adjust", None, points, 0, 0, note)
+        await _bump_generation(conn)
+        async with conn.execute(
+                '''SELECT points, first_bloods FROM users WHERE guild_id = ? AND user_id = ?''', key) as cur:
+            points_now, first_bloods = await cur.fetchone()
+        return {"points": points_now, "first_bloods": first_bloods}
+
+    return await write(apply)
+
+
+async def snapshot_ledger():
+    """Fold the events since the latest snapshot into a new one at the ledger head.
+
+    Keeps the previous snapshot as well. Returns the new snapshot's
+    sequence number, or None if no event was appended since the last one.
+    """
+    async def apply(conn):
+        async with conn.execute(
+                '''SELECT (SELECT COALESCE(MAX(seq), 0) FROM solve_ledger),
+                          (SELECT COALESCE(MAX(seq), 0) FROM ledger_snapshots)''') as cur:
+            head, base = await cur.fetchone()
+        if head == base:
+            return None
+        await conn.execute(
+            f'''INSERT INTO ledger_snapshots (seq, guild_id, user_id, points, first_bloods, flags)
+                SELECT ?, guild_id, user_id, points, first_bloods, flags FROM ({_ledger_projection()})''', (head,))
+        await conn.execute('''DELETE FROM ledger_snapshots WHERE seq < ?''', (base,))
+        return head
+
+    return await write(apply)
+
+
+async def rebuild_user_totals(guild_id):
+    """Replace a guild's users rows with the ledger projection; returns the number of users written.
+
+    Users whose totals are all zero (for instance after a reset) are left out.
+    """
+    params = {"guild_id": str(guild_id)}
+
+    async def apply(conn):
+        await conn.execute('''DELETE FROM users WHERE guild_id = :guild_id''', params)
+        async with conn.execute(
+                f'''INSERT INTO users (guild_id, user_id, points, first_bloods)
+                    SELECT guild_id, user_id, points, first_bloods FROM ({_ledger_projection("AND guild_id = :guild_id")})
+                     WHERE points != 0 OR first_bloods != 0 OR flags != 0''', params) as cur:
+            written = cur.rowcount
+        await _bump_generation(conn)
+        return written
+
+    return await write(apply)
+
+
+async def get_ledger_check(guild_id):
+    """Read everything the verification of a guild's ledger compares, from one consistent snapshot of the database.
+
+    Returns a dict with the ``events`` count and, keyed by (guild_id,
+    user_id), the full ``replay`` of the ledger and the ``projection``
+    (snapshot + tail) as (points, first_bloods, flags), the ``users`` rows
+    as (points, first_bloods) and ``solves`` from solved_challenges as
+    (first_blood solves, solves).
+    """
+    params = {"guild_id": str(guild_id)}
+    queries = {
+        "replay": '''SELECT guild_id, user_id, SUM(points), SUM(first_bloods), SUM(flags)
+                      FROM solve_ledger WHERE guild_id = :guild_id GROUP BY guild_id, user_id''',
+        "projection": _ledger_projection("AND guild_id = :guild_id"),
+        "users": '''SELECT guild_id, user_id, points, first_bloods FROM users WHERE guild_id = :guild_id''',
+        "solves": '''SELECT guild_id, user_id, SUM(first_blood = 1), COUNT(*)
+                      FROM solved_challenges WHERE guild_id = :guild_id GROUP BY guild_id, user_id''',
+    }
+    conn = await _pool.acquire()
+    try:
+        await conn.execute("BEGIN")  # One read transaction, so concurrent writes cannot show up as drift
+        try:
+            async with conn.execute('''SELECT COUNT(*) FROM solve_ledger WHERE guild_id = :guild_id''', params) as cur:
+                check = {"events": (await cur.fetchone())[0]}
+            for name, sql in queries.items():
+                async with conn.execute(sql, params) as cur:
+                    check[name] = {(guild_id, user_id): tuple(values) for guild_id, user_id, *values in await cur.fetchall()}
+        finally:
+            await conn.execute("COMMIT")
+    finally:
+        _pool.release(conn)
+    return check
+
+
+# --- Solve rollups and seasons ---
+# solve_rollups is maintained by triggers on solved_challenges (migration 7)
+
+ROLLUP_JOINS = "LEFT JOIN scores s ON s.difficulty = r.difficulty LEFT JOIN multipliers m ON m.category = r.category"
+
+
+async def get_window_leaderboard(guild_id, since, until, scoring, limit):
+    """Top players by points over the days in [since, until), as (user_id, flags, points, first_bloods)."""
+    ctes, score_params = scoring.ctes()
+    return await fetchall(
+        f'''WITH {ctes}
+            SELECT r.user_id, SUM(r.solves), SUM({scoring.rollup_points_sql("r")}) AS points, SUM(r.first_bloods)
+              FROM solve_rollups r {ROLLUP_JOINS}
+             WHERE r.guild_id = ? AND r.day >= ? AND r.day < ?
+             GROUP BY r.user_id ORDER BY points DESC, r.user_id LIMIT ?''',
+        (*score_params, str(guild_id), since, until, limit))
+
+
+async def get_window_user_stats_rows(guild_id, user_id, since, until, scoring):
+    """Rows for UserStats over the days in [since, until), in the shape of get_user_stats_rows.
+
+    There is one ('user', NULL, points, first_bloods) row and one ('rank',
+    NULL, rank, NULL) row if the user solved anything in the window, and
+    one ('category', name, solves, first_blood_solves) row per category.
+    """
+    ctes, score_params = scoring.ctes()
+    guild_id, user_id = str(guild_id), str(user_id)
+    return await fetchall(
+        f'''WITH {ctes},
+            totals AS (
+                SELECT r.user_id, SUM({scoring.rollup_points_sql("r")}) AS points, SUM(r.first_bloods) AS first_bloods
+                  FROM solve_rollups r {ROLLUP_JOINS}
+                 WHERE r.guild_id = ? AND r.day >= ? AND r.day < ? GROUP BY r.user_id)
+            SELECT 'user', NULL, points, first_bloods FROM totals WHERE user_id = ?
+            UNION ALL
+            SELECT 'rank', NULL, (SELECT COUNT(*) + 1 FROM totals o
+                                   WHERE o.points > t.points OR (o.points = t.points AND o.user_id < t.user_id)), NULL
+              FROM totals t WHERE t.user_id = ?
+            UNION ALL
+            SELECT 'category', category, SUM(solves), SUM(first_bloods) FROM solve_rollups
+             WHERE guild_id = ? AND user_id = ? AND day >= ? AND day < ? GROUP BY category''',
+        (*score_params, guild_id, since, until, user_id, user_id, guild_id, user_id, since, until))
+
+
+async def get_seasons(guild_id):
+    """Return a guild's (name, start_day) seasons, oldest first."""
+    return await fetchall(
+        '''SELECT name, start_day FROM seasons WHERE guild_id = ? ORDER BY start_day''', (str(guild_id),))
+
+
+async def start_season(guild_id, name, start_day):
+    """Open a season on ``start_day``; returns False if the name or the day is already taken."""
+    async def apply(conn):
+        try:
+            await conn.execute(
+                '''INSERT INTO seasons (guild_id, name, start_day) VALUES (?, ?, ?)''', (str(guild_id), name, start_day))
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    return await write(apply)
+
+
+# --- Full-text search ---
+# search_index is maintained by triggers on solved_challenges, active_challenges and thread_messages (migration 10)
+
+async def get_challenge_thread_ids():
+    return [row[0] for row in await fetchall('''SELECT thread_id FROM challenge_threads''')]
+
+
+async def add_thread_message(guild_id, thread_id, message_id, author_id, content, created_at):
+    await execute(
+        '''INSERT OR IGNORE INTO thread_messages (message_id, thread_id, guild_id, author_id, content, created_at)
+           VALUES (?, ?, ?, ?, ?, ?)''',
+        (int(message_id), int(thread_id), str(guild_id), str(author_id), content, created_at))
+
+
+async def edit_thread_message(message_id, content):
+    await execute(
+        '''UPDATE thread_messages SET content = ? WHERE message_id = ? AND content != ?''',
+        (content, int(message_id), content))
+
+
+async def delete_thread_message(message_id):
+    await execute('''DELETE FROM thread_messages WHERE message_id = ?''', (int(message_id),))
+
+
+async def forget_thread(thread_id):
+    """Drop a deleted thread and its indexed messages."""
+    async def apply(conn):
+        await conn.execute('''DELETE FROM thread_messages WHERE thread_id = ?''', (int(thread_id),))
+        await conn.execute('''DELETE FROM challenge_threads WHERE thread_id = ?''', (int(thread_id),))
+
+    await write(apply)
+
+
+async def search_hits(guild_id, match, limit):
+    """Return the rowids of a guild's search hits for the FTS5 query ``match``, best first."""
+    rows = await fetchall(
+        '''SELECT rowid FROM search_index WHERE search_index MATCH ? AND guild_id = ?
+           ORDER BY bm25(search_index, 10.0, 5.0, 1.0), rowid LIMIT ?''',
+        (match, str(guild_id), limit))
+    return [rowid for rowid, in rows]
+
+
+async def search_rows(guild_id, match, rowids):
+    """Return the search hits among ``rowids`` that still match, in no particular order.
+
+    Rows are (rowid, kind, challenge_name, category, snippet, user_id,
+    thread_id, message_id, created_at), where kind is 'solve', 'active' or
+    'message' and the thread of a solve is the latest thread opened for
+    its challenge, preferring the solver's own.
+    """
+    guild_id = str(guild_id)
+    rowids = list(rowids)
+    return await fetchall(
+        f'''SELECT h.id, CASE h.id % 4 WHEN 0 THEN 'solve' WHEN 1 THEN 'active' ELSE 'message' END,
+                   COALESCE(h.challenge_name, t.challenge_name), COALESCE(h.category, t.category), h.snippet, h.user_id,
+                   COALESCE(h.thread_id,
+                            (SELECT MAX(ct.thread_id) FROM challenge_threads ct
+                              WHERE ct.guild_id = ? AND ct.challenge_name = h.challenge_name AND ct.user_id = h.user_id),
+                            (SELECT MAX(ct.thread_id) FROM challenge_threads ct
+                              WHERE ct.guild_id = ? AND ct.challenge_name = h.challenge_name)),
+                   m.message_id, h.created_at
+              FROM (SELECT rowid AS id, challenge_name, category,
+                           snippet(search_index, 2, '**', '**', '…', 24) AS snippet, user_id, thread_id, created_at
+                      FROM search_index
+                     WHERE search_index MATCH ? AND guild_id = ? AND rowid IN ({", ".join("?" * len(rowids))})) h
+              LEFT JOIN challenge_threads t ON t.thread_id = h.thread_id
+              LEFT JOIN thread_messages m ON h.id % 4 = 2 AND m.seq = h.id / 4''',
+        (guild_id, guild_id, match, guild_id, *rowids))
+
+
+# --- CTFtime response cache ---
+
+async def get_cached_response(key):
+    """Return (body, etag, last_modified, expires_at, stale_until) or None."""
+    return await fetchone(
+        '''SELECT body, etag, last_modified, expires_at, stale_until
+           FROM http_cache WHERE key = ?''', (key,))
+
+
+async def put_cached_response(key, body, etag, last_modified, fetched_at, expires_at, stale_until):
+    await execute(
+        '''INSERT OR REPLACE INTO http_cache
+           (key, body, etag, last_modified, fetched_at, expires_at, stale_until, last_access, size)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+        (key, body, etag, last_modified, fetched_at, expires_at, stale_until, fetched_at,
+         len(body.encode())))
+
+
+async def refresh_cached_response(key, etag, last_modified, fetched_at, expires_at, stale_until):
+    """Extend the lifetime of an entry that the server confirmed unchanged (HTTP 304)."""
+    await execute(
+        '''UPDATE http_cache
+           SET etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified),
+               fetched_at = ?, expires_at = ?, stale_until = ?, last_access = ?
+           WHERE key = ?''',
+        (etag, last_modified, fetched_at, expires_at, stale_until, fetched_at, key))
+
+
+async def touch_cached_response(key, accessed_at):
+    await execute('''UPDATE http_cache SET last_access = ? WHERE key = ?''', (accessed_at, key))
+
+
+async def evict_cached_responses(max_bytes):
+    """Drop least recently used entries until the cache fits in ``max_bytes``."""
+    await execute(
+        '''DELETE FROM http_cache WHERE key IN (
+               SELECT key FROM (
+                   SELECT key, SUM(size) OVER (ORDER BY last_access DESC, key) AS running
+                   FROM http_cache)
+               WHERE running > ?)''', (max_bytes,))
+
+
+# --- Scheduled jobs ---
+
+async def get_jobs():
+    """Return every pending job as (job_id, kind, run_at, payload, attempts)."""
+    rows = await fetchall(
+        '''SELECT job_id, kind, run_at, payload, attempts FROM scheduled_jobs ORDER BY run_at''')
+    return [(job_id, kind, run_at, json.loads(payload) if payload else None, attempts)
+            for job_id, kind, run_at, payload, attempts in rows]
+
+
+async def save_job(job_id, kind, run_at, payload=None, attempts=0):
+    await execute(
+        '''INSERT OR REPLACE INTO scheduled_jobs (job_id, kind, run_at, payload, attempts)
+           VALUES (?, ?, ?, ?, ?)''',
+        (job_id, kind, run_at, json.dumps(payload) if payload is not None else None, attempts))
+
+
+async def delete_job(job_id):
+    await execute('''DELETE FROM scheduled_jobs WHERE job_id = ?''', (job_id,))
+
+
+# --- User names ---
+
+async def get_user_name(user_id):
+    """Return (name, updated_at) for a user fetched before, or None."""
+    return await fetchone('''SELECT name, updated_at FROM user_names WHERE user_id = ?''', (str(user_id),))
+
+
+async def get_user_names(user_ids):
+    """Return (user_id, name, updated_at) for every given user fetched before."""
+    return await fetchall(
+        '''SELECT user_id, name, updated_at FROM user_names
+           WHERE user_id IN (SELECT value FROM json_each(?))''',
+        (json.dumps([str(uid) for uid in user_ids]),))
+
+
+async def set_user_name(user_id, name, updated_at):
+    await execute(
+        '''INSERT OR REPLACE INTO user_names (user_id, name, updated_at) VALUES (?, ?, ?)''',
+        (str(user_id), name, updated_at))
+
+
+# --- CTFtime event mirror ---
+
+CTFTIME_EVENT_COLUMNS = "event_id, title, start, finish, weight, format, url, ctftime_url, data"
+
+
+def ctftime_timestamp(value):
+    """Epoch seconds of a CTFtime ISO-8601 date, or None."""
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+def _ctftime_event_row(event, synced_at):
+    return (event["id"], event["title"], ctftime_timestamp(event["start"]), ctftime_timestamp(event.get("finish")),
+            event.get("weight") or 0,
+            event.get("format"), event.get("url"), event.get("ctftime_url"), json.dumps(event), synced_at)
+
+
+async def get_ctftime_sync_windows(since):
+    """Return {window_start: synced_at} for the sync windows starting at or after ``since``."""
+    rows = await fetchall(
+        '''SELECT window_start, synced_at FROM ctftime_sync_windows WHERE window_start >= ?''', (since,))
+    return dict(rows)
+
+
+async def save_ctftime_events(events, synced_at, window_start=None):
+    """Upsert CTFtime event dicts into the mirror and mark their sync window as done."""
+    async def apply(conn):
+        await conn.executemany(
+            f'''INSERT INTO ctftime_events ({CTFTIME_EVENT_COLUMNS}, synced_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (event_id) DO UPDATE SET
+                    title = excluded.title, start = excluded.start, finish = excluded.finish,
+                    weight = excluded.weight, format = excluded.format, url = excluded.url,
+                    ctftime_url = excluded.ctftime_url, data = excluded.data, synced_at = excluded.synced_at''',
+            [_ctftime_event_row(event, synced_at) for event in events])
+        if window_start is not None:
+            await conn.execute(
+                '''INSERT OR REPLACE INTO ctftime_sync_windows (window_start, synced_at) VALUES (?, ?)''',
+                (window_start, synced_at))
+
+    await write(apply)
+
+
+async def get_ctftime_event(event_id):
+    """Return the mirrored CTFtime JSON of an event, or None."""
+    row = await fetchone('''SELECT data FROM ctftime_events WHERE event_id = ?''', (int(event_id),))
+    return json.loads(row[0]) if row else None
+
+
+async def pick_ctftime_events(start, finish, soonest=4, top=2):
+    """Of the ``soonest`` events starting in [start, finish), return the ``top`` heaviest."""
+    rows = await fetchall(
+        '''SELECT data FROM (
+               SELECT data, weight, start FROM ctftime_events
+               WHERE start >= ? AND start < ? ORDER BY start, event_id LIMIT ?)
+           ORDER BY weight DESC, start LIMIT ?''', (start, finish, soonest, top))
+    return [json.loads(data) for data, in rows]
+
+
+async def get_ctftime_events_page(after, cursor=None, limit=15, query=None):
+    """Keyset page of events starting after ``after``, soonest first, optionally matching ``query``.
+
+    Rows are (start, event_id, title, finish, weight, format, url, ctftime_url).
+    """
+    clauses, params = ["start >= ?"], [after]
+    if query:
+        clauses.append("title LIKE ? ESCAPE '\\'")
+        params.append("%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+    if cursor:
+        clauses.append("(start, event_id) > (?, ?)")
+        params.extend(cursor)
+    return await fetchall(
+        f'''SELECT start, event_id, title, finish, weight, format, url, ctftime_url FROM ctftime_events
+            WHERE {" AND ".join(clauses)} ORDER BY start, event_id LIMIT ?''', (*params, limit))
+
+
+# --- CTF events ---
+
+CTF_EVENT_FIELDS = ("title", "announce_message_id", "channel_id", "role_id")
+
+
+async def get_ctf_events():
+    """Return every tracked CTF as (guild_id, event_id, title, announce_message_id, channel_id, role_id)."""
+    return await fetchall(
+        '''SELECT guild_id, event_id, title, announce_message_id, channel_id, role_id FROM ctf_events''')
+
+
+async def update_ctf_event(guild_id, event_id, **fields):
+    """Create a guild's event row if needed and set the given columns (None clears one)."""
+    columns = [name for name in fields if name in CTF_EVENT_FIELDS]
+    if len(columns) != len(fields):
+        raise ValueError(f"Unknown ctf_events columns: {set(fields) - set(CTF_EVENT_FIELDS)}")
+    key = (str(guild_id), str(event_id))
+
+    async def apply(conn):
+        await conn.execute('''INSERT OR IGNORE INTO ctf_events (guild_id, event_id) VALUES (?, ?)''', key)
+        if columns:
+            assignments = ", ".join(f"{name} = ?" for name in columns)
+            await conn.execute(
+                f'''UPDATE ctf_events SET {assignments} WHERE guild_id = ? AND event_id = ?''',
+                (*(fields[name] for name in columns), *key))
+
+    await write(apply)
@@ -0,0 +1,72 @@
+"""Full-text search for !search over challenges and their discussion threads.
+
+``search_index`` is an FTS5 table holding one row per solve, per active
+challenge and per message posted in a thread opened with !trying.
+Triggers on the source tables (migration 10) add, change and remove index
+rows in the same transaction as the write, so !add, !unsolve, !import and
+new messages update the index incrementally instead of rebuilding it.
+
+Hits are ranked with bm25, weighting challenge names over categories over
+message text. bm25 scores depend on statistics of the whole index, so
+every new solve or message shifts them and a keyset on the score would
+skip or repeat hits between pages. Each !search therefore ranks its hits
+once (at most MAX_HITS of them) and pages through that snapshot by
+position: hits indexed afterwards are not shown and removed ones are
+skipped.
+"""
+import re
+
+import db
+
+MAX_TERMS = 8
+MAX_HITS = 1000
+
+
+def match_query(text):
+    """Turn free text into an FTS5 query matching every word as a prefix; raises ValueError if it has none."""
+    words = re.findall(r"\w+", text)[:MAX_TERMS]
+    if not words:
+        raise ValueError("Give at least one word to search for.")
+    return " ".join(f'"{word}"*' for word in words)
+
+
+class ChallengeThreads:
+    """IDs of the threads opened with !trying, so messages elsewhere are skipped without a query."""
+
+    def __init__(self):
+        self._ids = set()
+
+    async def load(self):
+        self._ids = set(await db.get_challenge_thread_ids())
+
+    def __contains__(self, thread_id):
+        return thread_id in self._ids
+
+    def add(self, thread_id):
+        self._ids.add(thread_id)
+
+    async def forget(self, thread_id):
+        self._ids.discard(thread_id)
+        await db.forget_thread(thread_id)
+
+
+class SearchResults:
+    """The hits of one !search, ranked when the first page is fetched."""
+
+    def __init__(self, guild_id, match):
+        self.guild_id = guild_id
+        self.match = match
+        self._rowids = None
+
+    async def page(self, cursor, limit):
+        """Return up to ``limit`` rows (position, rowid, kind, ...) after the ``cursor`` position."""
+        if self._rowids is None:
+            self._rowids = await db.search_hits(self.guild_id, self.match, MAX_HITS)
+        position = 0 if cursor is None else cursor[0] + 1
+        rows = []
+        while len(rows) < limit and position < len(self._rowids):
+            rowids = self._rowids[position:position + limit - len(rows)]
+            found = {row[0]: row for row in await db.search_rows(self.guild_id, self.match, rowids)}
+            rows.extend((position + i, *found[rowid]) for i, rowid in enumerate(rowids) if rowid in found)
+            position += len(rowids)
+        return rows
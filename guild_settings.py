@@ -0,0 +1,62 @@
+"""Per-guild configuration, cached in memory over the ``guild_config`` table.
+
+Every channel, category and team the bot works with is a setting of the
+guild it runs in, so one process can serve many teams. All settings are
+loaded once at startup; ``guilds_with`` lets periodic loops visit only
+the guilds that configured the feature they serve.
+"""
+import re
+
+import db
+
+# Setting name -> description; these are the settings !config can change
+SETTINGS = {
+    "scoreboard_channel": "Channel holding the live scoreboard message",
+    "firstblood_channel": "Channel where first bloods are announced",
+    "ctftime_team_id": "CTFtime team ID shown in the team stats message",
+    "ctftime_team_channel": "Channel for the daily CTFtime team stats",
+    "upcoming_ctfs_channel": "Channel where upcoming CTFs are announced",
+    "ctf_running_category": "Category for channels of running CTFs",
+    "ctf_archive_category": "Category that finished CTF channels move to",
+}
+
+
+def parse_setting(value):
+    """Turn a channel mention or a plain ID into the stored ID; 'none' clears."""
+    if value.lower() in ("none", "off", "unset"):
+        return None
+    match = re.fullmatch(r"<#(\d+)>|(\d+)", value.strip())
+    if not match:
+        raise ValueError(f"`{value}` is not a channel mention or an ID.")
+    return int(match.group(1) or match.group(2))
+
+
+class GuildSettings:
+    def __init__(self):
+        self._settings = {}  # guild_id -> {key: value}
+
+    async def load(self):
+        self._settings.clear()
+        for guild_id, key, value in await db.get_guild_config_rows():
+            if key in SETTINGS:
+                self._settings.setdefault(guild_id, {})[key] = int(value)
+
+    def get(self, guild_id, key):
+        return self._settings.get(str(guild_id), {}).get(key)
+
+    def all(self, guild_id):
+        return dict(self._settings.get(str(guild_id), {}))
+
+    async def set(self, guild_id, key, value):
+        if key not in SETTINGS:
+            raise ValueError(f"Unknown setting `{key}`.")
+        await db.set_guild_config(guild_id, key, value)
+        settings = self._settings.setdefault(str(guild_id), {})
+        if value is None:
+            settings.pop(key, None)
+        else:
+            settings[key] = int(value)
+
+    def guilds_with(self, key):
+        """Return (guild_id, value) for every guild that set ``key``."""
+        return [(int(guild_id), settings[key]) for guild_id, settings in self._settings.items() if key in settings]
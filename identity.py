@@ -0,0 +1,112 @@
+"""Resolve Discord user IDs to names without a REST call per row.
+
+Lookups go, in order, through the gateway cache (``client.get_user``), a
+bounded in-memory LRU with a TTL, the ``user_names`` table, and only then
+``client.fetch_user``. Concurrent lookups of the same ID share a single
+REST request, and ``resolve_many`` resolves a whole listing at once.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+
+import discord
+
+import db
+import metrics
+
+
+class ResolvedUser:
+    """The subset of ``discord.User`` the embeds need."""
+
+    __slots__ = ("id", "name")
+
+    def __init__(self, user_id, name):
+        self.id = int(user_id)
+        self.name = name
+
+    @property
+    def mention(self):
+        return f"<@{self.id}>"
+
+
+class UserResolver:
+    def __init__(self, client, max_size=2048, ttl=24 * 3600, max_concurrency=5):
+        self.client = client
+        self.max_size = max_size
+        self.ttl = ttl
+        self._cache = OrderedDict()  # user_id -> (ResolvedUser, expires_at)
+        self._inflight = {}
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    def _remember(self, user, ttl=None):
+        self._cache[user.id] = (user, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self._cache.move_to_end(user.id)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    def _cached(self, user_id):
+        entry = self._cache.get(user_id)
+        if entry is None:
+            return None
+        user, expires_at = entry
+        if time.monotonic() >= expires_at:
+            del self._cache[user_id]
+            return None
+        self._cache.move_to_end(user_id)
+        return user
+
+    def forget(self, user_id):
+        self._cache.pop(int(user_id), None)
+
+    async def warm(self, user_ids):
+        """Load the stored names of ``user_ids`` into the cache with one query."""
+        now = time.time()
+        for user_id, name, updated_at in await db.get_user_names(user_ids):
+            if now - updated_at < self.ttl:
+                self._remember(ResolvedUser(user_id, name), ttl=self.ttl - (now - updated_at))
+
+    async def resolve(self, user_id):
+        user_id = int(user_id)
+        if (member := self.client.get_user(user_id)) is not None:
+            metrics.CACHE_LOOKUPS.inc(cache="user_names", result="gateway")
+            return ResolvedUser(user_id, member.name)
+        if (user := self._cached(user_id)) is not None:
+            metrics.CACHE_LOOKUPS.inc(cache="user_names", result="memory")
+            return user
+        if user_id not in self._inflight:
+            self._inflight[user_id] = asyncio.ensure_future(self._load(user_id))
+        return await asyncio.shield(self._inflight[user_id])
+
+    async def _load(self, user_id):
+        try:
+            return await self._lookup(user_id)
+        finally:
+            self._inflight.pop(user_id, None)
+
+    async def _lookup(self, user_id):
+        row = await db.get_user_name(user_id)
+        if row and time.time() - row[1] < self.ttl:
+            metrics.CACHE_LOOKUPS.inc(cache="user_names", result="database")
+            user = ResolvedUser(user_id, row[0])
+            self._remember(user)
+            return user
+        metrics.CACHE_LOOKUPS.inc(cache="user_names", result="miss")
+        try:
+            async with self._semaphore:
+                fetched = await self.client.fetch_user(user_id)
+        except discord.HTTPException as e:
+            if row:
+                # Better a stale name than none at all
+                return ResolvedUser(user_id, row[0])
+            print(f"Failed to fetch user {user_id}: {e}")
+            return ResolvedUser(user_id, f"Unknown user {user_id}")
+        user = ResolvedUser(user_id, fetched.name)
+        self._remember(user)
+        await db.set_user_name(user_id, fetched.name, time.time())
+        return user
+
+    async def resolve_many(self, user_ids):
+        """Resolve a batch of IDs; returns {user_id: ResolvedUser}."""
+        unique = list(dict.fromkeys(int(uid) for uid in user_ids))
+        users = await asyncio.gather(*(self.resolve(uid) for uid in unique))
+        return dict(zip(unique, users))
@@ -0,0 +1,63 @@
+"""Append-only solve ledger: verification, snapshots and rebuilds.
+
+Every change to a user's points, first bloods or flag count is an event
+in ``solve_ledger``: ``solve`` and ``unsolve`` from !add, !unsolve and
+!import, ``rescore`` when the scoring rules or a decaying challenge's
+value change, ``reset`` from !reset_scoreboard, and ``adjust`` for admin
+corrections and the opening balances migrations 8 and 9 wrote from the
+old counters. The ``users`` table is a projection of the ledger that
+each write updates in the same transaction as its event.
+
+``snapshot`` folds the ledger into ``ledger_snapshots`` from time to time,
+so the projection can be rebuilt from the latest snapshot plus the tail.
+``verify`` replays the whole ledger with grouped queries and checks it
+against the projection, the snapshot and ``solved_challenges``.
+"""
+import time
+
+import db
+
+FIELDS = ("points", "first_bloods", "flags")
+
+
+class LedgerReport:
+    def __init__(self, events, users, mismatches, seconds):
+        self.events = events
+        self.users = users
+        self.mismatches = mismatches  # (guild_id, user_id, check, field, expected, actual)
+        self.seconds = seconds
+
+    @property
+    def ok(self):
+        return not self.mismatches
+
+
+def _compare(mismatches, check, expected, actual, fields):
+    for key in expected.keys() | actual.keys():
+        want = expected.get(key, (0,) * len(fields))
+        got = actual.get(key, (0,) * len(fields))
+        for field, a, b in zip(fields, want, got):
+            if a != b:
+                mismatches.append((*key, check, field, a, b))
+
+
+async def verify(guild_id):
+    """Replay a guild's ledger and compare it with every aggregate derived from it."""
+    start = time.perf_counter()
+    check = await db.get_ledger_check(guild_id)
+    replay = check["replay"]
+    mismatches = []
+    _compare(mismatches, "users table", {k: v[:2] for k, v in replay.items()}, check["users"], FIELDS[:2])
+    _compare(mismatches, "snapshot + tail", replay, check["projection"], FIELDS)
+    _compare(mismatches, "solved challenges", {k: v[1:] for k, v in replay.items()}, check["solves"], FIELDS[1:])
+    mismatches.sort()
+    return LedgerReport(check["events"], len(replay), mismatches, time.perf_counter() - start)
+
+
+async def snapshot():
+    return await db.snapshot_ledger()
+
+
+async def rebuild(guild_id):
+    """Rewrite a guild's users rows from the latest snapshot plus the ledger tail."""
+    return await db.rebuild_user_totals(guild_id)
@@ -0,0 +1,118 @@
+"""Paginated listings for !solved, !working, !upcoming and !search.
+
+Pages are read with keyset pagination on (timestamp, rowid) in the order
+of the page query, so every page costs one indexed query of at most
+``PAGE_ROWS + 1`` rows no matter how large the table is, and only the
+users on that page are resolved. A page stops early if the next row would push the embed
+past Discord's description limit. Previous/Next buttons fetch pages on
+demand.
+"""
+import re
+from datetime import datetime, timedelta
+
+import discord
+
+EMBED_DESCRIPTION_LIMIT = 4096
+PAGE_ROWS = 15
+FILTER_HELP = "Filters: `category:<name>` `user:@user` `since:YYYY-MM-DD` `until:YYYY-MM-DD`"
+
+
+def parse_filters(args):
+    """Turn ``key:value`` command arguments into keyword filters for the page queries."""
+    filters = {}
+    for arg in args:
+        key, sep, value = arg.partition(":")
+        key = key.lower()
+        if not sep or not value:
+            raise ValueError(f"Invalid filter `{arg}`. {FILTER_HELP}")
+        if key == "category":
+            filters["category"] = value.lower()
+        elif key == "user":
+            match = re.search(r"\d{15,20}", value)
+            if not match:
+                raise ValueError(f"Invalid user `{value}`, mention the user or give their ID.")
+            filters["user_id"] = match.group()
+        elif key in ("since", "until"):
+            try:
+                day = datetime.strptime(value, "%Y-%m-%d")
+            except ValueError:
+                raise ValueError(f"Invalid date `{value}`, expected YYYY-MM-DD.")
+            if key == "until":
+                day += timedelta(days=1)  # Include the whole day
+            filters[key] = day.strftime("%Y-%m-%d")
+        else:
+            raise ValueError(f"Unknown filter `{key}`. {FILTER_HELP}")
+    return filters
+
+
+class ListingView(discord.ui.View):
+    """One paginated listing message.
+
+    ``fetch_page(cursor, limit)`` returns rows whose first two columns are
+    the (timestamp, rowid) keyset; ``format_rows(rows)`` returns one text
+    block per row.
+    """
+
+    def __init__(self, author_id, fetch_page, format_rows, title, color, page_rows=PAGE_ROWS, timeout=180):
+        super().__init__(timeout=timeout)
+        self.author_id = author_id
+        self.fetch_page = fetch_page
+        self.format_rows = format_rows
+        self.title = title
+        self.color = color
+        self.page_rows = page_rows
+        self.cursors = [None]  # cursors[i] is the keyset page i starts after
+        self.page = 0
+        self.empty = False
+        self.message = None
+
+    async def render(self):
+        rows = await self.fetch_page(self.cursors[self.page], self.page_rows + 1)
+        blocks = await self.format_rows(rows[:self.page_rows])
+        desc = ""
+        shown = 0
+        for block in blocks:
+            if len(desc) + len(block) > EMBED_DESCRIPTION_LIMIT:
+                break
+            desc += block
+            shown += 1
+        has_next = shown < len(rows)
+        del self.cursors[self.page + 1:]
+        if has_next:
+            self.cursors.append(tuple(rows[shown - 1][:2]))
+        self.empty = self.page == 0 and not rows
+        self.previous.disabled = self.page == 0
+        self.next.disabled = not has_next
+        embed = discord.Embed(title=self.title, description=desc, color=self.color)
+        embed.set_footer(text=f"Page {self.page + 1}")
+        return embed
+
+    async def send(self, ctx, embed):
+        if self.previous.disabled and self.next.disabled:
+            self.stop()
+            self.message = await ctx.send(embed=embed)
+        else:
+            self.message = await ctx.send(embed=embed, view=self)
+
+    async def interaction_check(self, interaction):
+        if interaction.user.id != self.author_id:
+            await interaction.response.send_message("Run the command yourself to browse this list.", ephemeral=True)
+            return False
+        return True
+
+    async def on_timeout(self):
+        if self.message is not None:
+            try:
+                await self.message.edit(view=None)
+            except discord.HTTPException:
+                pass
+
+    @discord.ui.button(label="◀ Previous", style=discord.ButtonStyle.secondary)
+    async def previous(self, interaction, button):
+        self.page = max(0, self.page - 1)
+        await interaction.response.edit_message(embed=await self.render(), view=self)
+
+    @discord.ui.button(label="Next ▶", style=discord.ButtonStyle.secondary)
+    async def next(self, interaction, button):
+        self.page += 1
+        await interaction.response.edit_message(embed=await self.render(), view=self)
@@ -1,132 +1,165 @@
 import discord
-import sqlite3
 import os
 from datetime import datetime, timedelta
 from discord.ext import commands
 from discord.utils import get, escape_markdown
-import atexit
-import requests
-from discord.ext import tasks
 import pytz
-import json
 import asyncio
 import random
 import string
+import time
+from typing import Optional
+
+from actions import BACKGROUND, INTERACTIVE, ActionQueue, roles_bucket
+from announcer import Announcer
+import bulk
+import db
+import fulltext
+import ledger
+import metrics
+from ctf_events import CTFEventIndex
+from ctftime import CTFtimeClient, CTFtimeError, ResponseCache
+from ctftime_mirror import CTFtimeMirror
+from guild_settings import SETTINGS, GuildSettings, parse_setting
+from identity import UserResolver
+from listings import ListingView, parse_filters
+from media import MediaCache
+from publisher import SCOREBOARD_DIGEST_KEY, ScoreboardPublisher
+from ranking import RankingIndex
+import rollups
+import scoring
+from stats import StatsCache
+from scheduler import DeadlineScheduler
 
 # Initialize bot with intents
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
-client = commands.Bot(command_prefix="!", intents=intents)
-client.remove_command('help')
 
-# Database setup
-conn = sqlite3.connect('ctf_team.db')
-cursor = conn.cursor()
-
-# Create tables with proper schema
-cursor.execute('''CREATE TABLE IF NOT EXISTS users (
-                user_id TEXT PRIMARY KEY,
-                first_bloods INTEGER DEFAULT 0,
-                points INTEGER DEFAULT 0)''')
-
-cursor.execute('''CREATE TABLE IF NOT EXISTS solved_challenges (
-                challenge_name TEXT,
-                category TEXT,
-                difficulty TEXT,
-                first_blood INTEGER DEFAULT 0,
-                user_id TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id))''')
-
-cursor.execute('''CREATE TABLE IF NOT EXISTS active_challenges (
-                challenge_name TEXT,
-                category TEXT,
-                user_id TEXT,
-                thread_id TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''')
-
-cursor.execute('''CREATE TABLE IF NOT EXISTS bot_config (
-    key TEXT PRIMARY KEY,
-    value TEXT
-)''')
-
-cursor.execute('''CREATE TABLE IF NOT EXISTS ctf_participation (
-    user_id TEXT,
-    event_id TEXT,
-    PRIMARY KEY (user_id, event_id)
-)''')
-conn.commit()
-
-SCOREBOARD_CHANNEL_ID = 1437730193274966136  # Scoreboard channel
-SCOREBOARD_CONFIG_KEY = "scoreboard_message_id"
-
-# Store/retrieve scoreboard message ID in DB
-def get_scoreboard_message_id():
-    cursor.execute("SELECT value FROM bot_config WHERE key = ?", (SCOREBOARD_CONFIG_KEY,))
-    row = cursor.fetchone()
-    return int(row[0]) if row else None
-
-def set_scoreboard_message_id(message_id):
-    cursor.execute("INSERT OR REPLACE INTO bot_config (key, value) VALUES (?, ?)", (SCOREBOARD_CONFIG_KEY, str(message_id)))
-    conn.commit()
-
-async def get_scoreboard_channel(guild):
-    return guild.get_channel(SCOREBOARD_CHANNEL_ID)
-
-async def update_scoreboard_message(guild, debug_ctx=None):
-    channel = await get_scoreboard_channel(guild)
+
+class LainBot(commands.AutoShardedBot):
+    async def setup_hook(self):
+        if METRICS_PORT:
+            await metrics_server.start()
+        await db.init()
+        await guild_settings.load()
+        await scoring_config.load()
+        await media.load()
+        await ctftime.start()
+        await ranking.load()
+        await ctf_events.load()
+        await challenge_threads.load()
+        await users.warm(uid for guild_id in ranking.guilds() for uid, *_ in ranking.top(guild_id, MAX_SCOREBOARD_SIZE))
+        await scheduler.start()
+        startup["setup"] = time.monotonic()
+
+    async def close(self):
+        await announcer.drain()
+        for publisher in scoreboard_publishers.values():
+            await publisher.drain()
+        await actions.drain()
+        await super().close()
+        await self.stop_services()
+
+    async def stop_services(self):
+        """Stop everything setup_hook started, saving state for the next start."""
+        await scheduler.stop()
+        await ranking.save()
+        await ctftime.close()
+        await media.close()
+        await db.close()
+        await metrics_server.close()
+
+
+# Monotonic timestamps of each startup milestone, for measuring time-to-ready
+startup = {"started": time.monotonic(), "setup": None, "connected": None, "ready": None}
+STARTUP_DEFER_TIMEOUT = float(os.getenv("STARTUP_DEFER_TIMEOUT", "60"))  # Max seconds background work waits for the first command
+first_command_served = asyncio.Event()
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))  # 0 disables the /metrics endpoint
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0")) or None  # None lets Discord pick the shard count
+# Rate limits longer than this are handed back to the action queue instead of blocking the caller (minimum 30)
+RATELIMIT_TIMEOUT = max(30.0, float(os.getenv("RATELIMIT_TIMEOUT", "30")))
+
+client = LainBot(command_prefix="!", intents=intents, shard_count=SHARD_COUNT, max_ratelimit_timeout=RATELIMIT_TIMEOUT)
+client.remove_command('help')
+ctftime = CTFtimeClient(cache=ResponseCache())
+ctftime_mirror = CTFtimeMirror(ctftime)
+scheduler = DeadlineScheduler()
+users = UserResolver(client)
+ranking = RankingIndex()
+user_stats = StatsCache()
+ctf_events = CTFEventIndex()
+challenge_threads = fulltext.ChallengeThreads()
+guild_settings = GuildSettings()
+scoring_config = scoring.ScoringConfig()
+announcer = Announcer(max_concurrency=int(os.getenv("ANNOUNCE_CONCURRENCY", "4")))
+actions = ActionQueue(max_concurrency=int(os.getenv("DISCORD_ACTION_CONCURRENCY", "2")))
+metrics_server = metrics.MetricsServer(METRICS_HOST, METRICS_PORT)
+media = MediaCache(["Easy_FirstBlood.gif", "Medium_FirstBlood.gif", "Hard_FirstBlood.gif", "solved.webp"])
+
+SCOREBOARD_UPDATE_WINDOW = float(os.getenv("SCOREBOARD_UPDATE_WINDOW", "5"))  # Seconds between scoreboard edits
+SCOREBOARD_SIZE = 10  # Players shown on the scoreboard message
+MAX_SCOREBOARD_SIZE = 25  # Discord allows at most 25 embed fields
+
+ALLOWED_CATEGORIES = ['misc', 'web', 'crypto', 'reverse', 'blockchain', 'dfir', 'osint', 'pwn', 'android', 'ppc']
+ALLOWED_DIFFICULTIES = ['easy', 'medium', 'hard']
+
+# Settings of the guild this bot served before per-guild configuration; seeded when its data is claimed
+LEGACY_GUILD_SETTINGS = {
+    "scoreboard_channel": 1437730193274966136,
+    "firstblood_channel": 1437730232072147076,
+    "ctftime_team_id": 303159,
+    "ctftime_team_channel": 1437730458464161792,
+    "upcoming_ctfs_channel": 1437730129865347083,
+    "ctf_running_category": 1437730339924607036,
+    "ctf_archive_category": 1437730381091835974,
+}
+# bot_config keys that became per-guild configuration
+LEGACY_CONFIG_KEYS = [db.SCOREBOARD_CONFIG_KEY, db.CTFTIME_TEAM_CONFIG_KEY, SCOREBOARD_DIGEST_KEY]
+
+def get_setting_channel(guild, key):
+    """The channel or category a guild configured for ``key``, or None."""
+    channel_id = guild_settings.get(guild.id, key)
+    return guild.get_channel(channel_id) if channel_id else None
+
+scoreboard_publishers = {}
+
+def get_scoreboard_publisher(guild_id):
+    if guild_id not in scoreboard_publishers:
+        scoreboard_publishers[guild_id] = ScoreboardPublisher(
+            guild_id, lambda: generate_scoreboard_embed(guild_id), window=SCOREBOARD_UPDATE_WINDOW)
+    return scoreboard_publishers[guild_id]
+
+async def update_scoreboard_message(guild, debug_ctx=None, immediate=False):
+    """Publish the guild's scoreboard; changes are coalesced unless ``immediate`` is set."""
+    channel = get_setting_channel(guild, "scoreboard_channel")
     if not channel:
-        msg = f"Scoreboard channel '{SCOREBOARD_CHANNEL_ID}' not found!"
+        msg = f"Scoreboard channel not found in {guild.name}! Set it with `!config scoreboard_channel #channel`."
         print(msg)
         if debug_ctx:
             await debug_ctx.send(msg)
         return
-    embed = await generate_scoreboard_embed()
-    message_id = get_scoreboard_message_id()
-    msg = None
-    if message_id:
-        try:
-            msg = await channel.fetch_message(message_id)
-            await msg.edit(content=None, embed=embed)
-            return
-        except Exception as e:
-            print(f"Failed to edit scoreboard message: {e}")
-    # If not found, create a new scoreboard message and store its ID
-    msg = await channel.send(embed=embed)
-    set_scoreboard_message_id(msg.id)
-
-SCOREBOARD_MESSAGE_ID = 1437731093678788628  # Hardcoded message ID to always update
-FIRSTBLOOD_CHANNEL_ID = 1437730232072147076
-
-CTFTIME_TEAM_ID = 303159
-CTFTIME_TEAM_CHANNEL_ID = 1437730458464161792
-CTFTIME_TEAM_CONFIG_KEY = "ctftime_team_message_id"
-
-UPCOMING_CTFS_CHANNEL_ID = 1437730129865347083
-CTF_ANNOUNCE_CONFIG_KEY = "ctf_announce_message_ids"  # Will store as JSON: {event_id: message_id}
-
-CTF_RUNNING_CATEGORY_ID = 1437730339924607036
-CTF_ARCHIVE_CATEGORY_ID = 1437730381091835974
-CTF_CHANNELS_CONFIG_KEY = "ctf_channels"  # Will store as JSON: {event_id: channel_id}
-
-CTF_ROLES_CONFIG_KEY = "ctf_roles"  # Will store as JSON: {event_id: role_id}
+    publisher = get_scoreboard_publisher(guild.id)
+    if immediate:
+        await publisher.publish(channel)
+    else:
+        publisher.mark_dirty(channel)
 
-async def generate_scoreboard_embed():
-    cursor.execute(
-        '''SELECT u.user_id, COUNT(sc.challenge_name), u.points, u.first_bloods
-            FROM users u
-            LEFT JOIN solved_challenges sc ON u.user_id = sc.user_id
-            GROUP BY u.user_id
-            ORDER BY u.points DESC LIMIT 10''')
-    leaderboard = cursor.fetchall()
+async def generate_scoreboard_embed(guild_id, size=SCOREBOARD_SIZE, window=None):
+    if window is None:
+        leaderboard = ranking.top(guild_id, min(size, MAX_SCOREBOARD_SIZE))
+    else:
+        leaderboard = await rollups.leaderboard(guild_id, window, scoring_config.get(guild_id), min(size, MAX_SCOREBOARD_SIZE))
+    resolved = await users.resolve_many(uid for uid, *_ in leaderboard)
     embed = discord.Embed(
-        title="🏆 Server Scoreboard 🏆",
-        description="Here are the top 10 players ranked by points:",
+        title="🏆 Server Scoreboard 🏆" if window is None else f"🏆 Scoreboard: {window.label} 🏆",
+        description=f"Here are the top {size} players ranked by points:",
         color=discord.Color.gold()
     )
     for rank, (uid, flags, points, fbs) in enumerate(leaderboard, 1):
-        user = await client.fetch_user(uid)
+        user = resolved[int(uid)]
         if rank == 1:
             medal = "🥇"
         elif rank == 2:
@@ -142,16 +175,25 @@ async def generate_scoreboard_embed():
         )
     return embed
 
-@tasks.loop(hours=24)
+@metrics.timed_loop(hours=24)
 async def update_ctftime_team_stats():
     await client.wait_until_ready()
-    guild = discord.utils.get(client.guilds)
-    channel = guild.get_channel(CTFTIME_TEAM_CHANNEL_ID)
+    for guild_id, team_id in guild_settings.guilds_with("ctftime_team_id"):
+        guild = client.get_guild(guild_id)
+        if not guild:
+            continue
+        try:
+            await update_guild_ctftime_team_stats(guild, team_id)
+        except Exception as e:
+            print(f"Failed to update CTFtime team stats in {guild.name}: {e}")
+
+async def update_guild_ctftime_team_stats(guild, team_id):
+    channel = get_setting_channel(guild, "ctftime_team_channel")
     if not channel:
-        print(f"CTFtime team channel with ID {CTFTIME_TEAM_CHANNEL_ID} not found.")
+        print(f"CTFtime team channel not found in {guild.name}.")
         return
-    embed = await generate_ctftime_team_embed()
-    message_id = get_ctftime_team_message_id()
+    embed = await generate_ctftime_team_embed(team_id)
+    message_id = await db.get_ctftime_team_message_id(guild.id)
     if message_id:
         try:
             msg = await channel.fetch_message(message_id)
@@ -161,24 +203,15 @@ async def update_ctftime_team_stats():
             print(f"Failed to edit CTFtime team message: {e}")
     # If message doesn't exist, send a new one and store its ID
     msg = await channel.send(embed=embed)
-    set_ctftime_team_message_id(msg.id)
-
-def get_ctftime_team_message_id():
-    cursor.execute("SELECT value FROM bot_config WHERE key = ?", (CTFTIME_TEAM_CONFIG_KEY,))
-    row = cursor.fetchone()
-    return int(row[0]) if row else None
+    await db.set_ctftime_team_message_id(guild.id, msg.id)
 
-def set_ctftime_team_message_id(message_id):
-    cursor.execute("INSERT OR REPLACE INTO bot_config (key, value) VALUES (?, ?)", (CTFTIME_TEAM_CONFIG_KEY, str(message_id)))
-    conn.commit()
-
-async def generate_ctftime_team_embed():
-    url = f"https://ctftime.org/api/v1/teams/{CTFTIME_TEAM_ID}/"
-    resp = requests.get(url)
-    if resp.status_code != 200:
+async def generate_ctftime_team_embed(team_id):
+    try:
+        data = await ctftime.get_team(team_id)
+    except CTFtimeError as e:
+        print(f"Failed to fetch team data from CTFtime: {e}")
         embed = discord.Embed(title="CTFtime Team Stats", description="Failed to fetch team data from CTFtime.", color=discord.Color.red())
         return embed
-    data = resp.json()
     team_name = data.get("name", "Unknown")
     rating_points = data.get("rating_points", "N/A")
     logo_url = data.get("logo", "https://ctftime.org/static/images/logo_ctftime.png")
@@ -207,17 +240,6 @@ async def generate_ctftime_team_embed():
     embed.set_thumbnail(url=logo_url)
     return embed
 
-def get_ctf_announce_message_ids():
-    cursor.execute("SELECT value FROM bot_config WHERE key = ?", (CTF_ANNOUNCE_CONFIG_KEY,))
-    row = cursor.fetchone()
-    if row:
-        return json.loads(row[0])
-    return {}
-
-def set_ctf_announce_message_ids(mapping):
-    cursor.execute("INSERT OR REPLACE INTO bot_config (key, value) VALUES (?, ?)", (CTF_ANNOUNCE_CONFIG_KEY, json.dumps(mapping)))
-    conn.commit()
-
 async def generate_ctf_announcement_embed(event, now=None):
     title = event.get("title", "Unknown CTF")
     start = event.get("start", "")
@@ -258,37 +280,14 @@ async def generate_ctf_announcement_embed(event, now=None):
         embed.set_thumbnail(url=event["logo"])
     return embed
 
-def get_ctf_channels_mapping():
-    cursor.execute("SELECT value FROM bot_config WHERE key = ?", (CTF_CHANNELS_CONFIG_KEY,))
-    row = cursor.fetchone()
-    if row:
-        return json.loads(row[0])
-    return {}
-
-def set_ctf_channels_mapping(mapping):
-    cursor.execute("INSERT OR REPLACE INTO bot_config (key, value) VALUES (?, ?)", (CTF_CHANNELS_CONFIG_KEY, json.dumps(mapping)))
-    conn.commit()
-
-def get_ctf_roles_mapping():
-    cursor.execute("SELECT value FROM bot_config WHERE key = ?", (CTF_ROLES_CONFIG_KEY,))
-    row = cursor.fetchone()
-    if row:
-        return json.loads(row[0])
-    return {}
-
-def set_ctf_roles_mapping(mapping):
-    cursor.execute("INSERT OR REPLACE INTO bot_config (key, value) VALUES (?, ?)", (CTF_ROLES_CONFIG_KEY, json.dumps(mapping)))
-    conn.commit()
-
-async def create_ctf_role_and_permissions(guild, ctf_name, event_id, ctf_channel):
+async def create_ctf_role_and_permissions(guild, ctf_name, event_id, ctf_channel, priority=BACKGROUND):
     # Role name: ctf_name (already sanitized)
     role = discord.utils.get(guild.roles, name=ctf_name)
     if not role:
-        role = await guild.create_role(name=ctf_name, mentionable=False)
+        role = await actions.submit(roles_bucket(guild), lambda: guild.create_role(name=ctf_name, mentionable=False),
+                                    priority, label=f"create role {ctf_name}")
     # Store mapping event_id -> role_id
-    ctf_roles = get_ctf_roles_mapping()
-    ctf_roles[event_id] = role.id
-    set_ctf_roles_mapping(ctf_roles)
+    await ctf_events.update(guild.id, event_id, role_id=role.id)
     # Set channel permissions: only users with the role (and admins) can see/talk
     overwrites = {
         guild.default_role: discord.PermissionOverwrite(view_channel=False),
@@ -298,26 +297,34 @@ async def create_ctf_role_and_permissions(guild, ctf_name, event_id, ctf_channel
     for admin_role in guild.roles:
         if admin_role.permissions.administrator:
             overwrites[admin_role] = discord.PermissionOverwrite(view_channel=True)
-    await ctf_channel.edit(overwrites=overwrites)
+    await actions.edit_channel(ctf_channel, priority, overwrites=overwrites)
     return role
 
-@tasks.loop(hours=24)
+@metrics.timed_loop(hours=6)
+async def snapshot_ledger():
+    seq = await ledger.snapshot()
+    if seq is not None:
+        print(f"Snapshotted the solve ledger at event {seq}.")
+
+@metrics.timed_loop(hours=1)
+async def sync_ctftime_events():
+    refreshed = await ctftime_mirror.sync()
+    if refreshed:
+        print(f"Synced {refreshed} CTFtime event window(s).")
+
+async def pick_upcoming_ctfs(now):
+    """The two heaviest of the four CTFs starting soonest within 30 days."""
+    await ctftime_mirror.sync()
+    return await ctftime_mirror.pick(now.timestamp(), (now + timedelta(days=30)).timestamp())
+
+@metrics.timed_loop(hours=24)
 async def announce_upcoming_ctfs():
     await client.wait_until_ready()
     now = datetime.now(pytz.utc)
     weekday = now.weekday()
     if weekday not in [2, 3]:  # 2=Wednesday, 3=Thursday
         return
-    start_ts = int(now.timestamp())
-    finish_ts = int((now + timedelta(days=30)).timestamp())
-    url = f"https://ctftime.org/api/v1/events/?limit=10&start={start_ts}&finish={finish_ts}"
-    resp = requests.get(url)
-    if resp.status_code != 200:
-        print("Failed to fetch upcoming CTFs from CTFtime.")
-        return
-    events = resp.json()
-    events = sorted(events, key=lambda e: e.get('start', ''))[:4]
-    top2 = sorted(events, key=lambda e: e.get('weight', 0), reverse=True)[:2]
+    top2 = await pick_upcoming_ctfs(now)
     to_post = None
     if weekday == 2:
         to_post = top2[0] if len(top2) > 0 else None
@@ -326,31 +333,33 @@ async def announce_upcoming_ctfs():
     if not to_post:
         print("No CTF to announce today.")
         return
-    channel = None
-    for guild in client.guilds:
-        ch = guild.get_channel(UPCOMING_CTFS_CHANNEL_ID)
-        if ch:
-            channel = ch
-            break
-    if not channel:
-        print(f"Upcoming CTFs channel with ID {UPCOMING_CTFS_CHANNEL_ID} not found.")
-        return
-    mapping = get_ctf_announce_message_ids()
+    for guild_id, channel_id in guild_settings.guilds_with("upcoming_ctfs_channel"):
+        guild = client.get_guild(guild_id)
+        channel = guild.get_channel(channel_id) if guild else None
+        if not channel:
+            print(f"Upcoming CTFs channel with ID {channel_id} not found.")
+            continue
+        try:
+            await announce_ctf(channel, to_post, now)
+        except Exception as e:
+            print(f"Failed to announce CTF {to_post.get('id')} in {guild.name}: {e}")
+
+async def announce_ctf(channel, to_post, now):
+    """Announce a CTFtime event in a guild and create its channel and role."""
+    guild = channel.guild
     event_id = str(to_post["id"])
-    if event_id in mapping:
-        print(f"Event {event_id} already announced, skipping.")
+    if ctf_events.is_announced(guild.id, event_id):
+        print(f"Event {event_id} already announced in {guild.name}, skipping.")
         return
     embed = await generate_ctf_announcement_embed(to_post, now=now)
     msg = await channel.send(content="@everyone", embed=embed, allowed_mentions=discord.AllowedMentions(everyone=True))
     await msg.add_reaction("🔥")
-    mapping[event_id] = msg.id
-    set_ctf_announce_message_ids(mapping)
+    await ctf_events.update(guild.id, event_id, title=to_post.get("title"), announce_message_id=msg.id)
 
     # --- Step 1: Create a text channel for the CTF ---
-    guild = channel.guild
     ctf_name = to_post.get("title", "ctf").replace(" ", "-")
     ctf_name = ctf_name[:90]  # Discord channel name limit is 100 chars, keep some margin
-    running_category = guild.get_channel(CTF_RUNNING_CATEGORY_ID)
+    running_category = get_setting_channel(guild, "ctf_running_category")
     if running_category and isinstance(running_category, discord.CategoryChannel):
         ctf_channel = await guild.create_text_channel(
             name=ctf_name,
@@ -364,22 +373,20 @@ async def announce_upcoming_ctfs():
             to_post.get('url', 'N/A'),
             to_post.get('discord_url') or to_post.get('discord')
         )
-        ctf_channels = get_ctf_channels_mapping()
-        ctf_channels[event_id] = ctf_channel.id
-        set_ctf_channels_mapping(ctf_channels)
+        await ctf_events.update(guild.id, event_id, channel_id=ctf_channel.id)
         print(f"Created channel {ctf_channel.name} for CTF {event_id}")
+        await schedule_ctf_archive(guild.id, to_post)
         # Create role and set permissions
         role = await create_ctf_role_and_permissions(guild, ctf_name, event_id, ctf_channel)
         await send_ctf_start_message(guild, event_id, ctf_name, role)
     else:
-        print(f"CTF Running category with ID {CTF_RUNNING_CATEGORY_ID} not found or not a category.")
+        print(f"CTF Running category not found in {guild.name} or not a category.")
 
 async def send_ctf_start_message(guild, event_id, ctf_name, role):
-    ctf_channels = get_ctf_channels_mapping()
-    channel_id = ctf_channels.get(event_id)
-    if not channel_id:
+    event = ctf_events.get(guild.id, event_id)
+    if not event or not event.channel_id:
         return
-    channel = guild.get_channel(channel_id)
+    channel = guild.get_channel(event.channel_id)
     if not channel:
         return
     await channel.send(
@@ -398,23 +405,23 @@ async def send_ctf_start_message(guild, event_id, ctf_name, role):
     )
 
 async def send_ctf_end_message(guild, event_id, ctf_name, role):
-    ctf_channels = get_ctf_channels_mapping()
-    channel_id = ctf_channels.get(event_id)
-    if not channel_id:
+    event = ctf_events.get(guild.id, event_id)
+    if not event or not event.channel_id:
         return
-    channel = guild.get_channel(channel_id)
+    channel = guild.get_channel(event.channel_id)
     if not channel:
         return
-    await channel.send(
+    await actions.send(channel, content=(
         f"{role.mention}\n\n"
         f"🎉 The CTF Event '{escape_markdown(ctf_name)}' has officially ended! 🎉\n\n"
         "Thank you all for being an integral part of the team! Each and every one of you was truly amazing and brought your unique energy to the event. 💪✨\n\n"
         "We can't wait to compete alongside you in future challenges and create even more unforgettable moments together. 🚀🔥\n\n"
         "Please don't forget to share your writeups if you have any in the writeup channel."
-    )
+    ))
     await delete_ctf_role(guild, event_id)
 
-async def make_channel_readonly(channel, role):
+def make_channel_readonly(channel, role):
+    """Queue the edit making ``channel`` read-only for ``role``; returns its future."""
     overwrites = channel.overwrites
     # Set the CTF role to read-only
     if role in overwrites:
@@ -422,9 +429,10 @@ async def make_channel_readonly(channel, role):
     else:
         overwrites[role] = discord.PermissionOverwrite(view_channel=True, send_messages=False, read_message_history=True)
     # Default role stays hidden
-    await channel.edit(overwrites=overwrites)
+    return actions.edit_channel(channel, overwrites=overwrites)
 
-async def make_channel_archived_public(channel):
+def make_channel_archived_public(channel):
+    """Queue the edit opening ``channel`` read-only to everyone; returns its future."""
     overwrites = channel.overwrites
     # Remove all role-specific overwrites except @everyone
     for role in list(overwrites.keys()):
@@ -432,67 +440,173 @@ async def make_channel_archived_public(channel):
             del overwrites[role]
     # Set @everyone to view and read, but not send
     overwrites[channel.guild.default_role] = discord.PermissionOverwrite(view_channel=True, send_messages=False, read_message_history=True)
-    await channel.edit(overwrites=overwrites)
+    return actions.edit_channel(channel, overwrites=overwrites)
+
+ARCHIVE_JOB_KIND = "archive_ctf"
+
+def archive_job_id(guild_id, event_id):
+    return f"archive:{guild_id}:{event_id}"
+
+def parse_ctftime_datetime(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00')) if value else None
 
-@tasks.loop(minutes=30)
-async def check_and_archive_ctf_channels():
+async def schedule_ctf_archive(guild_id, event):
+    """Schedule a guild's channel of a CTFtime event to be archived when the event finishes."""
+    finish_dt = parse_ctftime_datetime(event.get("finish", ""))
+    if not finish_dt:
+        return
+    event_id = str(event["id"])
+    await scheduler.schedule(
+        archive_job_id(guild_id, event_id),
+        ARCHIVE_JOB_KIND,
+        finish_dt.timestamp(),
+        {"guild_id": str(guild_id), "event_id": event_id, "title": event.get("title", "ctf")}
+    )
+
+async def schedule_tracked_ctf_archives():
+    """Create archive jobs for tracked CTF channels that were created before the scheduler existed."""
     await client.wait_until_ready()
-    now = datetime.now(pytz.utc)
-    ctf_channels = get_ctf_channels_mapping()
-    ctf_roles = get_ctf_roles_mapping()
-    for event_id, channel_id in ctf_channels.items():
-        # Fetch event info from CTFtime
-        url = f"https://ctftime.org/api/v1/events/{event_id}/"
-        resp = requests.get(url)
-        if resp.status_code != 200:
+    for event in ctf_events:
+        guild_id, event_id = event.guild_id, event.event_id
+        if not event.channel_id or archive_job_id(guild_id, event_id) in scheduler:
+            continue
+        channel = client.get_channel(event.channel_id)
+        if not channel or channel.category_id == guild_settings.get(guild_id, "ctf_archive_category"):
+            continue
+        try:
+            event = await ctftime_mirror.get(event_id)
+        except CTFtimeError as e:
+            print(f"Failed to fetch CTF {event_id} from CTFtime: {e}")
             continue
-        event = resp.json()
-        finish = event.get("finish", "")
+        await schedule_ctf_archive(guild_id, event)
+
+async def archive_ctf_job(job_id, payload):
+    await client.wait_until_ready()
+    # Jobs scheduled before guild scoping belong to the guild that claimed the legacy data
+    guild_id = payload.get("guild_id") or await db.get_config(db.LEGACY_GUILD_KEY)
+    if not guild_id:
+        print(f"Archive job {job_id} has no guild yet, retrying later.")
+        return time.time() + 3600
+    event_id = payload["event_id"]
+    ctf_name = payload["title"].replace(" ", "-")
+    # Re-verify the finish time against the mirror, which the hourly sync keeps current
+    try:
+        event = await ctftime_mirror.get(event_id)
+    except CTFtimeError as e:
+        print(f"Could not re-verify CTF {event_id} with CTFtime, using stored finish time: {e}")
+    else:
+        finish_dt = parse_ctftime_datetime(event.get("finish", ""))
+        if finish_dt and finish_dt.timestamp() > time.time():
+            return finish_dt.timestamp()
         ctf_name = event.get("title", "ctf").replace(" ", "-")
-        finish_dt = datetime.fromisoformat(finish.replace('Z', '+00:00')) if finish else None
-        if finish_dt and now > finish_dt:
-            # Archive the channel if not already archived
-            for guild in client.guilds:
-                channel = guild.get_channel(channel_id)
-                role_id = ctf_roles.get(event_id)
-                role = guild.get_role(role_id) if role_id else None
-                if channel and channel.category_id != CTF_ARCHIVE_CATEGORY_ID:
-                    archive_category = guild.get_channel(CTF_ARCHIVE_CATEGORY_ID)
-                    if archive_category and isinstance(archive_category, discord.CategoryChannel):
-                        await channel.edit(category=archive_category, reason="CTF ended, archiving channel")
-                        if role:
-                            await make_channel_readonly(channel, role)
-                            await send_ctf_end_message(guild, event_id, ctf_name, role)
-                            await delete_ctf_role(guild, event_id)
-                            await make_channel_archived_public(channel)
+    await archive_ctf_channel(guild_id, event_id, ctf_name)
 
-# Bot events
-@client.event
-async def on_ready():
-    print(f'Bot ready as {client.user}')
-    print(f'Database path: {os.path.abspath("ctf_team.db")}')
+scheduler.register(ARCHIVE_JOB_KIND, archive_ctf_job)
+
+async def archive_ctf_channel(guild_id, event_id, ctf_name):
+    event = ctf_events.get(guild_id, event_id)
+    guild = client.get_guild(int(guild_id))
+    if not event or not event.channel_id or not guild:
+        return
+    # Archive the channel if not already archived
+    channel = guild.get_channel(event.channel_id)
+    role = guild.get_role(event.role_id) if event.role_id else None
+    archive_category = get_setting_channel(guild, "ctf_archive_category")
+    if channel and archive_category and channel.category_id != archive_category.id:
+        if isinstance(archive_category, discord.CategoryChannel):
+            # Queued edits of a channel are merged, so the move and the read-only overwrites are one call
+            edited = actions.edit_channel(channel, category=archive_category, reason="CTF ended, archiving channel")
+            if role:
+                make_channel_readonly(channel, role)
+                await send_ctf_end_message(guild, event_id, ctf_name, role)
+                await delete_ctf_role(guild, event_id)
+                edited = make_channel_archived_public(channel)
+            await edited
+
+async def run_deferred_startup():
+    """Start background work once the first command was served (or the timeout passed)."""
+    try:
+        await asyncio.wait_for(first_command_served.wait(), STARTUP_DEFER_TIMEOUT)
+    except asyncio.TimeoutError:
+        pass
     if not update_ctftime_team_stats.is_running():
         update_ctftime_team_stats.start()
+    if not sync_ctftime_events.is_running():
+        sync_ctftime_events.start()
+    if not snapshot_ledger.is_running():
+        snapshot_ledger.start()
     if not announce_upcoming_ctfs.is_running():
         announce_upcoming_ctfs.start()
-    if not check_and_archive_ctf_channels.is_running():
-        check_and_archive_ctf_channels.start()
-    # Ensure scoreboard message exists
-    guild = discord.utils.get(client.guilds)
-    await update_scoreboard_message(guild)
+    await schedule_tracked_ctf_archives()
+
+# Bot events
+@client.event
+async def on_connect():
+    if startup["connected"] is None:
+        startup["connected"] = time.monotonic()
+
+@client.event
+async def on_ready():
+    # on_ready fires again after every gateway reconnect; reconcile only once per process
+    if startup["ready"] is not None:
+        print(f'Reconnected as {client.user}')
+        return
+    startup["ready"] = time.monotonic()
+    print(f'Bot ready as {client.user} in {startup["ready"] - startup["started"]:.2f}s '
+          f'(setup {startup["setup"] - startup["started"]:.2f}s, '
+          f'{startup["ready"] - startup["connected"]:.2f}s from connect to ready)')
+    print(f'Database path: {os.path.abspath(db.DB_PATH)}')
+    await claim_legacy_data()
+    client.loop.create_task(run_deferred_startup())
+    # Ensure scoreboard messages exist; unchanged scoreboards are skipped without a REST call
+    for guild_id, _ in guild_settings.guilds_with("scoreboard_channel"):
+        if guild := client.get_guild(guild_id):
+            try:
+                await update_scoreboard_message(guild, immediate=True)
+            except Exception as e:
+                print(f"Failed to update scoreboard in {guild.name}: {e}")
+
+async def claim_legacy_data():
+    """Assign data from before per-guild configuration to the guild it belongs to."""
+    channel = client.get_channel(LEGACY_GUILD_SETTINGS["scoreboard_channel"])
+    if channel:
+        guild, settings = channel.guild, LEGACY_GUILD_SETTINGS
+    elif len(client.guilds) == 1:
+        guild, settings = client.guilds[0], {}
+    else:
+        return
+    if await db.claim_legacy_guild(guild.id, settings, LEGACY_CONFIG_KEYS):
+        await guild_settings.load()
+        await ctf_events.load()
+        await ranking.rebuild()
+        user_stats.clear()
+        print(f"Assigned existing data to guild {guild.name} ({guild.id})")
+
+@client.check
+async def in_guild(ctx):
+    """Every command works on the data of the guild it is used in."""
+    return ctx.guild is not None
+
+@client.before_invoke
+async def begin_command(ctx):
+    ctx.started_at = time.perf_counter()
+    # Background Discord actions wait while a command is being answered
+    actions.begin_interactive()
+
+@client.after_invoke
+async def mark_command_served(ctx):
+    actions.end_interactive()
+    metrics.COMMAND_LATENCY.observe(time.perf_counter() - ctx.started_at, command=ctx.command.qualified_name,
+                                    status="error" if ctx.command_failed else "ok")
+    first_command_served.set()
 
 @client.event
 async def on_raw_reaction_add(payload):
     if payload.emoji.name != "🔥":
         return
     # Only care about CTF announcement messages
-    mapping = get_ctf_announce_message_ids()
-    event_id = None
-    for eid, msg_id in mapping.items():
-        if int(msg_id) == payload.message_id:
-            event_id = eid
-            break
-    if not event_id:
+    event = ctf_events.for_message(payload.message_id)
+    if not event:
         return
     # Get guild, member, and role
     guild = client.get_guild(payload.guild_id)
@@ -501,30 +615,23 @@ async def on_raw_reaction_add(payload):
     member = guild.get_member(payload.user_id)
     if not member or member.bot:
         return
-    ctf_roles = get_ctf_roles_mapping()
-    role_id = ctf_roles.get(event_id)
-    if not role_id:
+    if not event.role_id:
         return
-    role = guild.get_role(role_id)
+    role = guild.get_role(event.role_id)
     if not role:
         return
     # Assign role
     await member.add_roles(role, reason="Reacted to CTF announcement")
     # Record participation
-    cursor.execute('''INSERT OR IGNORE INTO ctf_participation (user_id, event_id) VALUES (?, ?)''', (str(member.id), event_id))
-    conn.commit()
+    await db.add_participation(guild.id, member.id, event.event_id)
+    user_stats.invalidate(guild.id, member.id)
 
 @client.event
 async def on_raw_reaction_remove(payload):
     if payload.emoji.name != "🔥":
         return
-    mapping = get_ctf_announce_message_ids()
-    event_id = None
-    for eid, msg_id in mapping.items():
-        if int(msg_id) == payload.message_id:
-            event_id = eid
-            break
-    if not event_id:
+    event = ctf_events.for_message(payload.message_id)
+    if not event:
         return
     guild = client.get_guild(payload.guild_id)
     if not guild:
@@ -532,16 +639,39 @@ async def on_raw_reaction_remove(payload):
     member = guild.get_member(payload.user_id)
     if not member or member.bot:
         return
-    ctf_roles = get_ctf_roles_mapping()
-    role_id = ctf_roles.get(event_id)
-    if not role_id:
+    if not event.role_id:
         return
-    role = guild.get_role(role_id)
+    role = guild.get_role(event.role_id)
     if not role:
         return
     # Remove role
     await member.remove_roles(role, reason="Removed reaction from CTF announcement")
 
+@client.listen('on_message')
+async def index_thread_message(message):
+    """Add messages posted in challenge threads to the search index."""
+    if message.channel.id not in challenge_threads or message.author.bot or not message.content:
+        return
+    if message.content.startswith(client.command_prefix):
+        return
+    await db.add_thread_message(message.guild.id, message.channel.id, message.id, message.author.id,
+                                message.content, datetime.now().isoformat(" "))
+
+@client.event
+async def on_raw_message_edit(payload):
+    if payload.channel_id in challenge_threads and "content" in payload.data:
+        await db.edit_thread_message(payload.message_id, payload.data["content"])
+
+@client.event
+async def on_raw_message_delete(payload):
+    if payload.channel_id in challenge_threads:
+        await db.delete_thread_message(payload.message_id)
+
+@client.event
+async def on_raw_thread_delete(payload):
+    if payload.thread_id in challenge_threads:
+        await challenge_threads.forget(payload.thread_id)
+
 # Challenge tracking commands
 @client.command()
 async def trying(ctx, category: str, challenge_name: str):
@@ -556,44 +686,47 @@ async def trying(ctx, category: str, challenge_name: str):
             reason=f"Discussion for {challenge_name}")
 
         # Record in database with all 5 columns
-        cursor.execute(
-            '''INSERT INTO active_challenges 
-                         (challenge_name, category, user_id, thread_id, timestamp)
-                         VALUES (?,?,?,?,?)''',
-            (challenge_name, category.lower(), ctx.author.id, thread.id,
-             datetime.now()))
-        conn.commit()
+        await db.add_active_challenge(
+            ctx.guild.id, challenge_name, category.lower(), ctx.author.id, thread.id,
+            datetime.now().isoformat(" "))
+        challenge_threads.add(thread.id)
 
         # Send notifications
         await thread.send(f"🚧 {ctx.author.mention} is now trying the challenge `{challenge_name}` under the `{category.capitalize()}` category\n\n")
 
     except Exception as e:
         await ctx.send(f"❌ Error creating thread: {e}")
-        conn.rollback()
 
 
 @client.command()
-async def working(ctx):
+async def working(ctx, *filters: str):
     """List active challenges"""
-    cursor.execute('''SELECT * FROM active_challenges''')
-    active = cursor.fetchall()
-    if not active:
+    try:
+        filters = parse_filters(filters)
+    except ValueError as e:
+        await ctx.send(f"❌ {e}")
+        return
+
+    async def fetch_page(cursor, limit):
+        return await db.get_active_page(ctx.guild.id, cursor, limit, **filters)
+
+    async def format_rows(rows):
+        resolved = await users.resolve_many(row[4] for row in rows)
+        blocks = []
+        for _, _, name, cat, uid, thread_id in rows:
+            user = resolved[int(uid)]
+            blocks.append(
+                f"**{name} ({cat.capitalize()})**\n"
+                f"Started by: {user.mention}\n\n"
+            )
+        return blocks
+
+    view = ListingView(ctx.author.id, fetch_page, format_rows, "🔨 Active Challenges", discord.Color.orange())
+    embed = await view.render()
+    if view.empty:
         await ctx.send(embed=discord.Embed(title="🔨 Active Challenges", description="No active challenges!", color=discord.Color.orange()))
         return
-    desc = ""
-    for challenge in active:
-        name, cat, uid, thread_id, _ = challenge
-        user = await client.fetch_user(uid)
-        desc += (
-            f"**{name} ({cat.capitalize()})**\n"
-            f"Started by: {user.mention}\n\n"
-        )
-    embed = discord.Embed(
-        title="🔨 Active Challenges",
-        description=desc,
-        color=discord.Color.orange()
-    )
-    await ctx.send(embed=embed)
+    await view.send(ctx, embed)
 
 
 # Challenge solving commands
@@ -604,72 +737,41 @@ async def add(ctx,
               difficulty: str,
               first_blood: int = 0):
     """Record a solved challenge"""
-    allowed_categories = [
-        'misc', 'web', 'crypto', 'reverse', 'blockchain', 'dfir', 'osint', 'pwn', 'android', 'ppc'
-    ]
-    allowed_difficulties = ['easy', 'medium', 'hard']
     category = category.lower()
     difficulty = difficulty.lower()
-    if category not in allowed_categories:
-        await ctx.send(f"❌ Invalid category: `{category}`. Allowed categories: {', '.join(allowed_categories)}")
+    if category not in ALLOWED_CATEGORIES:
+        await ctx.send(f"❌ Invalid category: `{category}`. Allowed categories: {', '.join(ALLOWED_CATEGORIES)}")
         return
-    if difficulty not in allowed_difficulties:
-        await ctx.send(f"❌ Invalid difficulty: `{difficulty}`. Allowed difficulties: {', '.join(allowed_difficulties)}")
+    if difficulty not in ALLOWED_DIFFICULTIES:
+        await ctx.send(f"❌ Invalid difficulty: `{difficulty}`. Allowed difficulties: {', '.join(ALLOWED_DIFFICULTIES)}")
         return
     user = ctx.author
 
     # Check duplicates
-    cursor.execute(
-        '''SELECT * FROM solved_challenges 
-           WHERE challenge_name = ? AND user_id = ?''',
-        (challenge_name, user.id))
-    if cursor.fetchone():
+    if await db.is_solved(ctx.guild.id, challenge_name, user.id):
         await ctx.send("❌ Challenge already recorded!")
         return
 
-    # Calculate points
-    points = {'easy': 10, 'medium': 25, 'hard': 40}.get(difficulty, 0)
-    if first_blood == 1:
-        points += {'easy': 10, 'medium': 15, 'hard': 20}.get(difficulty, 0)
-
     try:
-        # Update database
-        cursor.execute(
-            '''INSERT INTO solved_challenges 
-               (challenge_name, category, difficulty, first_blood, user_id, timestamp)
-               VALUES (?, ?, ?, ?, ?, ?)''',
-            (challenge_name, category, difficulty, first_blood, user.id, datetime.now()))
-
-        # Update user stats
-        cursor.execute(
-            '''SELECT points, first_bloods FROM users WHERE user_id = ?''',
-            (user.id,))
-        if user_data := cursor.fetchone():
-            new_points = user_data[0] + points
-            new_fb = user_data[1] + (1 if first_blood == 1 else 0)
-            cursor.execute(
-                '''UPDATE users SET points = ?, first_bloods = ? WHERE user_id = ?''',
-                (new_points, new_fb, user.id))
-        else:
-            cursor.execute(
-                '''INSERT INTO users (user_id, first_bloods, points)
-                   VALUES (?, ?, ?)''',
-                (user.id, (1 if first_blood == 1 else 0), points))
-
-        # Remove from active challenges
-        cursor.execute(
-            '''DELETE FROM active_challenges 
-               WHERE challenge_name = ? AND user_id = ?''',
-            (challenge_name, user.id))
-
-        conn.commit()
-
-        # Check if this is the user's first solve in this category
-        cursor.execute('''SELECT COUNT(*) FROM solved_challenges WHERE user_id = ? AND category = ?''', (str(user.id), category))
-        cat_count = cursor.fetchone()[0]
-        if cat_count == 1:
-            await give_category_role_and_congrats(user, ctx.guild, category, ctx.channel)
+        # Update database, user stats and active challenges in one transaction
+        result = await db.record_solve(
+            ctx.guild.id, challenge_name, category, difficulty, first_blood, user.id,
+            scoring_config.get(ctx.guild.id), datetime.now().isoformat(" "))
+        if result is None:
+            await ctx.send("❌ Challenge already recorded!")
+            return
+        ranking.update(ctx.guild.id, user.id, result["points"], result["first_bloods"], flags_delta=1)
+        user_stats.invalidate(ctx.guild.id, user.id)
+        apply_rescored(ctx.guild.id, result["rescored"])
+    except Exception as e:
+        await ctx.send(f"❌ Database error: {e}")
+        return
 
+    # Acknowledge in the invoking channel first, then run the other side effects concurrently
+    side_effects = {"scoreboard": update_scoreboard_message(ctx.guild, debug_ctx=ctx)}
+    if result["first_in_category"]:
+        side_effects["category role"] = give_category_role_and_congrats(user, ctx.guild, category, ctx.channel)
+    try:
         # 📸 Use different image if first blood
         if first_blood == 1:
             # Build the special first blood embed
@@ -689,15 +791,12 @@ async def add(ctx,
                 filename = "Hard_FirstBlood.gif"
             else:
                 filename = "solved.webp"
-            fb_embed.set_image(url=f"attachment://{filename}")
-            # Send to current channel
-            file1 = discord.File(filename, filename=filename)
-            await ctx.send(embed=fb_embed, file=file1)
+            # Send to current channel; the upload's URL is reused for the firstblood channel
+            await media.send(ctx, fb_embed, filename)
             # Send to firstblood channel
-            fb_channel = ctx.guild.get_channel(FIRSTBLOOD_CHANNEL_ID)
+            fb_channel = get_setting_channel(ctx.guild, "firstblood_channel")
             if fb_channel:
-                file2 = discord.File(filename, filename=filename)
-                await fb_channel.send(embed=fb_embed, file=file2)
+                side_effects["first blood channel"] = media.send(fb_channel, fb_embed, filename)
         else:
             embed = discord.Embed(
                 title="✅ Challenge Solved!",
@@ -707,51 +806,224 @@ async def add(ctx,
             embed.add_field(name="Category", value=category.capitalize(), inline=True)
             embed.add_field(name="Challenge", value=challenge_name, inline=True)
             embed.add_field(name="Difficulty", value=difficulty.capitalize(), inline=True)
-            file = discord.File("solved.webp", filename="solved.webp")
-            embed.set_image(url="attachment://solved.webp")
-            await ctx.send(embed=embed, file=file)
-        # Update scoreboard after challenge is solved, with debug context
-        await update_scoreboard_message(ctx.guild, debug_ctx=ctx)
-
-    except Exception as e:
-        await ctx.send(f"❌ Database error: {e}")
-        conn.rollback()
+            await media.send(ctx, embed, "solved.webp")
+    finally:
+        announcer.fan_out(**side_effects)
 
 # Information commands
 @client.command()
-async def solved(ctx):
+async def solved(ctx, *filters: str):
     """List all solved challenges"""
-    cursor.execute(
-        '''SELECT * FROM solved_challenges ORDER BY timestamp DESC''')
-    if not (solved := cursor.fetchall()):
-        await ctx.send("No challenges solved yet!")
-        return
-
-    desc = ""
-    for challenge in solved:
-        name, cat, diff, _, uid, _ = challenge
-        user = await client.fetch_user(uid)
-        desc += (
-            f"**{name} ({cat.capitalize()})**\n"
-                     f"Solved by: {user.mention}\n"
-                     f"Status: ✅\n"
-            f"Difficulty: {diff.capitalize()}\n\n"
-        )
-    embed = discord.Embed(
-        title="🔎 Solved Challenges",
-        description=desc,
-        color=discord.Color.green()
-    )
-    await ctx.send(embed=embed)
+    try:
+        filters = parse_filters(filters)
+    except ValueError as e:
+        await ctx.send(f"❌ {e}")
+        return
+
+    async def fetch_page(cursor, limit):
+        return await db.get_solved_page(ctx.guild.id, cursor, limit, **filters)
+
+    async def format_rows(rows):
+        resolved = await users.resolve_many(row[6] for row in rows)
+        blocks = []
+        for _, _, name, cat, diff, _, uid in rows:
+            user = resolved[int(uid)]
+            blocks.append(
+                f"**{name} ({cat.capitalize()})**\n"
+                f"Solved by: {user.mention}\n"
+                f"Status: ✅\n"
+                f"Difficulty: {diff.capitalize()}\n\n"
+            )
+        return blocks
+
+    view = ListingView(ctx.author.id, fetch_page, format_rows, "🔎 Solved Challenges", discord.Color.green())
+    embed = await view.render()
+    if view.empty:
+        await ctx.send("No challenges solved yet!" if not filters else "No solved challenges match those filters.")
+        return
+    await view.send(ctx, embed)
 
 
 @client.command()
-async def scoreboard(ctx):
-    """Show leaderboard"""
-    embed = await generate_scoreboard_embed()
+async def upcoming(ctx, *, search: str = None):
+    """Browse upcoming CTFs from the local CTFtime mirror"""
+    async def fetch_page(cursor, limit):
+        return await ctftime_mirror.page(cursor, limit, query=search)
+
+    async def format_rows(rows):
+        blocks = []
+        for start, _, title, finish, weight, fmt, url, ctftime_url in rows:
+            ends = f" → <t:{int(finish)}:f>" if finish else ""
+            blocks.append(
+                f"**{escape_markdown(title)}** — {fmt or 'Unknown'}, weight {weight or 0:.2f}\n"
+                f"🗓️ <t:{int(start)}:f>{ends}\n"
+                f"🔗 {url or ctftime_url}\n\n"
+            )
+        return blocks
+
+    view = ListingView(ctx.author.id, fetch_page, format_rows, "📅 Upcoming CTFs", discord.Color.blue())
+    embed = await view.render()
+    if view.empty:
+        await ctx.send("No upcoming CTFs found." if not search else f"No upcoming CTFs match `{search}`.")
+        return
+    await view.send(ctx, embed)
+
+
+@client.command(name='search')
+async def search_command(ctx, *, query: str = None):
+    """Search challenges and challenge thread discussions"""
+    try:
+        match = fulltext.match_query(query or "")
+    except ValueError as e:
+        await ctx.send(f"❌ {e} Usage: `!search <words>`")
+        return
+
+    results = fulltext.SearchResults(ctx.guild.id, match)
+
+    async def format_rows(rows):
+        resolved = await users.resolve_many(row[6] for row in rows if row[6])
+        blocks = []
+        for _, _, kind, name, cat, snippet, uid, thread_id, message_id, created_at in rows:
+            who = resolved[int(uid)].mention if uid else "someone"
+            title = f"**{name or 'Unknown challenge'}**" + (f" ({cat.capitalize()})" if cat else "")
+            thread = f"\n🧵 <#{thread_id}>" if thread_id else ""
+            if kind == "solve":
+                blocks.append(f"✅ {title} — solved by {who} on {created_at[:10]}{thread}\n\n")
+            elif kind == "active":
+                blocks.append(f"🔨 {title} — {who} is working on it{thread}\n\n")
+            else:
+                link = f"https://discord.com/channels/{ctx.guild.id}/{thread_id}/{message_id}"
+                blocks.append(f"💬 {title} — {who}: {snippet[:300]}\n🔗 {link}\n\n")
+        return blocks
+
+    view = ListingView(ctx.author.id, results.page, format_rows, f"🔎 Search: {query[:200]}", discord.Color.teal())
+    embed = await view.render()
+    if view.empty:
+        await ctx.send(f"No challenges or discussions match `{query}`.")
+        return
+    await view.send(ctx, embed)
+
+
+async def resolve_window(ctx, text):
+    """Resolve a window argument for a command, or report the problem and return None."""
+    channel_event = next((e.event_id for e in ctf_events if e.guild_id == str(ctx.guild.id) and e.channel_id == ctx.channel.id), None)
+    try:
+        return await rollups.resolve_window(ctx.guild.id, text, ctftime_mirror, channel_event_id=channel_event)
+    except ValueError as e:
+        await ctx.send(f"❌ {e}")
+        return None
+
+
+@client.command()
+async def scoreboard(ctx, size: Optional[int] = SCOREBOARD_SIZE, window: str = None):
+    """Show leaderboard, optionally over a time window"""
+    if window is not None and not (window := await resolve_window(ctx, window)):
+        return
+    embed = await generate_scoreboard_embed(ctx.guild.id, max(1, min(size, MAX_SCOREBOARD_SIZE)), window)
+    if window is not None and not embed.fields:
+        await ctx.send(f"No solves in {window.label}.")
+        return
     await ctx.send(embed=embed)
 
 
+@client.command()
+async def season(ctx, *, name: str = None):
+    """Show the seasons, or ADMIN ONLY: start a new season today."""
+    if name is None:
+        seasons = await db.get_seasons(ctx.guild.id)
+        lines = [f"`{season_name}` — since {start}" for season_name, start in seasons]
+        await ctx.send("📆 **Seasons:**\n" + "\n".join(lines) if lines else "No seasons yet. Admins start one with `!season <name>`.")
+        return
+    if not ctx.author.guild_permissions.administrator:
+        await ctx.send("❌ You do not have permission to use this command. (Admin only)")
+        return
+    today = datetime.now().date().isoformat()
+    if not await db.start_season(ctx.guild.id, name, today):
+        await ctx.send(f"❌ A season named `{name}` exists or a season already started today.")
+        return
+    await ctx.send(f"✅ Season `{name}` started. Use `!scoreboard season` for its leaderboard; all-time totals are kept.")
+
+
+@client.command(name='ledger')
+async def ledger_command(ctx, action: str = "verify", member: Optional[discord.Member] = None, points: int = None, *, reason: str = None):
+    """ADMIN ONLY: Verify or rebuild this server's solve ledger, or adjust a player's points."""
+    if not ctx.author.guild_permissions.administrator:
+        await ctx.send("❌ You do not have permission to use this command. (Admin only)")
+        return
+    action = action.lower()
+    if action == "verify":
+        report = await ledger.verify(ctx.guild.id)
+        summary = f"{report.events} events replayed for {report.users} players in {report.seconds:.2f}s"
+        if report.ok:
+            await ctx.send(f"✅ Ledger consistent: {summary}.")
+            return
+        lines = [f"<@{uid}> {check}: {field} is {actual}, ledger says {expected}"
+                 for _, uid, check, field, expected, actual in report.mismatches[:15]]
+        more = f"\n…and {len(report.mismatches) - 15} more" if len(report.mismatches) > 15 else ""
+        await ctx.send(f"⚠️ {len(report.mismatches)} mismatch(es), {summary}:\n" + "\n".join(lines) + more,
+                       allowed_mentions=discord.AllowedMentions.none())
+    elif action == "rebuild":
+        written = await ledger.rebuild(ctx.guild.id)
+        await ranking.rebuild()
+        user_stats.clear(ctx.guild.id)
+        await update_scoreboard_message(ctx.guild, debug_ctx=ctx)
+        await ctx.send(f"✅ Rebuilt totals of {written} players from the latest snapshot and the ledger tail.")
+    elif action == "adjust" and member is not None and points is not None:
+        result = await db.adjust_points(ctx.guild.id, member.id, points, reason)
+        ranking.update(ctx.guild.id, member.id, result["points"], result["first_bloods"])
+        user_stats.invalidate(ctx.guild.id, member.id)
+        await ctx.send(f"✅ Adjusted {member.mention} by {points:+d} points (now {result['points']}).")
+        await update_scoreboard_message(ctx.guild, debug_ctx=ctx)
+    else:
+        await ctx.send("❌ Usage: `!ledger verify`, `!ledger rebuild` or `!ledger adjust @user <points> [reason]`")
+
+
+@client.command(name='scoring')
+async def scoring_command(ctx, action: str = None, *args):
+    """Show the scoring rules, or ADMIN ONLY: change them and rescore every solve."""
+    rules = scoring_config.get(ctx.guild.id).copy()
+    if action is None:
+        await ctx.send("🧮 **Scoring rules:**\n" + "\n".join(rules.describe()))
+        return
+    if not ctx.author.guild_permissions.administrator:
+        await ctx.send("❌ You do not have permission to use this command. (Admin only)")
+        return
+    action = action.lower()
+    usage = ("❌ Usage: `!scoring points easy=10 …`, `!scoring bonus hard=20 …`, `!scoring multiplier web=1.5 …`, "
+             "`!scoring decay <minimum 0-1> <solvers>`, `!scoring decay off`, `!scoring reset` or `!scoring rescore`")
+    try:
+        if action == "points" and args:
+            rules.points_table.update(scoring.parse_table(args, ALLOWED_DIFFICULTIES))
+        elif action == "bonus" and args:
+            rules.bonus_table.update(scoring.parse_table(args, ALLOWED_DIFFICULTIES))
+        elif action == "multiplier" and args:
+            rules.multipliers.update(scoring.parse_table(args, ALLOWED_CATEGORIES, float))
+        elif action == "decay" and len(args) == 1 and args[0].lower() == "off":
+            rules.decay_minimum = rules.decay_solves = None
+        elif action == "decay" and len(args) == 2:
+            minimum, solves = float(args[0]), int(args[1])
+            if not 0 <= minimum <= 1 or solves < 1:
+                raise ValueError("The minimum is a fraction between 0 and 1 and the solver count must be at least 1.")
+            rules.decay_minimum, rules.decay_solves = minimum, solves
+        elif action == "reset":
+            rules = scoring.ScoringRules()
+        elif action != "rescore":
+            await ctx.send(usage)
+            return
+    except ValueError as e:
+        await ctx.send(f"❌ {e}")
+        return
+    await scoring_config.set(ctx.guild.id, rules)
+    start = time.perf_counter()
+    changed = await db.rescore(ctx.guild.id, rules)
+    if changed:
+        await ranking.rebuild()
+        user_stats.clear(ctx.guild.id)
+        await update_scoreboard_message(ctx.guild, debug_ctx=ctx)
+    await ctx.send(f"✅ Rescored every solve in {time.perf_counter() - start:.2f}s, {changed} player(s) changed.\n"
+                   + "\n".join(rules.describe()))
+
+
 @client.command()
 async def reset_scoreboard(ctx):
     """ADMIN ONLY: Reset the scoreboard (clears all users and solved challenges)."""
@@ -759,80 +1031,145 @@ async def reset_scoreboard(ctx):
         await ctx.send("❌ You do not have permission to use this command. (Admin only)")
         return
     try:
-        cursor.execute('DELETE FROM users')
-        cursor.execute('DELETE FROM solved_challenges')
-        cursor.execute('DELETE FROM active_challenges')
-        cursor.execute('DELETE FROM ctf_participation')
-        conn.commit()
+        await db.reset_scoreboard(ctx.guild.id)
+        ranking.clear(ctx.guild.id)
+        user_stats.clear(ctx.guild.id)
         await update_scoreboard_message(ctx.guild, debug_ctx=ctx)
         await ctx.send("✅ Complete database reset! Cleared: users, solved challenges, active challenges (working), and CTF participation.")
     except Exception as e:
         await ctx.send(f"❌ Error resetting database: {e}")
-        conn.rollback()
+
+
+@client.command(name='import')
+async def import_data(ctx):
+    """ADMIN ONLY: Bulk import solves and CTF participation from an attached CSV/JSONL file."""
+    if not ctx.author.guild_permissions.administrator:
+        await ctx.send("❌ You do not have permission to use this command. (Admin only)")
+        return
+    if not ctx.message.attachments:
+        await ctx.send("❌ Attach a CSV or JSONL file. Solve columns: `" + ", ".join(bulk.SOLVE_COLUMNS)
+                       + "`; participation columns: `" + ", ".join(bulk.PARTICIPATION_COLUMNS) + "`")
+        return
+    attachment = ctx.message.attachments[0]
+    try:
+        solves, participation, errors = bulk.parse_import(
+            attachment.filename, await attachment.read(), ALLOWED_CATEGORIES, ALLOWED_DIFFICULTIES)
+    except (ValueError, UnicodeDecodeError) as e:
+        await ctx.send(f"❌ Could not read `{attachment.filename}`: {e}")
+        return
+    if errors:
+        shown = "\n".join(errors[:10])
+        more = f"\n…and {len(errors) - 10} more" if len(errors) > 10 else ""
+        await ctx.send(f"❌ Nothing imported, {len(errors)} invalid row(s):\n{shown}{more}")
+        return
+    try:
+        solves_added, participation_added = await db.bulk_import(
+            ctx.guild.id, solves, participation, scoring_config.get(ctx.guild.id))
+    except Exception as e:
+        await ctx.send(f"❌ Database error: {e}")
+        return
+    if solves_added:
+        await ranking.rebuild()
+        user_stats.clear(ctx.guild.id)
+        await update_scoreboard_message(ctx.guild, debug_ctx=ctx)
+    elif participation_added:
+        user_stats.clear(ctx.guild.id)
+    await ctx.send(
+        f"✅ Imported {solves_added} solve(s) and {participation_added} participation row(s) "
+        f"({len(solves) - solves_added + len(participation) - participation_added} already present).")
+
+
+@client.command(name='export')
+async def export_data(ctx, table: str = "solves", fmt: str = "csv"):
+    """ADMIN ONLY: Export solves or CTF participation as CSV/JSONL."""
+    if not ctx.author.guild_permissions.administrator:
+        await ctx.send("❌ You do not have permission to use this command. (Admin only)")
+        return
+    table, fmt = table.lower(), fmt.lower()
+    if table not in bulk.EXPORT_TABLES or fmt not in ("csv", "jsonl"):
+        await ctx.send("❌ Usage: `!export <solves/participation> [csv/jsonl]`")
+        return
+    sql_table, columns = bulk.EXPORT_TABLES[table]
+    path = await bulk.export_to_file(db.iter_table(sql_table, columns, ctx.guild.id), columns, fmt)
+    try:
+        await ctx.send(file=discord.File(path, filename=f"{table}.{fmt}"))
+    except discord.HTTPException as e:
+        await ctx.send(f"❌ Could not upload the export: {e}")
+    finally:
+        os.remove(path)
+
+
+@client.command(name='config')
+async def config_command(ctx, setting: str = None, value: str = None):
+    """ADMIN ONLY: Show or change this server's channels, categories and CTFtime team."""
+    if not ctx.author.guild_permissions.administrator:
+        await ctx.send("❌ You do not have permission to use this command. (Admin only)")
+        return
+    if setting is None:
+        current = guild_settings.all(ctx.guild.id)
+        lines = [f"`{key}` — {current.get(key, 'not set')} ({description})" for key, description in SETTINGS.items()]
+        await ctx.send("⚙️ **Server settings:**\n" + "\n".join(lines))
+        return
+    setting = setting.lower()
+    if setting not in SETTINGS or value is None:
+        await ctx.send(f"❌ Usage: `!config <setting> <#channel/ID/none>`. Settings: {', '.join(SETTINGS)}")
+        return
+    try:
+        parsed = parse_setting(value)
+    except ValueError as e:
+        await ctx.send(f"❌ {e}")
+        return
+    await guild_settings.set(ctx.guild.id, setting, parsed)
+    await ctx.send(f"✅ `{setting}` set to {parsed if parsed is not None else 'not set'}.")
+    if setting == "scoreboard_channel" and parsed is not None:
+        # The old message lives in another channel; post a fresh scoreboard
+        await get_scoreboard_publisher(ctx.guild.id).reset()
+        await update_scoreboard_message(ctx.guild, debug_ctx=ctx, immediate=True)
 
 
 @client.command()
 async def categories(ctx):
     """List all challenge categories"""
-    cursor.execute('''SELECT DISTINCT category FROM solved_challenges''')
-    cats = [row[0].capitalize() for row in cursor.fetchall()]
+    cats = [cat.capitalize() for cat in await db.get_distinct_categories(ctx.guild.id)]
     await ctx.send(
         f"📂 **Categories:** {', '.join(cats) if cats else 'None yet!'}")
 
 
 @client.command()
-async def profile(ctx, member: discord.Member = None):
-    """Show player profile"""
+async def profile(ctx, member: Optional[discord.Member] = None, window: str = None):
+    """Show player profile, optionally over a time window"""
     member = member or ctx.author
-    # Get basic stats
-    cursor.execute(
-        '''SELECT first_bloods, points FROM users WHERE user_id = ?''',
-        (member.id, ))
-    if not (result := cursor.fetchone()):
-        await ctx.send(f"No data for {member.name}!")
-        return
-    fbs, points = result
-    # Total flags
-    cursor.execute(
-        '''SELECT COUNT(*) FROM solved_challenges WHERE user_id = ?''',
-        (member.id, ))
-    flags = cursor.fetchone()[0]
-    # Rank (by points)
-    cursor.execute(
-        '''SELECT user_id FROM users ORDER BY points DESC''')
-    all_users = [row[0] for row in cursor.fetchall()]
-    rank = all_users.index(str(member.id)) + 1 if str(member.id) in all_users else 'N/A'
-    # Per-category breakdown
-    categories = ['pwn', 'reverse', 'dfir', 'web', 'crypto', 'misc', 'blockchain', 'osint', 'android', 'ppc']
-    cat_counts = {}
-    for cat in categories:
-        cursor.execute(
-            '''SELECT COUNT(*) FROM solved_challenges WHERE user_id = ? AND category = ?''',
-            (member.id, cat))
-        cat_counts[cat] = cursor.fetchone()[0]
-    # Firstblood challenges solved
-    cursor.execute(
-        '''SELECT COUNT(*) FROM solved_challenges WHERE user_id = ? AND first_blood = 1''',
-        (member.id, ))
-    fb_solved = cursor.fetchone()[0]
+    if window is None:
+        stats = await user_stats.get(ctx.guild.id, member.id)
+    elif window := await resolve_window(ctx, window):
+        stats = await rollups.user_stats(ctx.guild.id, member.id, window, scoring_config.get(ctx.guild.id))
+    else:
+        return
+    if not stats:
+        await ctx.send(f"No data for {member.name}!" if window is None else f"No solves by {member.name} in {window.label}.")
+        return
+    points = stats.points
+    flags = stats.flags
+    rank = (stats.rank if window is not None else ranking.rank(ctx.guild.id, member.id)) or 'N/A'
+    fb_solved = stats.first_blood_solves
     # Real CTF participation
-    cursor.execute('''SELECT event_id FROM ctf_participation WHERE user_id = ?''', (str(member.id),))
-    ctf_rows = cursor.fetchall()
-    total_ctfs = len(ctf_rows)
-    ctfs_participated = ', '.join([row[0] for row in ctf_rows]) if ctf_rows else 'N/A'
+    total_ctfs = len(stats.events)
+    ctfs_participated = ', '.join(stats.events) if stats.events else 'N/A'
     # Per-category breakdown as a single field
     all_cats = ['pwn', 'reverse', 'dfir', 'web', 'crypto', 'misc', 'blockchain', 'osint', 'android', 'ppc']
-    all_breakdown = '\n'.join([f"🔹 {cat.capitalize()}: {cat_counts[cat]}" for cat in all_cats])
+    all_breakdown = '\n'.join([f"🔹 {cat.capitalize()}: {stats.categories.get(cat, 0)}" for cat in all_cats])
     # Build embed
     embed = discord.Embed(
-        title=f"🧑‍💻 Player Profile: {member.name}",
+        title=f"🧑‍💻 Player Profile: {member.name}" + (f" ({window.label})" if window is not None else ""),
         color=discord.Color.blue()
     )
     embed.set_thumbnail(url=member.display_avatar.url)
-    embed.add_field(name="🏆 Total CTFs Participated", value=total_ctfs, inline=True)
+    if window is None:
+        embed.add_field(name="🏆 Total CTFs Participated", value=total_ctfs, inline=True)
     embed.add_field(name="💎 Points", value=points, inline=True)
     embed.add_field(name="🏅 Rank", value=f"#{rank}", inline=True)
-    embed.add_field(name="🎯 CTFs Participated", value=ctfs_participated, inline=False)
+    if window is None:
+        embed.add_field(name="🎯 CTFs Participated", value=ctfs_participated, inline=False)
     embed.add_field(name="🛡️ Total Challenges Solved", value=flags, inline=True)
     embed.add_field(name="🩸 Firstblood Challenges Solved", value=fb_solved, inline=True)
     embed.add_field(name="🧩 Challenges Solved by Type", value=all_breakdown, inline=False)
@@ -849,16 +1186,29 @@ async def show_help(ctx):
         "`!add <category> <name> <easy/medium/hard> <1=first blood>` — Record a solved challenge\n"
         "`!unsolve <name>` — Revoke a solved challenge and update your stats\n\n"
         "__**Information:**__\n"
-        "`!solved` — Show solved challenges\n"
-        "`!working` — Active challenges\n"
-        "`!scoreboard` — Leaderboard\n"
-        "`!profile [@user]` — Player stats\n"
+        "`!solved [filters]` — Show solved challenges\n"
+        "`!working [filters]` — Active challenges\n"
+        "`!upcoming [search]` — Browse upcoming CTFs from CTFtime\n"
+        "`!search <words>` — Search challenges and challenge thread discussions\n"
+        "`!scoreboard [size] [window]` — Leaderboard (top 10 by default, up to 25)\n"
+        "`!profile [@user] [window]` — Player stats\n"
+        "`!season` — List seasons\n"
+        "`!scoring` — Show the scoring rules\n"
         "`!categories` — List categories\n"
         "`!help` — Show this guide\n\n"
+        "__**Admin:**__\n"
+        "`!import` — Bulk import solves/participation from an attached CSV or JSONL file\n"
+        "`!export <solves/participation> [csv/jsonl]` — Download a table\n"
+        "`!config [setting] [#channel/ID/none]` — Show or change this server's settings\n"
+        "`!season <name>` — Start a new season today, keeping all history\n"
+        "`!ledger [verify/rebuild/adjust @user <points> [reason]]` — Check or repair point totals\n"
+        "`!scoring [points/bonus/multiplier/decay/reset/rescore]` — Change the scoring rules and rescore every solve\n\n"
         "__**Notes:**__\n"
         "- Categories: misc, web, crypto, reverse, blockchain, dfir, osint, pwn, android, ppc\n"
         "- Difficulties: easy, medium, hard\n"
-        "- Use `1` for first blood, or omit for a regular solve."
+        "- Use `1` for first blood, or omit for a regular solve.\n"
+        "- Listing filters: `category:web` `user:@user` `since:2024-01-01` `until:2024-12-31`\n"
+        "- Windows: `week` `month` `season` `season:<name>` `ctf` (in a CTF channel) `ctf:<CTFtime event ID>`"
     )
     embed = discord.Embed(
         title="📖 Help & Guide",
@@ -872,35 +1222,14 @@ async def show_help(ctx):
 async def unsolve(ctx, challenge_name: str):
     """Revoke a solved challenge for the user and update stats."""
     user = ctx.author
-    # Find the solved challenge for this user
-    cursor.execute(
-        '''SELECT difficulty, first_blood FROM solved_challenges WHERE challenge_name = ? AND user_id = ?''',
-        (challenge_name, user.id))
-    row = cursor.fetchone()
-    if not row:
+    # Remove the solved challenge and take its points back
+    result = await db.revoke_solve(ctx.guild.id, challenge_name, user.id, scoring_config.get(ctx.guild.id))
+    if not result:
         await ctx.send(f"❌ Challenge `{challenge_name}` not found in your solved list.")
         return
-    difficulty, first_blood = row
-    # Calculate points to subtract
-    points = {'easy': 10, 'medium': 25, 'hard': 40}.get(difficulty, 0)
-    if first_blood == 1:
-        points += {'easy': 10, 'medium': 15, 'hard': 20}.get(difficulty, 0)
-    # Remove the solved challenge
-    cursor.execute(
-        '''DELETE FROM solved_challenges WHERE challenge_name = ? AND user_id = ?''',
-        (challenge_name, user.id))
-    # Update user stats
-    cursor.execute(
-        '''SELECT points, first_bloods FROM users WHERE user_id = ?''',
-        (user.id,))
-    user_data = cursor.fetchone()
-    if user_data:
-        new_points = max(0, user_data[0] - points)
-        new_fb = max(0, user_data[1] - (1 if first_blood == 1 else 0))
-        cursor.execute(
-            '''UPDATE users SET points = ?, first_bloods = ? WHERE user_id = ?''',
-            (new_points, new_fb, user.id))
-    conn.commit()
+    ranking.update(ctx.guild.id, user.id, result["points"], result["first_bloods"], flags_delta=-1)
+    user_stats.invalidate(ctx.guild.id, user.id)
+    apply_rescored(ctx.guild.id, result["rescored"])
     await ctx.send(f"✅ Challenge `{challenge_name}` has been revoked from your solved list and your stats updated.")
     await update_scoreboard_message(ctx.guild, debug_ctx=ctx)
 
@@ -928,11 +1257,13 @@ async def simulate_ctf_end(guild, event_id, ctf_name, ctf_channel, role, test_mo
         await asyncio.sleep(10)
     else:
         await asyncio.sleep(30)
-    archive_category = guild.get_channel(CTF_ARCHIVE_CATEGORY_ID)
+    archive_category = get_setting_channel(guild, "ctf_archive_category")
     if archive_category and isinstance(archive_category, discord.CategoryChannel):
-        await ctf_channel.edit(category=archive_category, reason="CTF ended (simulated), archiving channel")
-        await make_channel_readonly(ctf_channel, role)
+        actions.edit_channel(ctf_channel, category=archive_category, reason="CTF ended (simulated), archiving channel")
+        make_channel_readonly(ctf_channel, role)
         await send_ctf_end_message(guild, event_id, ctf_name, role)
+    await delete_ctf_role(guild, event_id)
+    await make_channel_archived_public(ctf_channel)
 
 # --- Patch for test_announce ---
 # Remove send_ctf_start_message and simulate_ctf_end from immediate execution, only trigger on reaction
@@ -941,41 +1272,30 @@ async def simulate_ctf_end(guild, event_id, ctf_name, ctf_channel, role, test_mo
 async def test_announce(ctx):
     """Test command to immediately announce the top 2 weighted CTFs and create their channels."""
     now = datetime.now(pytz.utc)
-    start_ts = int(now.timestamp())
-    finish_ts = int((now + timedelta(days=30)).timestamp())
-    url = f"https://ctftime.org/api/v1/events/?limit=10&start={start_ts}&finish={finish_ts}"
-    resp = requests.get(url)
-    if resp.status_code != 200:
-        await ctx.send("Failed to fetch upcoming CTFs from CTFtime.")
-        return
-    events = resp.json()
-    events = sorted(events, key=lambda e: e.get('start', ''))[:4]
-    top2 = sorted(events, key=lambda e: e.get('weight', 0), reverse=True)[:2]
+    top2 = await pick_upcoming_ctfs(now)
     if not top2:
         await ctx.send("No CTFs to announce for testing.")
         return
-    channel = ctx.guild.get_channel(UPCOMING_CTFS_CHANNEL_ID)
+    channel = get_setting_channel(ctx.guild, "upcoming_ctfs_channel")
     if not channel:
-        await ctx.send(f"Upcoming CTFs channel with ID {UPCOMING_CTFS_CHANNEL_ID} not found.")
+        await ctx.send("Upcoming CTFs channel not found. Set it with `!config upcoming_ctfs_channel #channel`.")
         return
-    mapping = get_ctf_announce_message_ids()
     announced = 0
     for to_post in top2:
         event_id = str(to_post["id"])
-        if event_id in mapping:
+        if ctf_events.is_announced(ctx.guild.id, event_id):
             await ctx.send(f"Event {event_id} already announced, skipping.")
             continue
         embed = await generate_ctf_announcement_embed(to_post, now=now)
         msg = await channel.send(content="@everyone", embed=embed, allowed_mentions=discord.AllowedMentions(everyone=True))
         await msg.add_reaction("🔥")
-        mapping[event_id] = msg.id
-        set_ctf_announce_message_ids(mapping)
+        await ctf_events.update(ctx.guild.id, event_id, title=to_post.get("title"), announce_message_id=msg.id)
 
         # --- Create a text channel for the CTF ---
         guild = channel.guild
         ctf_name = to_post.get("title", "ctf").replace(" ", "-")
         ctf_name = ctf_name[:90]
-        running_category = guild.get_channel(CTF_RUNNING_CATEGORY_ID)
+        running_category = get_setting_channel(guild, "ctf_running_category")
         if running_category and isinstance(running_category, discord.CategoryChannel):
             # Set explicit overwrites for the bot
             overwrites = {
@@ -995,12 +1315,10 @@ async def test_announce(ctx):
                 to_post.get('url', 'N/A'),
                 to_post.get('discord_url') or to_post.get('discord')
             )
-            ctf_channels = get_ctf_channels_mapping()
-            ctf_channels[event_id] = ctf_channel.id
-            set_ctf_channels_mapping(ctf_channels)
+            await ctf_events.update(guild.id, event_id, channel_id=ctf_channel.id)
             await ctx.send(f"Created channel {ctf_channel.mention} for CTF '{ctf_name}'")
             # Create role and set permissions
-            role = await create_ctf_role_and_permissions(guild, ctf_name, event_id, ctf_channel)
+            role = await create_ctf_role_and_permissions(guild, ctf_name, event_id, ctf_channel, INTERACTIVE)
             # Wait a moment to ensure channel is ready
             await asyncio.sleep(1)
             # Try to send start message and catch errors
@@ -1008,20 +1326,11 @@ async def test_announce(ctx):
                 await send_ctf_start_message(guild, event_id, ctf_name, role)
             except Exception as e:
                 await ctx.send(f"Error sending start message: {e}")
-            # Wait 10 seconds, then archive and send end message
-            await asyncio.sleep(10)
-            archive_category = guild.get_channel(CTF_ARCHIVE_CATEGORY_ID)
-            if archive_category and isinstance(archive_category, discord.CategoryChannel):
-                await ctf_channel.edit(category=archive_category, reason="CTF ended (simulated), archiving channel")
-                await make_channel_readonly(ctf_channel, role)
-                try:
-                    await send_ctf_end_message(guild, event_id, ctf_name, role)
-                except Exception as e:
-                    await ctx.send(f"Error sending end message: {e}")
-            await delete_ctf_role(guild, event_id)
-            await make_channel_archived_public(ctf_channel)
+            # Archive after 10 seconds in the background, once this command has replied
+            announcer.fan_out(**{f"simulated end of {event_id}": simulate_ctf_end(
+                guild, event_id, ctf_name, ctf_channel, role, test_mode=True)})
         else:
-            await ctx.send(f"CTF Running category with ID {CTF_RUNNING_CATEGORY_ID} not found or not a category.")
+            await ctx.send("CTF Running category not found or not a category. Set it with `!config ctf_running_category <id>`.")
         announced += 1
     if announced:
         await ctx.send(f"Test announcement complete. {announced} CTF(s) announced and channels created.")
@@ -1029,18 +1338,17 @@ async def test_announce(ctx):
         await ctx.send("No new CTFs were announced (all were already announced).")
 
 async def delete_ctf_role(guild, event_id):
-    ctf_roles = get_ctf_roles_mapping()
-    role_id = ctf_roles.get(event_id)
-    if role_id:
-        role = guild.get_role(role_id)
+    event = ctf_events.get(guild.id, event_id)
+    if event and event.role_id:
+        role = guild.get_role(event.role_id)
         if role:
             try:
-                await role.delete(reason="CTF ended, cleaning up role")
+                await actions.submit(roles_bucket(guild), lambda: role.delete(reason="CTF ended, cleaning up role"),
+                                     label=f"delete role {role.name}")
             except Exception as e:
                 print(f"Error deleting role for event {event_id}: {e}")
         # Remove from mapping
-        del ctf_roles[event_id]
-        set_ctf_roles_mapping(ctf_roles)
+        await ctf_events.update(guild.id, event_id, role_id=None)
 
 def generate_random_password(length=12):
     chars = string.ascii_letters + string.digits + "!@#$%^&*()_+-="
@@ -1060,10 +1368,14 @@ async def set_ctf_channel_description_and_message(ctf_channel, ctf_name, ctf_url
     if ctf_discord:
         desc_lines.append(f"Discord: {ctf_discord}")
     desc = " | ".join(desc_lines)
-    try:
-        await ctf_channel.edit(topic=desc[:1024])
-    except Exception as e:
-        print(f"Error setting channel topic: {e}")
+    # Not awaited, so it can merge with the role overwrites queued right after it
+    actions.edit_channel(ctf_channel, topic=desc[:1024])
+
+def apply_rescored(guild_id, rescored):
+    """Update the in-memory ranking and stats of players whose solves were rescored by decay."""
+    for user_id, (points, first_bloods) in rescored.items():
+        ranking.update(guild_id, user_id, points, first_bloods)
+        user_stats.invalidate(guild_id, user_id)
 
 def get_random_color():
     return discord.Color(random.randint(0, 0xFFFFFF))
@@ -0,0 +1,126 @@
+"""Solve and first-blood images, uploaded once and then linked by URL.
+
+The image files are read into memory once at startup. The first time an
+image is needed it is attached to the message, and the CDN URL Discord
+gives the attachment is saved in ``bot_config``; every later embed just
+points at that URL. Discord signs attachment URLs with an expiry (the
+``ex`` query parameter), so a URL that has expired, or is about to, is
+dropped and the image is uploaded again.
+
+A URL can also stop working before it expires, for example when the
+message holding the upload is deleted. Before a saved URL is reused it is
+checked with a HEAD request, at most once every CHECK_INTERVAL seconds;
+a 403/404 answer, or Discord rejecting the embed, drops the URL and the
+image is uploaded again from the local file.
+"""
+import asyncio
+import io
+import time
+from urllib.parse import parse_qs, urlparse
+
+import aiohttp
+import discord
+
+import db
+import metrics
+
+MEDIA_URLS_KEY = "media_urls"
+EXPIRY_MARGIN = 3600  # Re-upload this many seconds before a URL expires
+CHECK_INTERVAL = 600  # Seconds between checks that a saved URL still serves the image
+
+
+def url_expired(url, now=None):
+    """True if a signed Discord CDN URL expires within EXPIRY_MARGIN seconds."""
+    expires = parse_qs(urlparse(url).query).get("ex")
+    if not expires:
+        return False
+    try:
+        return int(expires[0], 16) - EXPIRY_MARGIN <= (now or time.time())
+    except ValueError:
+        return True
+
+
+class MediaCache:
+    def __init__(self, filenames):
+        self.filenames = list(filenames)
+        self._data = {}
+        self._urls = {}
+        self._checked = {}
+        self._session = None
+        self._locks = {name: asyncio.Lock() for name in self.filenames}
+
+    async def load(self):
+        """Read every image into memory and restore the URLs of earlier uploads."""
+        for name in self.filenames:
+            self._data[name] = await asyncio.to_thread(self._read, name)
+        self._urls = {name: url for name, url in (await db.get_config_json(MEDIA_URLS_KEY)).items()
+                      if name in self._data}
+        self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5))
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @staticmethod
+    def _read(name):
+        with open(name, "rb") as f:
+            return f.read()
+
+    def url(self, name):
+        url = self._urls.get(name)
+        if url and url_expired(url):
+            del self._urls[name]
+            return None
+        return url
+
+    async def _checked_url(self, name):
+        """The saved URL for ``name`` if the CDN still serves it, else None."""
+        url = self.url(name)
+        if not url or self._session is None:
+            return url
+        if name in self._checked and time.monotonic() - self._checked[name] < CHECK_INTERVAL:
+            return url
+        try:
+            async with self._session.head(url) as resp:
+                gone = resp.status in (403, 404, 410)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            gone = False  # Our own network trouble says nothing about the upload
+        if gone:
+            await self._evict(name, url)
+            return None
+        self._checked[name] = time.monotonic()
+        return url
+
+    async def _evict(self, name, url):
+        if self._urls.get(name) == url:
+            del self._urls[name]
+            self._checked.pop(name, None)
+            await db.set_config_json(MEDIA_URLS_KEY, self._urls)
+
+    async def send(self, destination, embed, name, **kwargs):
+        """Send ``embed`` with image ``name``, uploading the image only if no working URL is known."""
+        if url := await self._checked_url(name):
+            metrics.CACHE_LOOKUPS.inc(cache="media", result="hit")
+            embed.set_image(url=url)
+            try:
+                return await destination.send(embed=embed, **kwargs)
+            except discord.HTTPException as e:
+                if e.status != 400:
+                    raise
+                print(f"Discord rejected the saved URL for {name}, uploading it again: {e}")
+                await self._evict(name, url)
+        async with self._locks[name]:
+            if url := self.url(name):  # Another send uploaded it meanwhile
+                metrics.CACHE_LOOKUPS.inc(cache="media", result="hit")
+                embed.set_image(url=url)
+                return await destination.send(embed=embed, **kwargs)
+            metrics.CACHE_LOOKUPS.inc(cache="media", result="miss")
+            embed.set_image(url=f"attachment://{name}")
+            message = await destination.send(
+                embed=embed, file=discord.File(io.BytesIO(self._data[name]), filename=name), **kwargs)
+            if message.attachments:
+                self._urls[name] = message.attachments[0].url
+                self._checked[name] = time.monotonic()
+                await db.set_config_json(MEDIA_URLS_KEY, self._urls)
+            return message
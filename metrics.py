@@ -0,0 +1,219 @@
+"""Process metrics in the Prometheus text format, served on a local HTTP port.
+
+The metrics are module-level objects that any module updates directly:
+command and job latency, SQLite statement counts and time, CTFtime
+request latency and errors, Discord REST latency and 429s, cache lookups
+and event-loop lag. ``MetricsServer`` serves them at ``/metrics`` and
+samples the event-loop lag while it runs.
+
+SQLite statements run on aiosqlite's worker threads, so every metric
+guards its values with a lock.
+"""
+import asyncio
+import contextlib
+import functools
+import logging
+import threading
+import time
+
+from aiohttp import web
+from discord.ext import tasks
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key, value):
+        return [f"{self.name}{_format_labels(self.labels, key)} {value}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def total(self):
+        """Sum over every label combination."""
+        with self._lock:
+            return sum(self._values.values())
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    @contextlib.contextmanager
+    def timer(self, **labels):
+        """Observe the duration of the block; a ``status`` label becomes 'error' if it raises."""
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            yield
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            if "status" in self.labels:
+                labels["status"] = status
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self, key, value):
+        counts, total, count = value
+        lines = [f"{self.name}_bucket{_format_labels(self.labels, key, [('le', bound)])} {bucket_count}"
+                 for bound, bucket_count in zip(self.buckets, counts)]
+        lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, [('le', '+Inf')])} {count}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total}")
+        lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+COMMAND_LATENCY = Histogram("lain_command_duration_seconds", "Time spent handling a command", ("command", "status"))
+JOB_LATENCY = Histogram("lain_job_duration_seconds", "Time spent in a background loop or scheduled job", ("job", "status"))
+DB_QUERIES = Counter("lain_db_queries_total", "SQLite statements executed", ("statement",))
+DB_QUERY_SECONDS = Counter("lain_db_query_seconds_total", "Time spent executing SQLite statements", ("statement",))
+CTFTIME_LATENCY = Histogram("lain_ctftime_request_duration_seconds", "CTFtime HTTP request latency", ("endpoint", "status"))
+CTFTIME_ERRORS = Counter("lain_ctftime_errors_total", "Failed CTFtime requests", ("endpoint", "reason"))
+DISCORD_LATENCY = Histogram("lain_discord_action_duration_seconds", "Queued Discord REST action latency", ("bucket", "status"))
+DISCORD_RATE_LIMITS = Counter("lain_discord_rate_limits_total", "HTTP 429 responses from Discord", ("scope",))
+CACHE_LOOKUPS = Counter("lain_cache_lookups_total", "Cache lookups by outcome", ("cache", "result"))
+LOOP_LAG = Gauge("lain_event_loop_lag_seconds", "Latest delay of a timer on the event loop")
+LOOP_LAG_HISTOGRAM = Histogram("lain_event_loop_lag_distribution_seconds", "Event loop timer delays",
+                               buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+
+
+def render():
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+@functools.lru_cache(maxsize=512)
+def statement_label(sql):
+    """Collapse whitespace so each statement in db.py maps to one label."""
+    return " ".join(sql.split())[:160]
+
+
+def observe_query(sql, seconds):
+    label = statement_label(sql)
+    DB_QUERIES.inc(statement=label)
+    DB_QUERY_SECONDS.inc(seconds, statement=label)
+
+
+def timed_job(func):
+    """Wrap an async job so every run is recorded under its function name."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        with JOB_LATENCY.timer(job=func.__name__):
+            return await func(*args, **kwargs)
+    return wrapper
+
+
+def timed_loop(**kwargs):
+    """``tasks.loop`` whose every iteration is recorded by ``timed_job``."""
+    return lambda func: tasks.loop(**kwargs)(timed_job(func))
+
+
+class _RateLimitLogHandler(logging.Handler):
+    """Counts the warnings discord.py logs for every 429 it receives."""
+
+    def emit(self, record):
+        message = str(record.msg)
+        if message.startswith("We are being rate limited"):
+            DISCORD_RATE_LIMITS.inc(scope="route")
+        elif message.startswith("Global rate limit has been hit"):
+            DISCORD_RATE_LIMITS.inc(scope="global")
+
+
+class MetricsServer:
+    def __init__(self, host="127.0.0.1", port=9108, lag_interval=1.0):
+        self.host = host
+        self.port = port
+        self.lag_interval = lag_interval
+        self._runner = None
+        self._lag_task = None
+        self._log_handler = _RateLimitLogHandler(logging.WARNING)
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logging.getLogger("discord.http").addHandler(self._log_handler)
+        self._lag_task = asyncio.create_task(self._sample_lag())
+        print(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+    async def close(self):
+        logging.getLogger("discord.http").removeHandler(self._log_handler)
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            self._lag_task = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle(self, request):
+        return web.Response(text=render(), content_type="text/plain")
+
+    async def _sample_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.lag_interval)
+            lag = max(0.0, loop.time() - start - self.lag_interval)
+            LOOP_LAG.set(lag)
+            LOOP_LAG_HISTOGRAM.observe(lag)
@@ -0,0 +1,407 @@
+"""Versioned schema migrations for ctf_team.db.
+
+The schema version lives in ``PRAGMA user_version``. ``migrate`` applies
+every migration newer than the file's version, each in its own
+transaction together with the version bump, so an existing database is
+upgraded in place and a half-applied migration never sticks.
+
+Migrations are append-only: never edit one that has shipped, add a new
+one instead. A step is either an SQL string or an ``async def step(conn)``.
+"""
+import json
+
+
+async def _import_ctf_event_blobs(conn):
+    """Move the JSON mappings kept in bot_config into ctf_events rows."""
+    blobs = {}
+    for key in ("ctf_announce_message_ids", "ctf_channels", "ctf_roles"):
+        async with conn.execute("SELECT value FROM bot_config WHERE key = ?", (key,)) as cur:
+            row = await cur.fetchone()
+        blobs[key] = json.loads(row[0]) if row and row[0] else {}
+    event_ids = set().union(*blobs.values())
+    await conn.executemany(
+        '''INSERT OR IGNORE INTO ctf_events (event_id, announce_message_id, channel_id, role_id)
+           VALUES (?, ?, ?, ?)''',
+        [(str(event_id),
+          blobs["ctf_announce_message_ids"].get(event_id),
+          blobs["ctf_channels"].get(event_id),
+          blobs["ctf_roles"].get(event_id))
+         for event_id in event_ids])
+    await conn.execute(
+        '''DELETE FROM bot_config WHERE key IN ('ctf_announce_message_ids', 'ctf_channels', 'ctf_roles')''')
+
+
+# Rollup key of a solved_challenges row; days are the dates of the stored (local) timestamps
+def _rollup_key(row):
+    return (f"{row}.guild_id, COALESCE(date({row}.timestamp), '0000-00-00'), {row}.user_id, "
+            f"COALESCE({row}.category, ''), COALESCE({row}.difficulty, '')")
+
+
+def _rollup_add(row):
+    return f'''INSERT INTO solve_rollups (guild_id, day, user_id, category, difficulty, solves, first_bloods)
+        VALUES ({_rollup_key(row)}, 1, {row}.first_blood = 1)
+        ON CONFLICT (guild_id, day, user_id, category, difficulty) DO UPDATE
+        SET solves = solves + 1, first_bloods = first_bloods + excluded.first_bloods;'''
+
+
+def _rollup_remove(row):
+    match = f"(guild_id, day, user_id, category, difficulty) = ({_rollup_key(row)})"
+    return f'''UPDATE solve_rollups SET solves = solves - 1, first_bloods = first_bloods - ({row}.first_blood = 1)
+        WHERE {match};
+        DELETE FROM solve_rollups WHERE {match} AND solves <= 0;'''
+
+
+# search_index rowids are the source row's rowid * 4 + the source kind, so each source row maps to exactly one index row
+_SEARCH_COLUMNS = "rowid, challenge_name, category, body, guild_id, user_id, thread_id, created_at"
+_SEARCH_SOURCES = {
+    "solved_challenges": (0, lambda row: f"{row}.challenge_name, {row}.category, NULL, {row}.guild_id, "
+                                         f"{row}.user_id, NULL, {row}.timestamp"),
+    "active_challenges": (1, lambda row: f"{row}.challenge_name, {row}.category, NULL, {row}.guild_id, "
+                                         f"{row}.user_id, CAST({row}.thread_id AS INTEGER), {row}.timestamp"),
+    "thread_messages": (2, lambda row: f"NULL, NULL, {row}.content, {row}.guild_id, "
+                                       f"{row}.author_id, {row}.thread_id, {row}.created_at"),
+}
+
+
+def _search_triggers(table):
+    kind, values = _SEARCH_SOURCES[table]
+    add = f"INSERT INTO search_index ({_SEARCH_COLUMNS}) VALUES (NEW.rowid * 4 + {kind}, {values('NEW')});"
+    remove = f"DELETE FROM search_index WHERE rowid = OLD.rowid * 4 + {kind};"
+    return [
+        f"CREATE TRIGGER {table}_search_insert AFTER INSERT ON {table} BEGIN {add} END",
+        f"CREATE TRIGGER {table}_search_delete AFTER DELETE ON {table} BEGIN {remove} END",
+        f"CREATE TRIGGER {table}_search_update AFTER UPDATE ON {table} BEGIN {remove} {add} END",
+    ]
+
+
+async def backfill_search_index(conn):
+    """Index every row of the search sources."""
+    await conn.execute('''DELETE FROM search_index''')
+    for table, (kind, values) in _SEARCH_SOURCES.items():
+        await conn.execute(
+            f'''INSERT INTO search_index ({_SEARCH_COLUMNS}) SELECT t.rowid * 4 + {kind}, {values("t")} FROM {table} t''')
+
+
+async def backfill_solve_rollups(conn):
+    """Rebuild solve_rollups from every row of solved_challenges."""
+    await conn.execute('''DELETE FROM solve_rollups''')
+    await conn.execute(
+        f'''INSERT INTO solve_rollups (guild_id, day, user_id, category, difficulty, solves, first_bloods)
+            SELECT {_rollup_key("sc")}, COUNT(*), SUM(sc.first_blood = 1)
+              FROM solved_challenges sc GROUP BY 1, 2, 3, 4, 5''')
+
+
+MIGRATIONS = [
+    (1, "baseline schema", [
+        '''CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY,
+            first_bloods INTEGER DEFAULT 0,
+            points INTEGER DEFAULT 0)''',
+        '''CREATE TABLE IF NOT EXISTS solved_challenges (
+            challenge_name TEXT,
+            category TEXT,
+            difficulty TEXT,
+            first_blood INTEGER DEFAULT 0,
+            user_id TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id))''',
+        '''CREATE TABLE IF NOT EXISTS active_challenges (
+            challenge_name TEXT,
+            category TEXT,
+            user_id TEXT,
+            thread_id TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''',
+        '''CREATE TABLE IF NOT EXISTS bot_config (
+            key TEXT PRIMARY KEY,
+            value TEXT)''',
+        '''CREATE TABLE IF NOT EXISTS ctf_participation (
+            user_id TEXT,
+            event_id TEXT,
+            PRIMARY KEY (user_id, event_id))''',
+        '''CREATE TABLE IF NOT EXISTS http_cache (
+            key TEXT PRIMARY KEY,
+            body TEXT NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            fetched_at REAL,
+            expires_at REAL,
+            stale_until REAL,
+            last_access REAL,
+            size INTEGER)''',
+        '''CREATE INDEX IF NOT EXISTS idx_http_cache_last_access ON http_cache (last_access)''',
+        '''CREATE TABLE IF NOT EXISTS scheduled_jobs (
+            job_id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            run_at REAL NOT NULL,
+            payload TEXT,
+            attempts INTEGER DEFAULT 0)''',
+        '''CREATE INDEX IF NOT EXISTS idx_scheduled_jobs_run_at ON scheduled_jobs (run_at)''',
+        '''CREATE TABLE IF NOT EXISTS user_names (
+            user_id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            updated_at REAL)''',
+        '''INSERT OR IGNORE INTO bot_config (key, value) VALUES ('data_generation', '0')''',
+    ]),
+    (2, "solve indexes and uniqueness constraints", [
+        # Older databases may hold duplicate rows; keep the first solve and the latest thread
+        '''DELETE FROM solved_challenges WHERE rowid NOT IN (
+            SELECT MIN(rowid) FROM solved_challenges GROUP BY user_id, challenge_name)''',
+        '''DELETE FROM active_challenges WHERE rowid NOT IN (
+            SELECT MAX(rowid) FROM active_challenges GROUP BY user_id, challenge_name)''',
+        '''CREATE UNIQUE INDEX IF NOT EXISTS idx_solved_user_challenge
+            ON solved_challenges (user_id, challenge_name)''',
+        '''CREATE INDEX IF NOT EXISTS idx_solved_user_category
+            ON solved_challenges (user_id, category, first_blood)''',
+        '''CREATE INDEX IF NOT EXISTS idx_solved_timestamp ON solved_challenges (timestamp)''',
+        '''CREATE UNIQUE INDEX IF NOT EXISTS idx_active_user_challenge
+            ON active_challenges (user_id, challenge_name)''',
+        '''CREATE INDEX IF NOT EXISTS idx_active_thread ON active_challenges (thread_id)''',
+        '''CREATE INDEX IF NOT EXISTS idx_participation_event ON ctf_participation (event_id)''',
+    ]),
+    (3, "normalized ctf_events table", [
+        '''CREATE TABLE IF NOT EXISTS ctf_events (
+            event_id TEXT PRIMARY KEY,
+            title TEXT,
+            announce_message_id INTEGER,
+            channel_id INTEGER,
+            role_id INTEGER)''',
+        '''CREATE UNIQUE INDEX IF NOT EXISTS idx_ctf_events_message ON ctf_events (announce_message_id)''',
+        '''CREATE INDEX IF NOT EXISTS idx_ctf_events_channel ON ctf_events (channel_id)''',
+        '''CREATE INDEX IF NOT EXISTS idx_ctf_events_role ON ctf_events (role_id)''',
+        _import_ctf_event_blobs,
+    ]),
+    (4, "keyset pagination index for active challenges", [
+        '''CREATE INDEX IF NOT EXISTS idx_active_timestamp ON active_challenges (timestamp)''',
+    ]),
+    # Rows that predate guild scoping get guild_id '0' until db.claim_legacy_guild assigns them
+    (5, "guild-scoped rows and per-guild configuration", [
+        '''CREATE TABLE guild_config (
+            guild_id TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT,
+            PRIMARY KEY (guild_id, key))''',
+        '''CREATE TABLE users_new (
+            guild_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            first_bloods INTEGER DEFAULT 0,
+            points INTEGER DEFAULT 0,
+            PRIMARY KEY (guild_id, user_id))''',
+        '''INSERT INTO users_new (guild_id, user_id, first_bloods, points)
+            SELECT '0', user_id, first_bloods, points FROM users''',
+        '''DROP TABLE users''',
+        '''ALTER TABLE users_new RENAME TO users''',
+        '''ALTER TABLE solved_challenges ADD COLUMN guild_id TEXT NOT NULL DEFAULT '0' ''',
+        '''DROP INDEX idx_solved_user_challenge''',
+        '''DROP INDEX idx_solved_user_category''',
+        '''DROP INDEX idx_solved_timestamp''',
+        '''CREATE UNIQUE INDEX idx_solved_user_challenge
+            ON solved_challenges (guild_id, user_id, challenge_name)''',
+        '''CREATE INDEX idx_solved_user_category
+            ON solved_challenges (guild_id, user_id, category, first_blood)''',
+        '''CREATE INDEX idx_solved_timestamp ON solved_challenges (guild_id, timestamp)''',
+        '''ALTER TABLE active_challenges ADD COLUMN guild_id TEXT NOT NULL DEFAULT '0' ''',
+        '''DROP INDEX idx_active_user_challenge''',
+        '''DROP INDEX idx_active_timestamp''',
+        '''CREATE UNIQUE INDEX idx_active_user_challenge
+            ON active_challenges (guild_id, user_id, challenge_name)''',
+        '''CREATE INDEX idx_active_timestamp ON active_challenges (guild_id, timestamp)''',
+        '''CREATE TABLE ctf_participation_new (
+            guild_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            event_id TEXT NOT NULL,
+            PRIMARY KEY (guild_id, user_id, event_id))''',
+        '''INSERT INTO ctf_participation_new (guild_id, user_id, event_id)
+            SELECT '0', user_id, event_id FROM ctf_participation''',
+        '''DROP TABLE ctf_participation''',
+        '''ALTER TABLE ctf_participation_new RENAME TO ctf_participation''',
+        '''CREATE INDEX idx_participation_event ON ctf_participation (guild_id, event_id)''',
+        '''CREATE TABLE ctf_events_new (
+            guild_id TEXT NOT NULL,
+            event_id TEXT NOT NULL,
+            title TEXT,
+            announce_message_id INTEGER,
+            channel_id INTEGER,
+            role_id INTEGER,
+            PRIMARY KEY (guild_id, event_id))''',
+        '''INSERT INTO ctf_events_new (guild_id, event_id, title, announce_message_id, channel_id, role_id)
+            SELECT '0', event_id, title, announce_message_id, channel_id, role_id FROM ctf_events''',
+        '''DROP TABLE ctf_events''',
+        '''ALTER TABLE ctf_events_new RENAME TO ctf_events''',
+        '''CREATE UNIQUE INDEX idx_ctf_events_message ON ctf_events (announce_message_id)''',
+        '''CREATE INDEX idx_ctf_events_channel ON ctf_events (channel_id)''',
+        '''CREATE INDEX idx_ctf_events_role ON ctf_events (role_id)''',
+    ]),
+    (6, "local mirror of CTFtime events", [
+        '''CREATE TABLE ctftime_events (
+            event_id INTEGER PRIMARY KEY,
+            title TEXT NOT NULL,
+            start REAL NOT NULL,
+            finish REAL,
+            weight REAL DEFAULT 0,
+            format TEXT,
+            url TEXT,
+            ctftime_url TEXT,
+            data TEXT NOT NULL,
+            synced_at REAL)''',
+        '''CREATE INDEX idx_ctftime_events_start ON ctftime_events (start, event_id)''',
+        '''CREATE TABLE ctftime_sync_windows (
+            window_start REAL PRIMARY KEY,
+            synced_at REAL NOT NULL)''',
+    ]),
+    # Triggers keep the rollups in step with every write to solved_challenges
+    (7, "daily solve rollups and seasons", [
+        '''CREATE TABLE solve_rollups (
+            guild_id TEXT NOT NULL,
+            day TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            category TEXT NOT NULL,
+            difficulty TEXT NOT NULL,
+            solves INTEGER NOT NULL,
+            first_bloods INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, day, user_id, category, difficulty)) WITHOUT ROWID''',
+        '''CREATE INDEX idx_solve_rollups_user ON solve_rollups (guild_id, user_id, day)''',
+        f'''CREATE TRIGGER solve_rollups_insert AFTER INSERT ON solved_challenges BEGIN
+            {_rollup_add("NEW")}
+        END''',
+        f'''CREATE TRIGGER solve_rollups_delete AFTER DELETE ON solved_challenges BEGIN
+            {_rollup_remove("OLD")}
+        END''',
+        f'''CREATE TRIGGER solve_rollups_update
+            AFTER UPDATE OF guild_id, user_id, category, difficulty, first_blood, timestamp ON solved_challenges BEGIN
+            {_rollup_remove("OLD")}
+            {_rollup_add("NEW")}
+        END''',
+        backfill_solve_rollups,
+        '''CREATE TABLE seasons (
+            guild_id TEXT NOT NULL,
+            name TEXT NOT NULL,
+            start_day TEXT NOT NULL,
+            PRIMARY KEY (guild_id, name))''',
+        '''CREATE UNIQUE INDEX idx_seasons_start ON seasons (guild_id, start_day)''',
+    ]),
+    # Each user's totals become one opening 'adjust' event. Points are taken as they are; first bloods and
+    # flags are recounted from solved_challenges, which also corrects first_bloods counters that drifted.
+    (8, "append-only solve ledger and aggregate snapshots", [
+        '''CREATE TABLE solve_ledger (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            challenge_name TEXT,
+            points INTEGER NOT NULL DEFAULT 0,
+            first_bloods INTEGER NOT NULL DEFAULT 0,
+            flags INTEGER NOT NULL DEFAULT 0,
+            note TEXT,
+            created_at REAL NOT NULL)''',
+        '''CREATE INDEX idx_solve_ledger_challenge ON solve_ledger (guild_id, user_id, challenge_name)''',
+        '''CREATE TABLE ledger_snapshots (
+            seq INTEGER NOT NULL,
+            guild_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            points INTEGER NOT NULL,
+            first_bloods INTEGER NOT NULL,
+            flags INTEGER NOT NULL,
+            PRIMARY KEY (seq, guild_id, user_id)) WITHOUT ROWID''',
+        '''UPDATE users SET first_bloods = (
+            SELECT COUNT(*) FROM solved_challenges sc
+             WHERE sc.guild_id = users.guild_id AND sc.user_id = users.user_id AND sc.first_blood = 1)''',
+        '''INSERT INTO solve_ledger (guild_id, user_id, kind, points, first_bloods, flags, note, created_at)
+            SELECT u.guild_id, u.user_id, 'adjust', u.points, u.first_bloods,
+                   (SELECT COUNT(*) FROM solved_challenges sc WHERE sc.guild_id = u.guild_id AND sc.user_id = u.user_id),
+                   'opening balance', CAST(strftime('%s', 'now') AS REAL)
+              FROM users u ORDER BY u.guild_id, u.user_id''',
+        '''UPDATE bot_config SET value = CAST(value AS INTEGER) + 1 WHERE key = 'data_generation' ''',
+    ]),
+    # Rescoring compares each solve with what the ledger credited for it, so every solve needs its own
+    # events. Solves covered only by an opening balance get a 'solve' event at the old fixed points, and
+    # their owners an 'adjust' that takes the same amounts back out of the opening balance.
+    (9, "per-solve ledger events and challenge index", [
+        '''CREATE INDEX idx_solved_challenge ON solved_challenges (guild_id, challenge_name)''',
+        '''CREATE TEMP TABLE uncredited AS
+            WITH scores (difficulty, base, bonus) AS (
+                VALUES ('easy', 10, 10), ('medium', 25, 15), ('hard', 40, 20))
+            SELECT sc.guild_id, sc.user_id, sc.challenge_name, sc.first_blood = 1 AS first_blood,
+                   COALESCE(s.base, 0) + CASE WHEN sc.first_blood = 1 THEN COALESCE(s.bonus, 0) ELSE 0 END AS points
+              FROM solved_challenges sc LEFT JOIN scores s ON s.difficulty = sc.difficulty
+             WHERE NOT EXISTS (
+                SELECT 1 FROM solve_ledger l
+                 WHERE l.guild_id = sc.guild_id AND l.user_id = sc.user_id AND l.challenge_name = sc.challenge_name)''',
+        '''INSERT INTO solve_ledger (guild_id, user_id, kind, points, first_bloods, flags, note, created_at)
+            SELECT guild_id, user_id, 'adjust', -SUM(points), -SUM(first_blood), -COUNT(*),
+                   'opening balance per solve', CAST(strftime('%s', 'now') AS REAL)
+              FROM uncredited GROUP BY guild_id, user_id ORDER BY guild_id, user_id''',
+        '''INSERT INTO solve_ledger
+                (guild_id, user_id, kind, challenge_name, points, first_bloods, flags, note, created_at)
+            SELECT guild_id, user_id, 'solve', challenge_name, points, first_blood, 1,
+                   'opening balance per solve', CAST(strftime('%s', 'now') AS REAL)
+              FROM uncredited ORDER BY guild_id, user_id, challenge_name''',
+        '''DROP TABLE uncredited''',
+    ]),
+    # Threads outlive their active_challenges row, which !add deletes, so they get their own table.
+    # Triggers keep the full-text index in step with solves, active challenges and thread messages.
+    (10, "full-text search over challenges and thread discussions", [
+        '''CREATE TABLE challenge_threads (
+            thread_id INTEGER PRIMARY KEY,
+            guild_id TEXT NOT NULL,
+            challenge_name TEXT NOT NULL,
+            category TEXT,
+            user_id TEXT,
+            created_at TEXT)''',
+        '''CREATE INDEX idx_challenge_threads_challenge ON challenge_threads (guild_id, challenge_name)''',
+        '''INSERT OR IGNORE INTO challenge_threads (thread_id, guild_id, challenge_name, category, user_id, created_at)
+            SELECT CAST(thread_id AS INTEGER), guild_id, challenge_name, category, user_id, timestamp
+              FROM active_challenges WHERE thread_id IS NOT NULL''',
+        '''CREATE TABLE thread_messages (
+            seq INTEGER PRIMARY KEY,
+            message_id INTEGER NOT NULL UNIQUE,
+            thread_id INTEGER NOT NULL,
+            guild_id TEXT NOT NULL,
+            author_id TEXT,
+            content TEXT NOT NULL,
+            created_at TEXT)''',
+        '''CREATE INDEX idx_thread_messages_thread ON thread_messages (thread_id)''',
+        '''CREATE VIRTUAL TABLE search_index USING fts5(
+            challenge_name, category, body,
+            guild_id UNINDEXED, user_id UNINDEXED, thread_id UNINDEXED, created_at UNINDEXED,
+            tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')''',
+        *_search_triggers("solved_challenges"),
+        *_search_triggers("active_challenges"),
+        *_search_triggers("thread_messages"),
+        backfill_search_index,
+    ]),
+    # Resets now have their own event kind, which marks where per-challenge ledger sums start again
+    (11, "reset ledger events", [
+        '''UPDATE solve_ledger SET kind = 'reset', note = NULL
+            WHERE kind = 'adjust' AND note = 'reset' AND challenge_name IS NULL''',
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+async def get_version(conn):
+    async with conn.execute("PRAGMA user_version") as cur:
+        return (await cur.fetchone())[0]
+
+
+async def migrate(conn):
+    """Apply pending migrations on ``conn``; returns the resulting schema version."""
+    current = await get_version(conn)
+    for version, description, steps in MIGRATIONS:
+        if version <= current:
+            continue
+        await conn.execute("BEGIN IMMEDIATE")
+        try:
+            for step in steps:
+                if isinstance(step, str):
+                    await conn.execute(step)
+                else:
+                    await step(conn)
+            await conn.execute(f"PRAGMA user_version = {version}")
+        except BaseException:
+            await conn.rollback()
+            raise
+        await conn.commit()
+        print(f"Applied database migration {version}: {description}")
+        current = version
+    return current
@@ -0,0 +1,115 @@
+"""Coalesced, debounced scoreboard message updates.
+
+Changes only mark the scoreboard dirty; at most one edit is sent per
+``window`` seconds, however many solves land in between. The scoreboard
+``Message`` is kept instead of being re-fetched by ID for every edit, and
+an edit is skipped entirely when the rendered embed is identical to the
+one last published.
+
+There is one publisher per guild. A digest of the last published embed is
+kept in the guild's configuration, so after a restart an unchanged
+scoreboard costs a single fetch, which also confirms the message still
+exists; a message deleted while the bot was offline is sent again.
+"""
+import asyncio
+import hashlib
+import json
+import time
+
+import discord
+
+import db
+
+SCOREBOARD_DIGEST_KEY = "scoreboard_digest"
+
+
+class ScoreboardPublisher:
+    def __init__(self, guild_id, render, window=5.0):
+        self.guild_id = guild_id
+        self.render = render  # async () -> discord.Embed
+        self.window = window
+        self._loaded = False
+        self._channel = None
+        self._message = None
+        self._last_digest = None
+        self._last_publish = float("-inf")
+        self._dirty = False
+        self._task = None
+        self._lock = asyncio.Lock()
+
+    async def load(self):
+        """Restore the digest of the scoreboard published before the last restart."""
+        self._last_digest = await db.get_guild_config(self.guild_id, SCOREBOARD_DIGEST_KEY)
+        self._loaded = True
+
+    async def reset(self):
+        """Forget the published message, e.g. after the scoreboard channel changed."""
+        async with self._lock:
+            self._message = None
+            self._last_digest = None
+            self._loaded = True
+            await db.set_scoreboard_message_id(self.guild_id, None)
+            await db.set_guild_config(self.guild_id, SCOREBOARD_DIGEST_KEY, None)
+
+    async def drain(self):
+        """Wait for a scheduled publish to finish."""
+        while self._task is not None and not self._task.done():
+            await self._task
+
+    def mark_dirty(self, channel):
+        """Schedule a publish to ``channel`` within the next window."""
+        self._channel = channel
+        self._dirty = True
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        while self._dirty:
+            delay = self._last_publish + self.window - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                await self.publish()
+            except Exception as e:
+                print(f"Failed to update scoreboard message: {e}")
+                self._last_publish = time.monotonic()
+
+    async def _get_message(self, channel):
+        if self._message is not None and self._message.channel.id == channel.id:
+            return self._message
+        message_id = await db.get_scoreboard_message_id(self.guild_id)
+        if message_id:
+            try:
+                return await channel.fetch_message(message_id)
+            except discord.HTTPException as e:
+                print(f"Failed to fetch scoreboard message: {e}")
+        return None
+
+    async def publish(self, channel=None):
+        """Render and publish now, unless nothing changed since the last publish."""
+        async with self._lock:
+            channel = channel or self._channel
+            self._channel = channel
+            self._dirty = False
+            if not self._loaded:
+                await self.load()
+            embed = await self.render()
+            digest = hashlib.sha256(json.dumps(embed.to_dict(), sort_keys=True).encode()).hexdigest()
+            # The digest only describes a message we hold; until then fetch it to check it still exists
+            message = await self._get_message(channel)
+            self._message = message
+            if message is not None and digest == self._last_digest:
+                return
+            if message is not None:
+                try:
+                    message = await message.edit(content=None, embed=embed)
+                except discord.NotFound:
+                    message = None
+            if message is None:
+                # If not found, create a new scoreboard message and store its ID
+                message = await channel.send(embed=embed)
+                await db.set_scoreboard_message_id(self.guild_id, message.id)
+            self._message = message
+            self._last_digest = digest
+            await db.set_guild_config(self.guild_id, SCOREBOARD_DIGEST_KEY, digest)
+            self._last_publish = time.monotonic()
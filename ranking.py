@@ -0,0 +1,91 @@
+"""In-memory ranking index for the scoreboard and player ranks.
+
+Each guild's players are kept in a list sorted by (-points, user_id), so
+the top N is a slice and a player's rank is a binary search. The index is
+updated in place after every add/unsolve/reset instead of re-running the
+scoreboard aggregation, and it also carries each player's flag count.
+
+On shutdown the index is saved to ``bot_config`` together with the data
+generation it reflects. Every solve mutation bumps that generation in the
+same transaction, so a snapshot is only reused when nothing changed since
+it was written; otherwise the index is rebuilt with one grouped query.
+"""
+import bisect
+
+import db
+
+RANKING_SNAPSHOT_KEY = "ranking_snapshot"
+
+
+class RankingIndex:
+    def __init__(self):
+        self._order = {}  # guild_id -> sorted [(-points, user_id)]
+        self._stats = {}  # guild_id -> {user_id: [points, first_bloods, flags]}
+
+    def __len__(self):
+        return sum(len(order) for order in self._order.values())
+
+    def guilds(self):
+        return list(self._order)
+
+    def _load_rows(self, rows):
+        self._order.clear()
+        self._stats.clear()
+        for guild_id, uid, points, fbs, flags in rows:
+            self._stats.setdefault(str(guild_id), {})[str(uid)] = [points, fbs, flags]
+        for guild_id, stats in self._stats.items():
+            self._order[guild_id] = sorted((-s[0], uid) for uid, s in stats.items())
+
+    async def load(self):
+        """Restore from the snapshot if it is current, otherwise rebuild from the database."""
+        snapshot = await db.get_config_json(RANKING_SNAPSHOT_KEY)
+        if snapshot and snapshot.get("generation") == await db.get_data_generation():
+            rows = snapshot["rows"]
+            if all(len(row) == 5 for row in rows):  # Snapshots from before guild scoping are rebuilt
+                self._load_rows(rows)
+                return
+        await self.rebuild()
+
+    async def rebuild(self):
+        self._load_rows(await db.get_ranking_rows())
+        await self.save()
+
+    async def save(self):
+        await db.save_generation_snapshot(RANKING_SNAPSHOT_KEY, [
+            [guild_id, uid, *s] for guild_id, stats in self._stats.items() for uid, s in stats.items()])
+
+    def update(self, guild_id, user_id, points, first_bloods, flags_delta=0):
+        """Record a player's new totals after a solve was added or revoked."""
+        guild_id, user_id = str(guild_id), str(user_id)
+        order = self._order.setdefault(guild_id, [])
+        stats = self._stats.setdefault(guild_id, {}).get(user_id)
+        if stats is None:
+            stats = self._stats[guild_id][user_id] = [points, first_bloods, 0]
+        else:
+            del order[bisect.bisect_left(order, (-stats[0], user_id))]
+            stats[0] = points
+            stats[1] = first_bloods
+        stats[2] = max(0, stats[2] + flags_delta)
+        bisect.insort(order, (-points, user_id))
+
+    def clear(self, guild_id):
+        self._order.pop(str(guild_id), None)
+        self._stats.pop(str(guild_id), None)
+
+    def rank(self, guild_id, user_id):
+        """1-based rank of a player in a guild, or None if they have no entry."""
+        guild_id, user_id = str(guild_id), str(user_id)
+        stats = self._stats.get(guild_id, {}).get(user_id)
+        if stats is None:
+            return None
+        return bisect.bisect_left(self._order[guild_id], (-stats[0], user_id)) + 1
+
+    def top(self, guild_id, n=10):
+        """Return a guild's top ``n`` rows as (user_id, flags, points, first_bloods)."""
+        guild_id = str(guild_id)
+        stats = self._stats.get(guild_id, {})
+        rows = []
+        for _, uid in self._order.get(guild_id, [])[:n]:
+            points, fbs, flags = stats[uid]
+            rows.append((uid, flags, points, fbs))
+        return rows
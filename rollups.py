@@ -0,0 +1,75 @@
+"""Time windows for the windowed !scoreboard and !profile.
+
+Solves are counted per (guild, day, user, category, difficulty) in the
+``solve_rollups`` table, which triggers on ``solved_challenges`` keep
+current and migration 7 backfilled from existing rows. A window is a
+range of days, so a windowed leaderboard reads the rollup rows of those
+days instead of the raw solve history, and points are applied from the
+guild's scoring rules at query time, without decay.
+
+Days are the dates of the stored solve timestamps, which are local time.
+"""
+from datetime import date, timedelta
+
+import db
+from ctftime import CTFtimeError
+from stats import UserStats
+
+WINDOW_HELP = "Windows: `week`, `month`, `season`, `season:<name>`, `ctf` (in a CTF channel), `ctf:<CTFtime event ID>`"
+FIRST_DAY = "0000-00-00"
+LAST_DAY = "9999-12-31"
+
+
+class Window:
+    __slots__ = ("label", "since", "until")
+
+    def __init__(self, label, since=FIRST_DAY, until=LAST_DAY):
+        self.label = label
+        self.since = since  # First day included, YYYY-MM-DD
+        self.until = until  # First day excluded
+
+
+async def resolve_window(guild_id, text, mirror, today=None, channel_event_id=None):
+    """Turn a window argument into a Window; raises ValueError with a user-facing message."""
+    today = today or date.today()
+    kind, _, arg = text.partition(":")
+    kind = kind.lower()
+    if kind == "week":
+        return Window("This week", (today - timedelta(days=today.weekday())).isoformat())
+    if kind == "month":
+        return Window("This month", today.replace(day=1).isoformat())
+    if kind == "season":
+        seasons = await db.get_seasons(guild_id)
+        if arg:
+            matches = [i for i, (name, _) in enumerate(seasons) if name.lower() == arg.lower()]
+        else:
+            matches = [i for i, (_, start) in enumerate(seasons) if start <= today.isoformat()][-1:]
+        if not matches:
+            raise ValueError(f"No season `{arg}`." if arg else "No season has started yet, an admin can start one with `!season <name>`.")
+        i = matches[0]
+        name, start = seasons[i]
+        return Window(f"Season {name}", start, seasons[i + 1][1] if i + 1 < len(seasons) else LAST_DAY)
+    if kind == "ctf":
+        event_id = arg or channel_event_id
+        if not event_id or not str(event_id).isdigit():
+            raise ValueError("Give a CTFtime event ID (`ctf:<id>`) or use `ctf` in a CTF channel.")
+        try:
+            event = await mirror.get(event_id)
+        except CTFtimeError as e:
+            raise ValueError(f"Could not look up CTF {event_id}: {e}")
+        start = db.ctftime_timestamp(event.get("start"))
+        finish = db.ctftime_timestamp(event.get("finish")) or start
+        return Window(event.get("title", f"CTF {event_id}"), date.fromtimestamp(start).isoformat(),
+                      (date.fromtimestamp(finish) + timedelta(days=1)).isoformat())
+    raise ValueError(f"Unknown window `{text}`. {WINDOW_HELP}")
+
+
+async def leaderboard(guild_id, window, scoring, limit):
+    """(user_id, flags, points, first_bloods) of the top players in the window."""
+    return await db.get_window_leaderboard(guild_id, window.since, window.until, scoring, limit)
+
+
+async def user_stats(guild_id, user_id, window, scoring):
+    """A user's UserStats over the window (with ``rank`` set), or None if they solved nothing in it."""
+    return UserStats.from_rows(
+        await db.get_window_user_stats_rows(guild_id, user_id, window.since, window.until, scoring))
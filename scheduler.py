@@ -0,0 +1,119 @@
+"""Durable deadline scheduler.
+
+Jobs are rows in the ``scheduled_jobs`` table and entries in an in-memory
+heap keyed by ``run_at`` (a UTC epoch timestamp). The runner sleeps until
+the earliest deadline instead of polling, so an idle bot does no work no
+matter how many jobs are pending. Jobs whose deadline passed while the bot
+was down run as soon as the scheduler starts.
+
+A handler is ``async def handler(job_id, payload)``. Returning a timestamp
+reschedules the job for that time; returning None completes it. A handler
+that raises is retried after ``RETRY_DELAY`` seconds, up to ``MAX_ATTEMPTS``.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+
+import db
+import metrics
+
+RETRY_DELAY = 300
+MAX_ATTEMPTS = 10
+MAX_SLEEP = 3600  # Re-check the wall clock at least hourly
+
+
+class DeadlineScheduler:
+    def __init__(self):
+        self._handlers = {}
+        self._jobs = {}  # job_id -> (run_at, kind, payload, attempts)
+        self._heap = []
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def register(self, kind, handler):
+        self._handlers[kind] = handler
+
+    def __contains__(self, job_id):
+        return job_id in self._jobs
+
+    def _push(self, job_id, run_at, kind, payload, attempts):
+        self._jobs[job_id] = (run_at, kind, payload, attempts)
+        heapq.heappush(self._heap, (run_at, next(self._counter), job_id))
+        self._wakeup.set()
+
+    async def start(self):
+        if self._task is not None:
+            return
+        for job_id, kind, run_at, payload, attempts in await db.get_jobs():
+            self._push(job_id, run_at, kind, payload, attempts)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def schedule(self, job_id, kind, run_at, payload=None, attempts=0):
+        """Create or move a job; ``run_at`` is a UTC epoch timestamp."""
+        await db.save_job(job_id, kind, run_at, payload, attempts)
+        self._push(job_id, run_at, kind, payload, attempts)
+
+    async def cancel(self, job_id):
+        self._jobs.pop(job_id, None)
+        await db.delete_job(job_id)
+
+    def _next_due(self):
+        # Drop heap entries for jobs that were cancelled or rescheduled since
+        while self._heap:
+            run_at, _, job_id = self._heap[0]
+            job = self._jobs.get(job_id)
+            if job and job[0] == run_at:
+                return run_at, job_id
+            heapq.heappop(self._heap)
+        return None
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            due = self._next_due()
+            delay = MAX_SLEEP if due is None else due[0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), min(delay, MAX_SLEEP))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._heap)
+            await self._execute(due[1])
+
+    async def _execute(self, job_id):
+        run_at, kind, payload, attempts = self._jobs[job_id]
+        handler = self._handlers.get(kind)
+        if handler is None:
+            print(f"No handler registered for job {job_id} ({kind}), dropping it.")
+            await self.cancel(job_id)
+            return
+        try:
+            with metrics.JOB_LATENCY.timer(job=kind):
+                next_run = await handler(job_id, payload)
+        except Exception as e:
+            attempts += 1
+            if attempts >= MAX_ATTEMPTS:
+                print(f"Job {job_id} failed {attempts} times, giving up: {e}")
+                await self.cancel(job_id)
+            else:
+                print(f"Job {job_id} failed (attempt {attempts}), retrying in {RETRY_DELAY}s: {e}")
+                await self.schedule(job_id, kind, time.time() + RETRY_DELAY, payload, attempts)
+            return
+        if self._jobs.get(job_id, (None,))[0] != run_at:
+            return  # The handler moved or cancelled its own job
+        if next_run is None:
+            await self.cancel(job_id)
+        else:
+            await self.schedule(job_id, kind, next_run, payload)
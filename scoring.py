@@ -0,0 +1,146 @@
+"""Per-guild scoring rules: point tables, first-blood bonuses, category multipliers and dynamic decay.
+
+A solve is worth ``(value + bonus) * multiplier``, rounded half up, where
+``value`` is the difficulty's base points, ``bonus`` the difficulty's
+first-blood bonus for first bloods, and ``multiplier`` the category's
+factor (1 by default). With decay enabled, ``value`` falls quadratically
+with the number of players who solved the challenge, CTFd style, from the
+base points for the first solver down to ``minimum`` times the base once
+``solves`` more players solved it; every solver of a challenge gets its
+current value.
+
+``points`` computes a solve's value in Python, and ``solve_points_sql``
+builds the same expression in SQL for set-based rescoring, with the same
+floating-point operations in the same order so both always agree.
+Windowed leaderboards (``rollup_points_sql``) apply the tables and
+multipliers but not decay, since the rollups do not record solve counts.
+"""
+import json
+
+import db
+
+SCORING_CONFIG_KEY = "scoring"
+DEFAULT_POINTS = {"easy": 10, "medium": 25, "hard": 40}
+DEFAULT_BONUS = {"easy": 10, "medium": 15, "hard": 20}
+
+
+def _round(value):
+    """Round half up, like ``CAST(value + 0.5 AS INTEGER)`` for the non-negative values used here."""
+    return int(value + 0.5)
+
+
+class ScoringRules:
+    def __init__(self, points=None, bonus=None, multipliers=None, decay_minimum=None, decay_solves=None):
+        self.points_table = dict(DEFAULT_POINTS if points is None else points)
+        self.bonus_table = dict(DEFAULT_BONUS if bonus is None else bonus)
+        self.multipliers = dict(multipliers or {})
+        self.decay_minimum = decay_minimum  # Fraction of the base points a challenge decays to
+        self.decay_solves = decay_solves  # Extra solvers after which the minimum is reached; None disables decay
+
+    @property
+    def dynamic(self):
+        """Whether a solve changes the value of the other solves of the same challenge."""
+        return self.decay_solves is not None
+
+    def value(self, base, solvers):
+        if not self.dynamic:
+            return base
+        low = base * self.decay_minimum
+        return max(low, base + (low - base) * (solvers - 1) * (solvers - 1) / (self.decay_solves * self.decay_solves))
+
+    def points(self, difficulty, category, first_blood, solvers=1):
+        """Points of one solve when ``solvers`` players (including this one) solved the challenge."""
+        bonus = self.bonus_table.get(difficulty, 0) if first_blood == 1 else 0
+        value = self.value(self.points_table.get(difficulty, 0), solvers)
+        return _round((value + bonus) * self.multipliers.get(category, 1.0))
+
+    def ctes(self):
+        """``scores`` and ``multipliers`` CTEs for the expressions below, with their parameters."""
+        difficulties = sorted(self.points_table.keys() | self.bonus_table.keys())
+        scores = [(d, self.points_table.get(d, 0), self.bonus_table.get(d, 0)) for d in difficulties] or [(None, 0, 0)]
+        multipliers = sorted(self.multipliers.items()) or [(None, 1.0)]
+        sql = (f"scores (difficulty, base, bonus) AS (VALUES {', '.join('(?, ?, ?)' for _ in scores)}), "
+               f"multipliers (category, factor) AS (VALUES {', '.join('(?, ?)' for _ in multipliers)})")
+        return sql, [v for row in scores for v in row] + [v for row in multipliers for v in row]
+
+    def solve_points_sql(self, solve, solvers):
+        """SQL for the points of row ``solve`` with ``solvers`` solvers; joins ``scores s`` and ``multipliers m``."""
+        base = "COALESCE(s.base, 0)"
+        if self.dynamic:
+            low = f"{base} * {float(self.decay_minimum)!r}"
+            square = float(self.decay_solves * self.decay_solves)
+            value = f"MAX({low}, {base} + ({low} - {base}) * ({solvers} - 1) * ({solvers} - 1) / {square!r})"
+        else:
+            value = base
+        return (f"CAST(({value} + CASE WHEN {solve}.first_blood = 1 THEN COALESCE(s.bonus, 0) ELSE 0 END)"
+                f" * COALESCE(m.factor, 1.0) + 0.5 AS INTEGER)")
+
+    def rollup_points_sql(self, rollup):
+        """SQL for the undecayed points of a ``solve_rollups`` row; joins ``scores s`` and ``multipliers m``."""
+        factor = "COALESCE(m.factor, 1.0)"
+        return (f"(({rollup}.solves - {rollup}.first_bloods) * CAST(COALESCE(s.base, 0) * {factor} + 0.5 AS INTEGER)"
+                f" + {rollup}.first_bloods * CAST((COALESCE(s.base, 0) + COALESCE(s.bonus, 0)) * {factor} + 0.5 AS INTEGER))")
+
+    def copy(self):
+        return ScoringRules.from_json(self.to_json())
+
+    def to_json(self):
+        decay = {"minimum": self.decay_minimum, "solves": self.decay_solves} if self.dynamic else None
+        return json.dumps({"points": self.points_table, "first_blood_bonus": self.bonus_table,
+                           "multipliers": self.multipliers, "decay": decay})
+
+    @classmethod
+    def from_json(cls, text):
+        data = json.loads(text)
+        decay = data.get("decay") or {}
+        return cls(data.get("points"), data.get("first_blood_bonus"), data.get("multipliers"),
+                   decay.get("minimum"), decay.get("solves"))
+
+    def describe(self):
+        lines = [
+            "Points: " + ", ".join(f"{d} {p}" for d, p in self.points_table.items()),
+            "First-blood bonus: " + ", ".join(f"{d} +{p}" for d, p in self.bonus_table.items()),
+            "Multipliers: " + (", ".join(f"{c} ×{f:g}" for c, f in sorted(self.multipliers.items())) or "none"),
+        ]
+        if self.dynamic:
+            lines.append(f"Decay: down to {self.decay_minimum:.0%} of the base after {self.decay_solves} more solvers")
+        else:
+            lines.append("Decay: off")
+        return lines
+
+
+def parse_table(args, allowed, cast=int):
+    """Parse ``key=value`` arguments into a dict; raises ValueError with a user-facing message."""
+    table = {}
+    for arg in args:
+        key, sep, value = arg.partition("=")
+        key = key.lower()
+        if not sep or key not in allowed:
+            raise ValueError(f"Expected `name=value` with a name from: {', '.join(allowed)}")
+        try:
+            table[key] = cast(value)
+        except ValueError:
+            raise ValueError(f"`{value}` is not a valid number.")
+        if not 0 <= table[key] < float("inf"):
+            raise ValueError("Values must be finite and not negative.")
+    return table
+
+
+class ScoringConfig:
+    """Scoring rules of every guild, cached over their ``guild_config`` rows."""
+
+    def __init__(self):
+        self._rules = {}  # guild_id -> ScoringRules
+
+    async def load(self):
+        self._rules.clear()
+        for guild_id, key, value in await db.get_guild_config_rows():
+            if key == SCORING_CONFIG_KEY and value:
+                self._rules[str(guild_id)] = ScoringRules.from_json(value)
+
+    def get(self, guild_id):
+        return self._rules.get(str(guild_id)) or ScoringRules()
+
+    async def set(self, guild_id, rules):
+        await db.set_guild_config(guild_id, SCORING_CONFIG_KEY, rules.to_json())
+        self._rules[str(guild_id)] = rules
@@ -0,0 +1,77 @@
+"""Per-user statistics aggregate shared by !profile and !add.
+
+``UserStats`` is built from a single grouped query and cached per
+(guild, user).
+Anything that changes a user's solves or participation must call
+``StatsCache.invalidate`` (or ``clear`` after a reset).
+"""
+from collections import OrderedDict
+
+import db
+import metrics
+
+
+class UserStats:
+    __slots__ = ("points", "first_bloods", "flags", "first_blood_solves", "categories", "events", "rank")
+
+    def __init__(self, points, first_bloods, categories, first_blood_solves, events, rank=None):
+        self.points = points
+        self.first_bloods = first_bloods
+        self.categories = categories  # category -> solves
+        self.flags = sum(categories.values())
+        self.first_blood_solves = first_blood_solves
+        self.events = events
+        self.rank = rank  # Only set for windowed stats; all-time ranks come from the RankingIndex
+
+    @classmethod
+    def from_rows(cls, rows):
+        user = None
+        categories = {}
+        first_blood_solves = 0
+        events = []
+        rank = None
+        for kind, name, a, b in rows:
+            if kind == "user":
+                user = (a, b)
+            elif kind == "rank":
+                rank = a
+            elif kind == "category":
+                categories[name] = a
+                first_blood_solves += b or 0
+            else:
+                events.append(name)
+        if user is None:
+            return None
+        return cls(user[0], user[1], categories, first_blood_solves, events, rank)
+
+
+class StatsCache:
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._cache = OrderedDict()
+
+    async def get(self, guild_id, user_id):
+        """Return a user's UserStats in a guild, or None if they have never solved anything there."""
+        key = (str(guild_id), str(user_id))
+        if key in self._cache:
+            metrics.CACHE_LOOKUPS.inc(cache="user_stats", result="hit")
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        metrics.CACHE_LOOKUPS.inc(cache="user_stats", result="miss")
+        stats = UserStats.from_rows(await db.get_user_stats_rows(*key))
+        if stats is not None:
+            self._cache[key] = stats
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return stats
+
+    def invalidate(self, guild_id, user_id):
+        self._cache.pop((str(guild_id), str(user_id)), None)
+
+    def clear(self, guild_id=None):
+        """Drop every cached entry, or only those of one guild."""
+        if guild_id is None:
+            self._cache.clear()
+            return
+        for key in [key for key in self._cache if key[0] == str(guild_id)]:
+            del self._cache[key]
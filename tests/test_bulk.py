@@ -0,0 +1,41 @@
+import unittest
+
+import bulk
+
+CATEGORIES = ["crypto", "web"]
+DIFFICULTIES = ["easy", "medium", "hard"]
+
+
+def parse(text, filename="solves.csv"):
+    return bulk.parse_import(filename, text.encode(), CATEGORIES, DIFFICULTIES)
+
+
+class ParseImportTest(unittest.TestCase):
+    def test_invalid_timestamps_are_reported(self):
+        solves, _, errors = parse(
+            "challenge_name,category,difficulty,user_id,timestamp\n"
+            "rsa,crypto,easy,123,yesterday\n"
+            "aes,crypto,easy,123,0\n"
+            "xss,web,hard,123,2024-03-01T10:00:00\n")
+        self.assertEqual(errors, ["line 2: invalid timestamp `yesterday`, expected ISO 8601",
+                                  "line 3: invalid timestamp `0`, expected ISO 8601"])
+        self.assertEqual([solve[-1] for solve in solves], ["2024-03-01 10:00:00"])
+
+    def test_timestamps_are_normalized_to_the_stored_form(self):
+        solves, _, errors = parse(
+            '{"challenge_name": "rsa", "category": "crypto", "difficulty": "easy", "user_id": "1", '
+            '"timestamp": "2024-03-01"}\n', "solves.jsonl")
+        self.assertEqual(errors, [])
+        self.assertEqual(solves[0][-1], "2024-03-01 00:00:00")
+
+    def test_fractional_seconds_are_dropped(self):
+        solves, _, errors = parse(
+            "challenge_name,category,difficulty,user_id,timestamp\n"
+            "rsa,crypto,easy,1,2024-03-01T10:00:00.123456\n")
+        self.assertEqual(errors, [])
+        self.assertEqual(solves[0][-1], "2024-03-01 10:00:00")
+
+    def test_missing_timestamp_defaults_to_now(self):
+        solves, _, errors = parse("challenge_name,category,difficulty,user_id\nrsa,crypto,easy,1\n")
+        self.assertEqual(errors, [])
+        self.assertRegex(solves[0][-1], r"^\d{4}-\d\d-\d\d \d\d:\d\d:\d\d")
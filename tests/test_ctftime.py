@@ -0,0 +1,92 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+import db
+from ctftime import CircuitBreaker, CTFtimeClient, ResponseCache
+
+
+class BrokenSession:
+    closed = False
+
+    def get(self, url, **kwargs):
+        raise RuntimeError("unexpected")
+
+
+class HangingSession:
+    closed = False
+
+    def get(self, url, **kwargs):
+        return self
+
+    async def __aenter__(self):
+        await asyncio.sleep(3600)
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class SlowSession:
+    closed = False
+    status = 200
+    headers = {}
+
+    def __init__(self):
+        self.gets = 0
+
+    def get(self, url, **kwargs):
+        self.gets += 1
+        return self
+
+    async def __aenter__(self):
+        await asyncio.sleep(0.05)
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def json(self, content_type=None):
+        return {"id": 1}
+
+
+def half_open_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    return breaker
+
+
+class CircuitBreakerTest(unittest.IsolatedAsyncioTestCase):
+    async def test_unexpected_error_in_trial_frees_the_trial(self):
+        client = CTFtimeClient(breaker=half_open_breaker(), retries=0)
+        client._session = BrokenSession()
+        with self.assertRaises(RuntimeError):
+            await client._fetch("events/")
+        self.assertTrue(client.breaker.allow())
+
+    async def test_cancelled_trial_frees_the_trial(self):
+        client = CTFtimeClient(breaker=half_open_breaker(), retries=0)
+        client._session = HangingSession()
+        task = asyncio.create_task(client._fetch("events/"))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertTrue(client.breaker.allow())
+
+
+class ResponseCacheTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        await db.init(os.path.join(self.tmp.name, "test.db"))
+
+    async def asyncTearDown(self):
+        await db.close()
+        self.tmp.cleanup()
+
+    async def test_concurrent_misses_share_one_request(self):
+        client = CTFtimeClient(cache=ResponseCache())
+        client._session = SlowSession()
+        results = await asyncio.gather(*(client.get_team(1) for _ in range(10)))
+        self.assertEqual(results, [{"id": 1}] * 10)
+        self.assertEqual(client._session.gets, 1)
@@ -0,0 +1,88 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import db
+import ledger
+from scoring import ScoringRules
+
+GUILD = "1"
+USER = "2"
+
+
+class LedgerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        await db.init(os.path.join(self.tmp.name, "test.db"))
+
+    async def asyncTearDown(self):
+        await db.close()
+        self.tmp.cleanup()
+
+    async def solve(self, name, difficulty="hard", first_blood=0, user=USER, rules=None):
+        return await db.record_solve(GUILD, name, "crypto", difficulty, first_blood, user,
+                                     rules or ScoringRules(), "2026-01-01 10:00:00")
+
+    async def test_unsolve_after_reset_takes_back_only_the_new_solve(self):
+        await self.solve("rsa", first_blood=1)
+        await db.reset_scoreboard(GUILD)
+        await self.solve("rsa")
+        await self.solve("aes", difficulty="easy")
+        result = await db.revoke_solve(GUILD, "rsa", USER, ScoringRules())
+        self.assertEqual(result["points"], 10)
+        self.assertEqual(result["first_bloods"], 0)
+        self.assertTrue((await ledger.verify(GUILD)).ok)
+
+    async def test_reset_of_a_zero_total_still_restarts_challenge_sums(self):
+        await self.solve("rsa")
+        await db.adjust_points(GUILD, USER, -40, "penalty")
+        await db.reset_scoreboard(GUILD)
+        await self.solve("rsa")
+        result = await db.revoke_solve(GUILD, "rsa", USER, ScoringRules())
+        self.assertEqual(result["points"], 0)
+
+    async def test_rescore_after_reset_compares_with_the_new_credit(self):
+        await self.solve("rsa", difficulty="easy")
+        await db.reset_scoreboard(GUILD)
+        await self.solve("rsa", difficulty="easy")
+        self.assertEqual(await db.rescore(GUILD, ScoringRules(points={"easy": 20})), 1)
+        points, = await db.fetchone("SELECT points FROM users WHERE guild_id = ? AND user_id = ?", (GUILD, USER))
+        self.assertEqual(points, 20)
+        self.assertTrue((await ledger.verify(GUILD)).ok)
+
+    async def test_decay_after_reset_rescores_every_solver(self):
+        rules = ScoringRules(decay_minimum=0.5, decay_solves=1)
+        await self.solve("rsa", rules=rules)
+        await db.reset_scoreboard(GUILD)
+        await self.solve("rsa", rules=rules)
+        result = await self.solve("rsa", user="3", rules=rules)
+        self.assertEqual(result["points"], 20)
+        self.assertEqual(result["rescored"], {USER: (20, 0)})
+
+    async def test_verify_and_rebuild_only_touch_one_guild(self):
+        await self.solve("rsa")
+        await db.record_solve("9", "rsa", "crypto", "hard", 0, USER, ScoringRules(), "2026-01-01 10:00:00")
+        await db.execute("UPDATE users SET points = 1")
+        report = await ledger.verify(GUILD)
+        self.assertEqual({m[0] for m in report.mismatches}, {GUILD})
+        self.assertEqual(await ledger.rebuild(GUILD), 1)
+        self.assertTrue((await ledger.verify(GUILD)).ok)
+        self.assertFalse((await ledger.verify("9")).ok)
+
+    async def test_first_in_category_is_decided_with_the_solve(self):
+        self.assertTrue((await self.solve("rsa"))["first_in_category"])
+        self.assertFalse((await self.solve("aes"))["first_in_category"])
+        await db.revoke_solve(GUILD, "rsa", USER, ScoringRules())
+        await db.revoke_solve(GUILD, "aes", USER, ScoringRules())
+        self.assertTrue((await self.solve("aes"))["first_in_category"])
+
+    async def test_rescore_in_batches_counts_each_player_once(self):
+        await self.solve("rsa", difficulty="easy")
+        await self.solve("aes", difficulty="easy")
+        await self.solve("rsa", difficulty="easy", user="3")
+        with mock.patch.object(db, "RESCORE_BATCH_SIZE", 1):
+            self.assertEqual(await db.rescore(GUILD, ScoringRules(points={"easy": 20})), 2)
+        points = dict(await db.fetchall("SELECT user_id, points FROM users WHERE guild_id = ?", (GUILD,)))
+        self.assertEqual(points, {USER: 40, "3": 20})
+        self.assertTrue((await ledger.verify(GUILD)).ok)
@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+
+import discord
+
+import db
+from media import MEDIA_URLS_KEY, MediaCache
+
+URL = "https://cdn.discordapp.com/attachments/1/2/solved.webp"
+
+
+class Response:
+    def __init__(self, status):
+        self.status = status
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class Session:
+    def __init__(self, status):
+        self.status = status
+
+    def head(self, url):
+        return Response(self.status)
+
+
+class Attachment:
+    url = "https://cdn.discordapp.com/attachments/1/3/solved.webp"
+
+
+class Message:
+    attachments = [Attachment()]
+
+
+class Channel:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, **kwargs):
+        self.sent.append(kwargs)
+        return Message()
+
+
+class MediaCacheTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        await db.init(os.path.join(self.tmp.name, "test.db"))
+        self.media = MediaCache(["solved.webp"])
+        self.media._data["solved.webp"] = b"image"
+        self.media._urls["solved.webp"] = URL
+
+    async def asyncTearDown(self):
+        await db.close()
+        self.tmp.cleanup()
+
+    async def test_working_url_is_reused(self):
+        self.media._session = Session(200)
+        channel = Channel()
+        await self.media.send(channel, discord.Embed(), "solved.webp")
+        self.assertNotIn("file", channel.sent[0])
+        self.assertEqual(channel.sent[0]["embed"].image.url, URL)
+
+    async def test_deleted_upload_is_sent_again_from_the_local_file(self):
+        self.media._session = Session(404)
+        channel = Channel()
+        await self.media.send(channel, discord.Embed(), "solved.webp")
+        self.assertIn("file", channel.sent[0])
+        self.assertEqual(await db.get_config_json(MEDIA_URLS_KEY), {"solved.webp": Attachment.url})
@@ -0,0 +1,74 @@
+import os
+import tempfile
+import unittest
+
+import discord
+
+import db
+from publisher import ScoreboardPublisher
+
+GUILD = 1
+
+
+class Response:
+    status = 404
+    reason = "Not Found"
+
+
+class Message:
+    def __init__(self, channel, message_id):
+        self.channel = channel
+        self.id = message_id
+
+    async def edit(self, **kwargs):
+        self.channel.edits += 1
+        return self
+
+
+class Channel:
+    id = 10
+
+    def __init__(self):
+        self.messages = {}
+        self.sends = self.edits = self.fetches = 0
+
+    async def fetch_message(self, message_id):
+        self.fetches += 1
+        if message_id not in self.messages:
+            raise discord.NotFound(Response(), "Unknown Message")
+        return self.messages[message_id]
+
+    async def send(self, **kwargs):
+        self.sends += 1
+        message = Message(self, 100 + self.sends)
+        self.messages[message.id] = message
+        return message
+
+
+async def render():
+    return discord.Embed(title="Scoreboard", description="alice 10")
+
+
+class PublisherTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        await db.init(os.path.join(self.tmp.name, "test.db"))
+
+    async def asyncTearDown(self):
+        await db.close()
+        self.tmp.cleanup()
+
+    async def test_restart_recreates_a_deleted_message_with_unchanged_scores(self):
+        channel = Channel()
+        await ScoreboardPublisher(GUILD, render).publish(channel)
+        channel.messages.clear()  # Deleted while the bot was offline
+        await ScoreboardPublisher(GUILD, render).publish(channel)
+        self.assertEqual(channel.sends, 2)
+
+    async def test_restart_with_unchanged_scores_only_fetches(self):
+        channel = Channel()
+        await ScoreboardPublisher(GUILD, render).publish(channel)
+        publisher = ScoreboardPublisher(GUILD, render)
+        await publisher.publish(channel)
+        await publisher.publish(channel)
+        self.assertEqual((channel.sends, channel.edits, channel.fetches), (1, 0, 1))
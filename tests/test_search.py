@@ -0,0 +1,35 @@
+import os
+import tempfile
+import unittest
+
+import db
+import fulltext
+from scoring import ScoringRules
+
+GUILD = "1"
+
+
+class SearchTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        await db.init(os.path.join(self.tmp.name, "test.db"))
+
+    async def asyncTearDown(self):
+        await db.close()
+        self.tmp.cleanup()
+
+    async def solve(self, name, user="2"):
+        await db.record_solve(GUILD, name, "crypto", "easy", 0, user, ScoringRules(), "2026-01-01 10:00:00")
+
+    async def test_pages_do_not_shift_when_the_index_changes(self):
+        for i in range(6):
+            await self.solve(f"rsa{i}")
+        results = fulltext.SearchResults(GUILD, fulltext.match_query("rsa"))
+        first = await results.page(None, 3)
+        for i in range(6):
+            await self.solve(f"rsa longer name {i}", user="3")
+        await db.revoke_solve(GUILD, first[0][3], "2", ScoringRules())
+        second = await results.page(first[-1][:2], 3)
+        names = [row[3] for row in first + second]
+        self.assertEqual(sorted(names), [f"rsa{i}" for i in range(6)])
+        self.assertEqual([row[3] for row in await results.page(None, 3)], names[1:4])